@@ -1,16 +1,24 @@
 # -*- coding: utf-8 -*-
 
 import os
+import shutil
+import calendar
+import tempfile
+import multiprocessing
+import numpy as np
 import xmltodict
 from OLP.Readers.ReaderTools import UniPrinter
 from OLP.Readers.CMSBReaders import CMSBReader
-from OLP.Readers.LoanFilter import getFilter
+from OLP.Readers.LoanFilter import getFilter, FilterEngine
 # from OLP.Readers.FeatureBuilder import FeatureBuilder
 # from OLP.Readers.ProdContactCounter import ProdContactCounter
 # from OLP.Readers.TransCounter import TransCounter
 # from OLP.Readers.LabelReader import LabelReader
 from OLP.core.samples import Sample, Samples
 from OLP.Readers.SamplesBuilder import SamplesBuilder
+from OLP.Readers.Pipeline import Pipeline
+from OLP.Readers.TransCounter import StreamTransCounter
+from OLP.Readers.ProdContactCounter import StreamProdContactCounter
 from OLP.core.models import get_classifier
 from OLP.core.metrics import get_metric
 import config as cf
@@ -24,16 +32,77 @@ def filterLoans(filterNames, fieldName2Index, loans, custNum2ProtolNums):
         filterNames (list): 过滤器名称列表
         fieldName2Index (dict): 贷款协议表字段索引
         loans (dict): 贷款协议表数据
+        custNum2ProtolNums (dict): 客户号对应的协议号，原地修改
 
     Returns:
         dict: 过滤后的贷款协议表数据
     '''
-    filters = [getFilter(filterName) for filterName in filterNames]
-    for filter_ in filters:
-        fieldName2Index, loans, custNum2ProtolNums = filter_.filter(fieldName2Index, loans, custNum2ProtolNums)
+    fieldName2Index, loans, custNum2ProtolNums = FilterEngine.fromNames(filterNames).filter(fieldName2Index, loans, custNum2ProtolNums)
     return loans
 
 
+def monthEnd(month):
+    '''
+    月份的最后一天
+
+    Args:
+        month (str): 月份，格式为'年-月'
+
+    Returns:
+        str: 日期，格式为'年/月/日'
+    '''
+    year, month = [int(item) for item in month.split('-')]
+    return '%d/%d/%d' % (year, month, calendar.monthrange(year, month)[1])
+
+
+def nextMonths(month, n):
+    '''
+    某月份之后的n个月份
+
+    Args:
+        month (str): 月份，格式为'年-月'
+        n (int): 月份数
+
+    Returns:
+        list: 月份列表，格式同month
+    '''
+    year, month = [int(item) for item in month.split('-')]
+    ordinals = [year * 12 + month - 1 + i for i in range(1, n + 1)]
+    return ['%d-%d' % (ordinal // 12, ordinal % 12 + 1) for ordinal in ordinals]
+
+
+def countTranss(reader, filenames, fieldNames, statDate):
+    '''
+    逐批读取交易流水文件并流式统计交易流水特征，不构建整张交易流水表
+
+    Args:
+        reader (CMSBReader): 读表器
+        filenames (list): 交易流水文件名列表
+        fieldNames (list): 需要读取的字段名
+        statDate (str): 统计日期
+
+    Returns:
+        tuple: 交易流水特征，格式同TransCounter.countProp的结果
+    '''
+    return StreamTransCounter(statDate).updateBatches(reader.iterTranss(filenames, fieldNames=fieldNames)).countProp()
+
+
+def countProds(reader, filenames, fieldNames, statDate):
+    '''
+    逐批读取产品签约文件并流式统计产品签约特征，不构建整张产品签约表
+
+    Args:
+        reader (CMSBReader): 读表器
+        filenames (list): 产品签约文件名列表
+        fieldNames (list): 需要读取的字段名
+        statDate (str): 统计日期
+
+    Returns:
+        dict: 产品签约特征，格式同ProdContactCounter.countProdContact的结果
+    '''
+    return StreamProdContactCounter(statDate).updateBatches(reader.iterProds(filenames, fieldNames=fieldNames)).countProdContact()
+
+
 def gen_samples(x_indexes, cust_num_protol_nums, feats, labels):
     '''
     将原有数据记录转为Samples格式
@@ -163,57 +232,235 @@ def gen_metrics(samples, filename):
             outfile.write('%s\n' % ret)
 
 
+def addSideStages(pipeline, reader, side, labelHorizons):
+    '''
+    将一侧(训练或测试)样本的生成流程加入pipeline
+
+    Args:
+        pipeline (Pipeline): 流程
+        reader (CMSBReader): 读表器
+        side (tuple): (阶段名前缀, 特征贷款协议文件名列表, 交易流水文件名列表, 产品签约文件名列表, 标签贷款协议文件名列表, 统计日期)
+        labelHorizons (list): 标签期限(月数)列表，为None时只生成一个标签
+
+    Returns:
+        str: 样本所在的阶段名
+    '''
+    prefix, loanFilenames, transFilenames, prodFilenames, labelLoanFilenames, statDate = side
+    return SamplesBuilder.addStages(pipeline, prefix, reader, loanFilenames, transFilenames, prodFilenames, labelLoanFilenames,
+                                    cf.filterNames, statDate, cf.vectorizedCount, labelHorizons, cf.streamTransCount,
+                                    cf.streamProdCount)
+
+
+def saveSampleArrays(samples, dirname, labelHorizons=None):
+    '''
+    将样本保存为.npy数组：特征矩阵、标签(多个标签期限时每列一个期限)、客户号、协议号及特征名
+
+    Args:
+        samples (Samples): 样本，labelHorizons给出时为{期限: Samples}，各期限的特征相同
+        dirname (str): 保存目录
+        labelHorizons (list): 标签期限(月数)列表
+    '''
+    horizonSamples = [samples[horizon] for horizon in labelHorizons] if labelHorizons else [samples]
+    samples = horizonSamples[0]
+    x_indexes = samples.get_x_indexes()
+    protol_nums = [sample.get_protol_nums() for sample in samples]
+    np.save(os.path.join(dirname, 'X.npy'), np.array(samples.get_Xs(), dtype=np.float64).reshape(len(samples), len(x_indexes)))
+    np.save(os.path.join(dirname, 'ys.npy'), np.array([horizon.get_ys() for horizon in horizonSamples], dtype=np.int64).T)
+    np.save(os.path.join(dirname, 'custNums.npy'), np.array([sample.get_cust_num() for sample in samples], dtype=str))
+    np.save(os.path.join(dirname, 'protolNums.npy'), np.array([protol_num for nums in protol_nums for protol_num in nums], dtype=str))
+    np.save(os.path.join(dirname, 'protolCounts.npy'), np.array([len(nums) for nums in protol_nums], dtype=np.int64))
+    np.save(os.path.join(dirname, 'xNames.npy'), np.array(sorted(x_indexes, key=x_indexes.get), dtype=str))
+
+
+def loadSampleArrays(dirname, labelHorizons=None):
+    '''
+    读取saveSampleArrays保存的样本。特征矩阵以内存映射方式读取且不复制，每个样本的特征为矩阵中一行的视图，
+    各期限的样本共用同一矩阵；客户号、协议号与标签较小，转换为列表
+
+    Returns:
+        Samples: 样本，labelHorizons给出时为{期限: Samples}
+    '''
+    load = lambda name: np.load(os.path.join(dirname, name + '.npy'), mmap_mode='r')
+    X, ys, custNums = load('X'), load('ys'), load('custNums').tolist()
+    offsets = np.concatenate([[0], np.cumsum(load('protolCounts'))]).tolist()
+    protolNums = load('protolNums').tolist()
+    x_indexes = dict((name, index) for index, name in enumerate(load('xNames').tolist()))
+    horizon2samples = {}
+    for i, horizon in enumerate(labelHorizons or [None]):
+        horizon2samples[horizon] = Samples(x_indexes, [Sample(custNum, protolNums[offsets[j]:offsets[j + 1]], X[j], y)
+                                                       for j, (custNum, y) in enumerate(zip(custNums, ys[:, i].tolist()))])
+    return horizon2samples if labelHorizons else horizon2samples[None]
+
+
+def buildSide(side, labelHorizons, dirname):
+    '''
+    在子进程中生成一侧样本，读表也在子进程中完成，结果由saveSampleArrays保存到dirname
+    '''
+    reader = CMSBReader(cf.fieldName2fieldType, cf.nReadProcs, cf.readChunkBytes, cf.cacheDir)
+    pipeline = Pipeline(cf.pipelineCacheDir)
+    saveSampleArrays(pipeline.run(addSideStages(pipeline, reader, side, labelHorizons)), dirname, labelHorizons)
+    if cf.pipelineCacheDir:
+        print pipeline.report()
+
+
+def buildSidesParallel(sides, labelHorizons):
+    '''
+    每侧样本在一个子进程中生成，两侧互不依赖。子进程将样本保存为.npy数组，主进程以内存映射方式读回，
+    不经pickle传递大对象。临时目录随后删除，已映射的特征矩阵在文件删除后仍可访问。
+    子进程不是守护进程，读表器仍可启动自己的解析进程
+
+    Args:
+        sides (list): 各侧的参数，格式见addSideStages
+        labelHorizons (list): 标签期限(月数)列表
+
+    Returns:
+        list: 各侧的样本
+    '''
+    workDir = tempfile.mkdtemp()
+    try:
+        dirnames = [os.path.join(workDir, str(i)) for i in range(len(sides))]
+        procs = []
+        for side, dirname in zip(sides, dirnames):
+            os.mkdir(dirname)
+            proc = multiprocessing.Process(target=buildSide, args=(side, labelHorizons, dirname))
+            proc.start()
+            procs.append(proc)
+        for proc in procs:
+            proc.join()
+        for side, proc in zip(sides, procs):
+            if proc.exitcode != 0:
+                raise RuntimeError('building samples %s failed with exit code %s' % (side[0], proc.exitcode))
+        return [loadSampleArrays(dirname, labelHorizons) for dirname in dirnames]
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+
+def backTestHorizons(trn_horizon2samples, tst_horizon2samples):
+    '''
+    对每个标签期限分别回测，步骤同evaluate，结果文件名后加上期限月数
+
+    Args:
+        trn_horizon2samples (dict): 标签期限对应的训练样本
+        tst_horizon2samples (dict): 标签期限对应的测试样本
+    '''
+    for horizon in sorted(trn_horizon2samples):
+        evaluate(trn_horizon2samples[horizon], tst_horizon2samples[horizon], '.%dm' % horizon)
+
+
 def backTest():
     '''
     回测
     '''
     # 读入贷款协议数据，交易流水数据和签约产品数据
-    reader = CMSBReader(cf.fieldName2fieldType)
+    reader = CMSBReader(cf.fieldName2fieldType, cf.nReadProcs, cf.readChunkBytes, cf.cacheDir)
 
     trnFeatLoanFilenames = [os.path.join(cf.loanDir, month) for month in cf.trnFeatMonths]
     trnFeatTransFilenames = [os.path.join(cf.transDir, month) for month in cf.trnFeatMonths]
     trnFeatProdFilenames = [os.path.join(cf.prodDir, month) for month in cf.trnFeatMonths]
-    trnLabelLoanFilenames = [os.path.join(cf.loanDir, month) for month in cf.trnLabelMonths]
     tstFeatLoanFilenames = [os.path.join(cf.loanDir, month) for month in cf.tstFeatMonths]
     tstFeatTransFilenames = [os.path.join(cf.transDir, month) for month in cf.tstFeatMonths]
     tstFeatProdFilenames = [os.path.join(cf.prodDir, month) for month in cf.tstFeatMonths]
-    tstLabelLoanFilenames = [os.path.join(cf.loanDir, month) for month in cf.tstLabelMonths]
-
-    loanFieldName2Index, trnFeatLoans, trnFeatCustNum2ProtolNums = reader.readLoans(trnFeatLoanFilenames)
-    transFieldName2Index, trnFeatTranss = reader.readTranss(trnFeatTransFilenames)
-    prodFieldName2Index, trnFeatProds = reader.readProds(trnFeatProdFilenames)
-    loanFieldName2Index, trnLabelLoans, trnLabelCustNum2ProtolNums = reader.readLoans(trnLabelLoanFilenames)
-    loanFieldName2Index, tstFeatLoans, tstFeatCustNum2ProtolNums = reader.readLoans(tstFeatLoanFilenames)
-    transFieldName2Index, tstFeatTranss = reader.readTranss(tstFeatTransFilenames)
-    prodFieldName2Index, tstFeatProds = reader.readProds(tstFeatProdFilenames)
-    loanFieldName2Index, tstLabelLoans, tstLabelCustNum2ProtolNums = reader.readLoans(tstLabelLoanFilenames)
+    # 多个标签期限时只读取一次最长期限的标签月份
+    labelHorizons = sorted(cf.labelHorizons) or None
+    if labelHorizons:
+        trnLabelMonths = nextMonths(cf.trnFeatMonths[-1], labelHorizons[-1])
+        tstLabelMonths = nextMonths(cf.tstFeatMonths[-1], labelHorizons[-1])
+    else:
+        trnLabelMonths, tstLabelMonths = cf.trnLabelMonths, cf.tstLabelMonths
+    trnLabelLoanFilenames = [os.path.join(cf.loanDir, month) for month in trnLabelMonths]
+    tstLabelLoanFilenames = [os.path.join(cf.loanDir, month) for month in tstLabelMonths]
+    # 特征统计到特征月份的最后一天
+    trnStatDate = monthEnd(cf.trnFeatMonths[-1])
+    tstStatDate = monthEnd(cf.tstFeatMonths[-1])
+
+    # 训练、测试两侧的阶段名前缀、文件与统计日期
+    trnSide = ('trn.', trnFeatLoanFilenames, trnFeatTransFilenames, trnFeatProdFilenames, trnLabelLoanFilenames, trnStatDate)
+    tstSide = ('tst.', tstFeatLoanFilenames, tstFeatTransFilenames, tstFeatProdFilenames, tstLabelLoanFilenames, tstStatDate)
+    if cf.parallelSides:  # 两侧样本(含读表)在两个子进程中并行生成
+        trn_samples, tst_samples = buildSidesParallel([trnSide, tstSide], labelHorizons)
+    elif cf.pipelineCacheDir:  # 样本生成的各阶段输出缓存在磁盘上，再次运行时只重新计算输入或配置变化的阶段
+        pipeline = Pipeline(cf.pipelineCacheDir)
+        trn_samples, tst_samples = [pipeline.run(addSideStages(pipeline, reader, side, labelHorizons)) for side in (trnSide, tstSide)]
+        print pipeline.report()
+    if cf.parallelSides or cf.pipelineCacheDir:
+        if labelHorizons:
+            backTestHorizons(trn_samples, tst_samples)
+        else:
+            evaluate(trn_samples, tst_samples)
+        return
+
+    # 支持下推的过滤器在读表时执行，其余过滤器读表后执行
+    pushedFilters = [getFilter(filterName) for filterName in cf.filterNames]
+    restFilterNames = [filterName for filterName, filter_ in zip(cf.filterNames, pushedFilters) if not filter_.pushDown]
+    pushedFilters = [filter_ for filter_ in pushedFilters if filter_.pushDown]
+
+    # 只读取生成样本用到的字段，特征与标签贷款协议表分别投影
+    fieldNames = SamplesBuilder.getFieldNames(restFilterNames)
+
+    loanFieldName2Index, trnFeatLoans, trnFeatCustNum2ProtolNums = reader.readLoans(trnFeatLoanFilenames, fieldNames['featLoans'], pushedFilters)
+    # 流式统计时交易流水只逐批读取一遍，不保存交易流水表
+    transFieldName2Index, trnFeatTranss, tstFeatTranss, trnFeatTransCounts, tstFeatTransCounts = None, None, None, None, None
+    if cf.streamTransCount:
+        trnFeatTransCounts = countTranss(reader, trnFeatTransFilenames, fieldNames['transs'], trnStatDate)
+        tstFeatTransCounts = countTranss(reader, tstFeatTransFilenames, fieldNames['transs'], tstStatDate)
+    else:
+        transFieldName2Index, trnFeatTranss = reader.readTranss(trnFeatTransFilenames, fieldNames['transs'])
+        transFieldName2Index, tstFeatTranss = reader.readTranss(tstFeatTransFilenames, fieldNames['transs'])
+    # 流式统计时产品签约同样只逐批读取一遍
+    prodFieldName2Index, trnFeatProds, tstFeatProds, trnFeatProdCounts, tstFeatProdCounts = None, None, None, None, None
+    if cf.streamProdCount:
+        trnFeatProdCounts = countProds(reader, trnFeatProdFilenames, fieldNames['prods'], trnStatDate)
+        tstFeatProdCounts = countProds(reader, tstFeatProdFilenames, fieldNames['prods'], tstStatDate)
+    else:
+        prodFieldName2Index, trnFeatProds = reader.readProds(trnFeatProdFilenames, fieldNames['prods'])
+        prodFieldName2Index, tstFeatProds = reader.readProds(tstFeatProdFilenames, fieldNames['prods'])
+    labelLoanFieldName2Index, trnLabelLoans, trnLabelCustNum2ProtolNums = reader.readLoans(trnLabelLoanFilenames, fieldNames['labelLoans'])
+    loanFieldName2Index, tstFeatLoans, tstFeatCustNum2ProtolNums = reader.readLoans(tstFeatLoanFilenames, fieldNames['featLoans'], pushedFilters)
+    labelLoanFieldName2Index, tstLabelLoans, tstLabelCustNum2ProtolNums = reader.readLoans(tstLabelLoanFilenames, fieldNames['labelLoans'])
 
     # 过滤贷款协议数据
-    trnFeatLoans = filterLoans(cf.filterNames, loanFieldName2Index, trnFeatLoans, trnFeatCustNum2ProtolNums)
-    tstFeatLoans = filterLoans(cf.filterNames, loanFieldName2Index, tstFeatLoans, tstFeatCustNum2ProtolNums)
+    trnFeatLoans = filterLoans(restFilterNames, loanFieldName2Index, trnFeatLoans, trnFeatCustNum2ProtolNums)
+    tstFeatLoans = filterLoans(restFilterNames, loanFieldName2Index, tstFeatLoans, tstFeatCustNum2ProtolNums)
 
     # ----------------------------------------------------------------------
     # 生成样本
     trn_samples_builder = SamplesBuilder(loanFieldName2Index, trnFeatLoans, trnFeatCustNum2ProtolNums, trnLabelLoans,
-                                         transFieldName2Index, trnFeatTranss, prodFieldName2Index, trnFeatProds)
+                                         transFieldName2Index, trnFeatTranss, prodFieldName2Index, trnFeatProds,
+                                         labelLoanFieldName2Index, cf.vectorizedCount, trnFeatTransCounts, trnStatDate,
+                                         labelHorizons, trnFeatProdCounts)
     tst_samples_builder = SamplesBuilder(loanFieldName2Index, tstFeatLoans, tstFeatCustNum2ProtolNums, tstLabelLoans,
-                                         transFieldName2Index, tstFeatTranss, prodFieldName2Index, tstFeatProds)
+                                         transFieldName2Index, tstFeatTranss, prodFieldName2Index, tstFeatProds,
+                                         labelLoanFieldName2Index, cf.vectorizedCount, tstFeatTransCounts, tstStatDate,
+                                         labelHorizons, tstFeatProdCounts)
+    if labelHorizons:
+        backTestHorizons(trn_samples_builder.buildSamples(), tst_samples_builder.buildSamples())
+        return
     trn_samples = trn_samples_builder.buildSample()
     tst_samples = tst_samples_builder.buildSample()
+    evaluate(trn_samples, tst_samples)
 
-    # ----------------------------------------------------------------------
+
+def evaluate(trn_samples, tst_samples, suffix=''):
+    '''
+    训练模型并预测，保存、分析样本并计算评价指标
+
+    Args:
+        trn_samples (Samples): 训练样本
+        tst_samples (Samples): 测试样本
+        suffix (str): 结果文件名的后缀，如标签期限
+    '''
     # 训练模型并预测
     fit_predict(cf.modelName, cf.modelParam, trn_samples, tst_samples)
 
     # 保存样本
-    trn_samples.save(cf.trnSampFilename)
-    tst_samples.save(cf.tstSampFilename)
+    trn_samples.save(cf.trnSampFilename + suffix)
+    tst_samples.save(cf.tstSampFilename + suffix)
 
     # 分析样本
-    analyze_samples(trn_samples, tst_samples, 20, cf.analyFilename)
+    analyze_samples(trn_samples, tst_samples, 20, cf.analyFilename + suffix)
 
     # 计算评价指标
-    gen_metrics(tst_samples, cf.metricFilename)
+    gen_metrics(tst_samples, cf.metricFilename + suffix)
 
 
 # def predict():
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+'''
+逐行字段转换的微基准：对比逐字段查字典的转换(convert，作为对照保留在本文件中)与编译后的转换器(CMSBRowConverter)。
+
+用法：python benchConvert.py 文件1 [文件2 ...]
+文件可由genData.py生成，例如：python genData.py 10000 loan.txt trans.txt prod.txt
+'''
+import sys
+import time
+from OLP.Readers.CMSBReaders import CMSBFieldProcessor
+import config as cf
+
+
+def convert(fieldName2fieldType, fields, fieldName2IndexOld, fieldName2IndexNew):
+    '''
+    转换字段列表：过滤掉非保留字段，并将保留字段按照保留字段索引的顺序排列。
+    逐字段查字典的未编译版本，仅作对照，读表时使用CMSBFieldProcessor.buildIndex编译得到的CMSBRowConverter
+
+    Args:
+        fieldName2fieldType (dict): 字段类型
+        fields (list): 字段列表
+        fieldName2IndexOld (dict): 原始字段索引
+        fieldName2IndexNew (dict): 保留字段索引
+
+    Returns:
+        list: 转换后字段列表
+    '''
+    fieldsCnvtd = [0.0] * len(fieldName2IndexNew)
+    for fieldName in fieldName2IndexNew:
+        type_ = fieldName2fieldType[fieldName]
+        indexOld = fieldName2IndexOld[fieldName]
+        indexNew = fieldName2IndexNew[fieldName]
+        fieldsCnvtd[indexNew] = type_(fields[indexOld])
+    return fieldsCnvtd
+
+
+def benchFile(filename, repeat=3):
+    processor = CMSBFieldProcessor(cf.fieldName2fieldType)
+    with open(filename) as inFile:
+        fieldNames = inFile.readline().strip().split('\t')
+        lines = inFile.readlines()
+    fieldName2IndexNew, converter = processor.buildIndex(fieldNames)
+    fieldName2IndexOld = converter.fieldName2IndexOld
+
+    def before():
+        for line in lines:
+            convert(processor.fieldName2fieldType, line.strip().split('\t'), fieldName2IndexOld, fieldName2IndexNew)
+
+    def after():
+        for line in lines:
+            converter(line.strip().split('\t'))
+
+    results = []
+    for run in (before, after):
+        best = float('inf')
+        for i in range(repeat):
+            start = time.time()
+            run()
+            best = min(best, time.time() - start)
+        results.append(len(lines) / best)
+    return len(lines), results[0], results[1]
+
+
+if __name__ == '__main__':
+
+    for filename in sys.argv[1:]:
+        nLines, before, after = benchFile(filename)
+        print '%s: %d lines, before %.0f lines/sec, after %.0f lines/sec, speedup %.2fx' % (filename, nLines, before, after, after / before)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+from OLP.Readers.FieldTypes import category, date
 
 # 标签
 OVERDUE = 1
@@ -11,6 +12,18 @@ trnFeatMonths = ['2014-2', '2014-3']
 trnLabelMonths = ['2014-4', '2014-5']
 tstFeatMonths = ['2014-6', '2014-7']
 tstLabelMonths = ['2014-8', '2014-9']
+# 标签期限(月数)，不为空时不使用上面的标签月份，而是读取特征月份之后最长期限内的各月份，为每个期限分别回测
+labelHorizons = []
+
+# 读取
+nReadProcs = 1  # 并行解析文件的进程数，为1时顺序解析
+readChunkBytes = 0  # 并行解析时大文件按该字节数切分，为0时每个文件为一块
+
+# 统计
+vectorizedCount = True  # 交易流水特征在整表上向量化分组聚合，为False时逐客户统计
+streamTransCount = False  # 逐批读取交易流水文件流式统计特征，不构建整张交易流水表，适合读取较多月份
+streamProdCount = False  # 逐批读取产品签约文件流式统计特征，不构建整张产品签约表
+parallelSides = False  # 训练、测试样本(含读表)在两个子进程中并行生成，结果经内存映射的数组文件传回
 
 
 def _bool(string='0'):
@@ -22,11 +35,11 @@ fieldName2fieldType = {
     '协议号': str,
     '还款卡号': str,
     '放款金额': float,
-    '统计日期': str,
-    '放款日期': str,
-    '最近欠款日期': str,
-    '上次付款日期': str,
-    '本月应还款日期': str,
+    '统计日期': date,
+    '放款日期': date,
+    '最近欠款日期': date,
+    '上次付款日期': date,
+    '本月应还款日期': date,
     '已还期数': float,
     '欠款期数': float,
     '剩余期限': float,
@@ -51,25 +64,26 @@ fieldName2fieldType = {
     '五级分类代码': str,
     # 流水表
     '我行客户号': str,
-    '客户类型': str,  # enum
+    '客户类型': category,
     '借贷标志': _bool,
     '折人民币': float,
+    '交易日期': date,
     '汇款标志': _bool,
-    '交易机构': str,  # enum
-    '交易代码': str,  # enum
-    '结算方式': str,  # enum
-    '对方系统': str,  # enum
-    '对方所在地区': str,  # enum
-    '对方行号类型': str,  # enum
+    '交易机构': category,
+    '交易代码': category,
+    '结算方式': category,
+    '对方系统': category,
+    '对方所在地区': category,
+    '对方行号类型': category,
     '对方银行名称': str,
     '对方是否我行客户': _bool,
-    '交易渠道': str,  # enum
-    '交易发生地行政区': str,  # enum
-    '交易去向行政区': str,  # enum
+    '交易渠道': category,
+    '交易发生地行政区': category,
+    '交易去向行政区': category,
     # 产品表
     '我行客户号': str,
     '零售签约产品代码': str,
-    '签约时间': str,
+    '签约时间': date,
 }
 
 # 过滤
@@ -106,6 +120,8 @@ transDir = os.path.join(dataDir, 'Transactions')  # 存放交易流水文件
 prodDir = os.path.join(dataDir, 'Products')  # 存放签约产品文件
 sampDir = os.path.join(dataDir, 'Samples')  # 存放用于训练/测试的样本
 metricDir = os.path.join(dataDir, 'Metrics')  # 存放评价指标等结果
+cacheDir = None  # 存放已解析的月度数据缓存，如os.path.join(dataDir, 'Cache')，设为None则不使用缓存
+pipelineCacheDir = None  # 存放样本生成各阶段的输出，只重新计算输入或配置变化的阶段，设为None则不使用
 
 trnSampFilename = os.path.join(sampDir, 'trnSamples')
 tstSampFilename = os.path.join(sampDir, 'tstSamples')
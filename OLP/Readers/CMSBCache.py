@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import os
+import types
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+
+def typeName(type_):
+    '''
+    字段类型的稳定名称，用于生成缓存键：取模块名和名称；Python函数另取字节码与默认参数的哈希，
+    同名函数的转换逻辑改变时名称随之改变；字段类型实例另取repr，包含日期分隔符等配置
+    '''
+    if not hasattr(type_, '__name__'):
+        return repr(type_)
+    name = '%s.%s' % (getattr(type_, '__module__', ''), type_.__name__)
+    code = getattr(type_, '__code__', None)
+    if code is not None:
+        return '%s:%s' % (name, codeDigest(code, getattr(type_, '__defaults__', None)))
+    if not isinstance(type_, (type, types.ClassType, types.BuiltinFunctionType)):
+        return '%s:%r' % (name, type_)
+    return name
+
+
+def codeDigest(code, defaults=None):
+    '''
+    函数字节码的哈希：包含字节码、常量(嵌套的函数递归计算)、引用的名称及默认参数
+    '''
+    sha1 = hashlib.sha1(code.co_code)
+    for const in code.co_consts:
+        sha1.update(codeDigest(const) if isinstance(const, types.CodeType) else repr(const))
+    sha1.update(repr(code.co_names))
+    sha1.update(repr(defaults))
+    return sha1.hexdigest()
+
+
+class CMSBCache(object):
+    '''
+    已解析数据块的二进制列式缓存。每个数据块(一个月度文件或其中一段)解析后的各字段数组
+    分别保存为.npy文件(枚举类字段另存词表)，再次读取时直接内存映射，无需重新解析。
+
+    缓存键由文件路径、大小、修改时间(可选文件内容哈希)、数据块的字节区间、
+    表头对应的保留字段、下推的过滤器及字段类型定义共同决定，任何一项变化都会使缓存失效。
+    '''
+    formatVersion = 3  # 缓存格式变化时递增，旧格式的缓存随之失效
+
+    def __init__(self, cacheDir, hashContent=False):
+        '''
+        Args:
+            cacheDir (str): 缓存目录
+            hashContent (bool): 是否将文件内容的哈希加入缓存键，文件可能被原地改写且保持修改时间时使用
+        '''
+        self.cacheDir = cacheDir
+        self.hashContent = hashContent
+        self.filename2digest = {}
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+    def getKey(self, task, fieldName2fieldType):
+        '''
+        计算数据块的缓存键
+
+        Args:
+            task (tuple): (逐行转换器, 文件名, 起始位置, 结束位置)
+            fieldName2fieldType (dict): 字段类型
+
+        Returns:
+            str: 缓存键
+        '''
+        converter, filename, start, stop = task
+        stat = os.stat(filename)
+        fingerprint = [self.formatVersion, os.path.abspath(filename), stat.st_size, stat.st_mtime, start, stop,
+                       converter.indexesOld, repr(converter.predicate), sorted(converter.fieldName2IndexNew.items(), key=lambda item: item[1]),
+                       sorted((fieldName, typeName(type_)) for fieldName, type_ in fieldName2fieldType.iteritems())]
+        if self.hashContent:
+            fingerprint.append(self.getDigest(filename))
+        return hashlib.sha1(repr(fingerprint)).hexdigest()
+
+    def getDigest(self, filename):
+        if filename not in self.filename2digest:
+            sha1 = hashlib.sha1()
+            with open(filename, 'rb') as inFile:
+                for data in iter(lambda: inFile.read(1 << 20), ''):
+                    sha1.update(data)
+            self.filename2digest[filename] = sha1.hexdigest()
+        return self.filename2digest[filename]
+
+    def load(self, key):
+        '''
+        读取缓存的数据块
+
+        Args:
+            key (str): 缓存键
+
+        Returns:
+            tuple: (内存映射的各字段数组, 枚举类字段的词表, 被过滤的记录)，缓存不存在时返回None
+        '''
+        blockDir = os.path.join(self.cacheDir, key)
+        if not os.path.isdir(blockDir):
+            return None
+        with open(os.path.join(blockDir, 'nFields')) as inFile:
+            nFields = int(inFile.read())
+        with open(os.path.join(blockDir, 'vocabs')) as inFile:
+            categoryIndexes = [int(i) for i in inFile.read().split()]
+        columns = [np.load(os.path.join(blockDir, '%d.npy' % i), mmap_mode='r') for i in range(nFields)]
+        vocabs = dict((i, np.load(os.path.join(blockDir, 'vocab%d.npy' % i))) for i in categoryIndexes)
+        return columns, vocabs, np.load(os.path.join(blockDir, 'discarded.npy'))
+
+    def save(self, key, block):
+        '''
+        保存数据块：先写入临时目录再重命名，中途失败或并发写入都不会留下不完整的缓存
+
+        Args:
+            key (str): 缓存键
+            block (tuple): (各字段数组, 枚举类字段的词表, 被过滤的记录)
+        '''
+        columns, vocabs, discarded = block
+        tmpDir = tempfile.mkdtemp(dir=self.cacheDir)
+        for i, column in enumerate(columns):
+            np.save(os.path.join(tmpDir, '%d.npy' % i), column)
+        for i, vocab in vocabs.iteritems():
+            np.save(os.path.join(tmpDir, 'vocab%d.npy' % i), vocab)
+        np.save(os.path.join(tmpDir, 'discarded.npy'), discarded)
+        with open(os.path.join(tmpDir, 'vocabs'), 'w') as outFile:
+            outFile.write(' '.join('%d' % i for i in sorted(vocabs)))
+        with open(os.path.join(tmpDir, 'nFields'), 'w') as outFile:
+            outFile.write('%d' % len(columns))
+        try:
+            os.rename(tmpDir, os.path.join(self.cacheDir, key))
+        except OSError:  # 已被其他进程写入
+            shutil.rmtree(tmpDir, ignore_errors=True)
@@ -1,353 +1,525 @@
 # -*- coding: utf-8 -*-
 
+import os
+import operator
+import multiprocessing
+import numpy as np
+from CMSBTable import CMSBTableBuilder, groupColumns, slotColumns, mergeVocabs
+from CMSBCache import CMSBCache
+from FieldTypes import isIdentity, isColumnar, defaultValue
 
-class CMSBFieldProcessor(object):
+
+class CMSBRowConverter(object):
     '''
-    该类用于辅助处理表数据
+    由表头编译得到的逐行转换器：预先计算保留字段的原始位置，用itemgetter一次取出，
+    再只对需要类型转换的字段调用转换函数(str、枚举类与日期类字段无需逐行转换，后两者在构建列时整列编码)
     '''
-    def __init__(self, fieldName2fieldType):
-        self.fieldName2fieldType = fieldName2fieldType  # 字段类型
-        self.loanFieldName2IndexOld = {}  # 贷款协议表原始字段索引
-        self.loanFieldName2IndexNew = {}  # 贷款协议表保留字段索引
-        self.transFieldName2IndexOld = {}  # 交易流水表原始字段索引
-        self.transFieldName2IndexNew = {}  # 交易流水表保留字段索引
-        self.prodFieldName2IndexOld = {}  # 产品签约表原始字段索引
-        self.prodFieldName2IndexNew = {}  # 产品签约表保留字段索引
+    def __init__(self, fieldName2IndexOld, fieldName2IndexNew, fieldName2fieldType):
+        '''
+        Args:
+            fieldName2IndexOld (dict): 原始字段索引
+            fieldName2IndexNew (dict): 保留字段索引
+            fieldName2fieldType (dict): 字段类型
+        '''
+        self.fieldName2IndexOld = fieldName2IndexOld
+        self.fieldName2IndexNew = fieldName2IndexNew
+        fieldNames = sorted(fieldName2IndexNew, key=fieldName2IndexNew.get)
+        self.indexesOld = [fieldName2IndexOld[fieldName] for fieldName in fieldNames]
+        self.converters = [(indexNew, fieldName2fieldType[fieldName]) for indexNew, fieldName in enumerate(fieldNames)
+                           if not isIdentity(fieldName2fieldType[fieldName])]
+        self.columnTypes = dict((indexNew, fieldName2fieldType[fieldName]) for indexNew, fieldName in enumerate(fieldNames)
+                                if isColumnar(fieldName2fieldType[fieldName]))  # 需整列编码的字段
+        self.predicate = None  # 读表时下推的过滤条件(CMSBRowPredicate)，由CMSBReader设置
+        self.buildProject()
+
+    def buildProject(self):
+        indexesOld = self.indexesOld
+        if len(indexesOld) == 0:
+            self.project = lambda fields: ()
+        elif len(indexesOld) == 1:  # 单个下标时itemgetter返回的不是元组
+            self.project = lambda fields: (fields[indexesOld[0]],)
+        else:
+            self.project = operator.itemgetter(*indexesOld)
+
+    def __getstate__(self):
+        # itemgetter与lambda无法序列化，传给子进程时只传下标，到子进程中重新构建
+        state = self.__dict__.copy()
+        del state['project']
+        return state
 
-    def buildLoanFieldNameIndex(self, fieldNames):
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.buildProject()
+
+    def __call__(self, fields):
         '''
-        构建贷款协议表字段索引
+        转换字段列表：过滤掉非保留字段，并将保留字段按照保留字段索引的顺序排列
 
         Args:
-            fieldNames (list): 字段名列表
+            fields (list): 字段列表
 
         Returns:
-            dict: 字段索引
+            list: 转换后字段列表
         '''
-        return self.buildIndex(fieldNames, self.loanFieldName2IndexOld, self.loanFieldName2IndexNew)
+        fieldsCnvtd = list(self.project(fields))
+        for indexNew, type_ in self.converters:
+            fieldsCnvtd[indexNew] = type_(fieldsCnvtd[indexNew])
+        return fieldsCnvtd
 
-    def buildTransFieldNameIndex(self, fieldNames):
-        '''
-        构建交易流水表字段索引
 
+class CMSBRowPredicate(object):
+    '''
+    下推到读表过程中的过滤条件：每行只转换过滤器用到的字段并逐个调用过滤器的hitRow，
+    命中任一过滤器的记录不再转换和保存，只记下其主键和客户号
+    '''
+    def __init__(self, filters, fieldName2IndexOld, fieldName2fieldType, primFieldName, custFieldName):
+        '''
         Args:
-            fieldNames (list): 字段名列表
-
-        Returns:
-            dict: 字段索引
+            filters (list): 支持下推的过滤器
+            fieldName2IndexOld (dict): 原始字段索引
+            fieldName2fieldType (dict): 字段类型
+            primFieldName (str): 主字段名
+            custFieldName (str): 客户号字段名
         '''
-        return self.buildIndex(fieldNames, self.transFieldName2IndexOld, self.transFieldName2IndexNew)
+        self.filters = filters
+        fieldNames = sorted(set(fieldName for filter_ in filters for fieldName in filter_.fieldNames))
+        self.fields = [(fieldName, fieldName2IndexOld[fieldName], fieldName2fieldType[fieldName]) for fieldName in fieldNames]
+        self.primIndex = fieldName2IndexOld[primFieldName]
+        self.custIndex = fieldName2IndexOld[custFieldName]
 
-    def buildProdFieldNameIndex(self, fieldNames):
+    def __repr__(self):
+        # 用于生成缓存键，过滤规则的实现或参数变化时缓存失效
+        return repr([filter_.getKey() for filter_ in self.filters])
+
+    def __call__(self, fields):
         '''
-        构建产品签约表字段索引
+        判断一行记录是否命中任一过滤器
 
         Args:
-            fieldNames (list): 字段名列表
+            fields (list): 原始字段列表
 
         Returns:
-            dict: 字段索引
+            bool: 是否命中
         '''
-        return self.buildIndex(fieldNames, self.prodFieldName2IndexOld, self.prodFieldName2IndexNew)
+        record = dict((fieldName, type_(fields[indexOld])) for fieldName, indexOld, type_ in self.fields)
+        for filter_ in self.filters:
+            if filter_.hitRow(record):
+                return True
+        return False
 
-    def buildIndex(self, fieldNames, fieldName2IndexOld, fieldName2IndexNew):
+
+class CMSBFieldProcessor(object):
+    '''
+    该类用于辅助处理表数据
+    '''
+    def __init__(self, fieldName2fieldType):
+        self.fieldName2fieldType = fieldName2fieldType  # 字段类型
+
+    def buildIndex(self, fieldNames, selected=None):
         '''
-        构建字段索引
+        构建字段索引，并编译逐行转换器。索引与转换器均由调用方持有，本类不保存每张表的状态，
+        因此同一实例可同时用于多张表或多个子进程
 
         Args:
             fieldNames (list): 字段名列表
-            fieldName2IndexOld (dict): 原始字段索引
-            fieldName2IndexNew (dict): 保留字段索引
+            selected (set): 需要保留的字段名，为None时保留所有定义了类型的字段
 
         Returns:
             dict: 保留字段索引
+            CMSBRowConverter: 逐行转换器
         '''
-        fieldName2IndexOld.clear()
-        fieldName2IndexNew.clear()
+        fieldName2IndexOld = {}  # 原始字段索引
+        fieldName2IndexNew = {}  # 保留字段索引
         for fieldName in fieldNames:
             fieldName2IndexOld[fieldName] = len(fieldName2IndexOld)
-            if fieldName in self.fieldName2fieldType:  # 保留目标字段
+            if fieldName in self.fieldName2fieldType and (selected is None or fieldName in selected):  # 保留目标字段
                 fieldName2IndexNew[fieldName] = len(fieldName2IndexNew)
-        return fieldName2IndexNew
+        return fieldName2IndexNew, CMSBRowConverter(fieldName2IndexOld, fieldName2IndexNew, self.fieldName2fieldType)
 
-    def convertLoanFields(self, fields):
+    def getDefaults(self, fieldName2Index):
         '''
-        转换贷款协议表字段列表：过滤掉非保留字段，并将保留字段按照保留字段索引的顺序排列
+        获取各字段的默认值，用于填充缺失月份
 
         Args:
-            field (list): 字段列表
+            fieldName2Index (dict): 字段索引
 
         Returns:
-            list: 转换后字段列表
+            list: 各字段的默认值，顺序与字段索引一致
         '''
-        return self.convert(fields, self.loanFieldName2IndexOld, self.loanFieldName2IndexNew)
+        defaults = [None] * len(fieldName2Index)
+        for fieldName, fieldIndex in fieldName2Index.iteritems():
+            defaults[fieldIndex] = defaultValue(self.fieldName2fieldType[fieldName])
+        return defaults
 
-    def convertTransFields(self, fields):
+    def getColumnTypes(self, fieldName2Index):
         '''
-        转换交易流水表字段列表：过滤掉非保留字段，并将保留字段按照保留字段索引的顺序排列
+        获取需整列编码的字段类型
 
         Args:
-            field (list): 字段列表
+            fieldName2Index (dict): 字段索引
 
         Returns:
-            list: 转换后字段列表
+            dict: 格式为{字段索引: 字段类型}
         '''
-        return self.convert(fields, self.transFieldName2IndexOld, self.transFieldName2IndexNew)
+        return dict((fieldIndex, self.fieldName2fieldType[fieldName]) for fieldName, fieldIndex in fieldName2Index.iteritems()
+                    if isColumnar(self.fieldName2fieldType[fieldName]))
+
 
-    def convertProdFields(self, fields):
+class CMSBReader(object):
+    '''
+    该类用于读取若干月(比如n ~ n+m-1共m个月)贷款协议表，交易流水表和产品签约表的数据。
+
+    各表数据均保存为列式表(CMSBTable)：每个字段一个类型化的numpy数组，同一主键的记录连续存放，
+    并通过 主键 -> 行区间 索引定位。按主键取值时仍得到原有的字典格式：
+
+    贷款协议表以协议号为主键，按月份槽位存放：每个协议号对应m行，第j行为第j个文件(月份)中的记录，
+    该月没有记录时取字段默认值，并在表的mask中标记为不存在：
+    loans[贷款协议号] = [[字段1第n月数据, 字段1第n+1月数据, ..., 字段1第n+m-1月数据],
+                        [字段2第n月数据, 字段2第n+1月数据, ..., 字段2第n+m-1月数据],
+                        ...
+                       ]
+
+    交易流水表以客户号为主键(假定用户i在n ~ n+m-1月内共有pi笔交易)：
+    transs[客户号i] = [[字段1第1笔数据, 字段1第2笔数据, ..., 字段1第pi笔数据],
+                      [字段2第1笔数据, 字段2第2笔数据, ..., 字段2第pi笔数据],
+                      ...
+                     ]
+
+    产品签约表以客户号为主键(假定用户i在n ~ n+m-1月内共签约qi款产品)：
+    prods[客户号i] = [[字段1第1笔数据, 字段1第2笔数据, ..., 字段1第qi笔数据],
+                     [字段2第1笔数据, 字段2第2笔数据, ..., 字段2第qi笔数据],
+                     ...
+                    ]
+    '''
+    def __init__(self, fieldName2fieldType, nProcs=1, chunkBytes=0, cacheDir=None):
         '''
-        转换产品签约表字段列表：过滤掉非保留字段，并将保留字段按照保留字段索引的顺序排列
+        Args:
+            fieldName2fieldType (dict): 字段类型
+            nProcs (int): 并行解析文件的进程数，为1时在当前进程中顺序解析
+            chunkBytes (int): 并行解析时大文件按该字节数切分为多块，为0时每个文件为一块
+            cacheDir (str): 已解析数据块的缓存目录，为None时不使用缓存
+        '''
+        self.fieldProcessor = CMSBFieldProcessor(fieldName2fieldType)
+        self.nProcs = nProcs
+        self.chunkBytes = chunkBytes
+        self.cache = CMSBCache(cacheDir) if cacheDir else None
+        self.protolNumName = '协议号'
+        self.loanCustNumName = '核心客户号'
+        self.custNumName = '我行客户号'
+
+    def readLoans(self, filenames, fieldNames=None, filters=()):
+        '''
+        读取贷款协议表数据
 
         Args:
-            field (list): 字段列表
+            filenames (list): 文件名列表
+            fieldNames (list): 需要读取的字段名，其余字段不做转换也不保存，为None时读取所有字段。
+                协议号与核心客户号总会被读取
+            filters (list): 下推到读表过程中的过滤器(pushDown为True)，结果与读表后依次调用其filter相同：
+                任一月份命中过滤规则的协议不出现在表中，其客户仍保留在客户号对应的协议号中
 
         Returns:
-            list: 转换后字段列表
+            dict: 字段索引
+            CMSBTable: 表数据
+            dict: 客户号对应的协议号，格式为{客户号1: [协议号11, 协议号12, ...], 客户号2: [协议号21, 协议号22, ...], ...}
         '''
-        return self.convert(fields, self.prodFieldName2IndexOld, self.prodFieldName2IndexNew)
+        fieldName2Index, blocks, slots = self.readBlocks(filenames, self.project(fieldNames, self.protolNumName, self.loanCustNumName),
+                                                         filters)
+        columns, vocabs = concatBlocks(fieldName2Index, blocks)
+        rowSlots = np.concatenate([np.zeros(0, dtype=np.int64)] +
+                                  [np.repeat(slot, blockSize(block)) for block, slot in zip(blocks, slots)])
+        discarded = np.concatenate([block[2] for block in blocks])  # 被过滤的 (协议号, 客户号)
+        if len(discarded) > 0:  # 被过滤的协议在其他月份的记录也不保留
+            keep = ~np.in1d(columns[fieldName2Index[self.protolNumName]], discarded[:, 0])
+            columns = [column[keep] for column in columns]
+            rowSlots = rowSlots[keep]
+        loans = slotColumns(fieldName2Index, columns, rowSlots, len(filenames), fieldName2Index[self.protolNumName],
+                            self.fieldProcessor.getDefaults(fieldName2Index), vocabs,
+                            self.fieldProcessor.getColumnTypes(fieldName2Index))  # 按月份槽位存放
 
-    def convert(self, fields, fieldName2IndexOld, fieldName2IndexNew):
+        custNum2ProtolNum = {}
+        custNums = loans.column(self.loanCustNumName)[loans.lastRows()].tolist()
+        for protolNum, custNum in zip(loans.primKeys.tolist(), custNums):
+            if custNum not in custNum2ProtolNum:
+                custNum2ProtolNum[custNum] = [protolNum]
+            else:
+                custNum2ProtolNum[custNum].append(protolNum)
+        for custNum in discarded[:, 1].tolist():
+            custNum2ProtolNum.setdefault(custNum, [])
+
+        return fieldName2Index, loans, custNum2ProtolNum
+
+    def readTranss(self, filenames, fieldNames=None):
         '''
-        转换字段列表：过滤掉非保留字段，并将保留字段按照保留字段索引的顺序排列
+        读取交易流水表数据
 
         Args:
-            field (list): 字段列表
-            fieldName2IndexOld (dict): 原始字段索引
-            fieldName2IndexNew (dict): 保留字段索引
+            filenames (list): 文件名列表
+            fieldNames (list): 需要读取的字段名，为None时读取所有字段
 
         Returns:
-            list: 转换后字段列表
+            dict: 字段索引
+            CMSBTable: 表数据
         '''
-        fieldsCnvtd = [0.0] * len(fieldName2IndexNew)
-        for fieldName in fieldName2IndexNew:
-            type_ = self.fieldName2fieldType[fieldName]
-            indexOld = fieldName2IndexOld[fieldName]
-            indexNew = fieldName2IndexNew[fieldName]
-            fieldsCnvtd[indexNew] = type_(fields[indexOld])
-        return fieldsCnvtd
+        return self.readTable(filenames, self.custNumName, fieldNames)
 
-    def addLoanFields(self, fields, samples, primFieldName):
+    def readProds(self, filenames, fieldNames=None):
         '''
-        添加一项新记录(字段列表)到贷款协议表数据中
+        读取产品签约表数据
 
         Args:
-            field (list): 字段列表
-            samples (dict): 贷款协议表数据
-            primFieldName (str): 主字段名
+            filenames (list): 文件名列表
+            fieldNames (list): 需要读取的字段名，为None时读取所有字段
+
+        Returns:
+            dict: 字段索引
+            CMSBTable: 表数据
         '''
-        self.addFields(fields, samples, primFieldName, self.loanFieldName2IndexNew)
+        return self.readTable(filenames, self.custNumName, fieldNames)
 
-    def addTransFields(self, fields, samples, primFieldName):
+    def readTable(self, filenames, primFieldName, fieldNames=None):
         '''
-        添加一项新记录(字段列表)到交易流水表数据中
+        读取表数据：各文件(或大文件的各块)分别解析，再按月份顺序合并并按主键分组
 
         Args:
-            field (list): 字段列表
-            samples (dict): 贷款协议表数据
+            filenames (list): 文件名列表
             primFieldName (str): 主字段名
+            fieldNames (list): 需要读取的字段名，为None时读取所有字段，主字段总会被读取
+
+        Returns:
+            dict: 字段索引
+            CMSBTable: 表数据
         '''
-        self.addFields(fields, samples, primFieldName, self.transFieldName2IndexNew)
+        fieldName2Index, blocks, slots = self.readBlocks(filenames, self.project(fieldNames, primFieldName))
+        columns, vocabs = concatBlocks(fieldName2Index, blocks)
+        return fieldName2Index, groupColumns(fieldName2Index, columns, fieldName2Index[primFieldName], vocabs,
+                                             self.fieldProcessor.getColumnTypes(fieldName2Index))
 
-    def addProdFields(self, fields, samples, primFieldName):
+    def project(self, fieldNames, *keyFieldNames):
         '''
-        添加一项新记录(字段列表)到产品签约表数据中
+        需要读取的字段集合，总是包含主键等关键字段
 
         Args:
-            field (list): 字段列表
-            samples (dict): 贷款协议表数据
-            primFieldName (str): 主字段名
+            fieldNames (list): 需要读取的字段名，为None表示全部读取
+            keyFieldNames (str): 关键字段名
+
+        Returns:
+            set: 需要读取的字段名，全部读取时为None
         '''
-        self.addFields(fields, samples, primFieldName, self.prodFieldName2IndexNew)
+        if fieldNames is None:
+            return None
+        return set(fieldNames) | set(keyFieldNames)
 
-    def addFields(self, fields, samples, primFieldName, fieldName2Index):
+    def readBlocks(self, filenames, selected=None, filters=()):
         '''
-        添加一项新记录(字段列表)到对应的表数据中
+        读取各文件(或大文件的各块)的数据块。并行与顺序解析走同一流程，结果完全一致。
+        启用缓存时已解析过的数据块直接从缓存读取
 
         Args:
-            field (list): 字段列表
-            samples (dict): 表数据
-            primFieldName (str): 主字段名
-        '''
-        primFieldIndex = fieldName2Index[primFieldName]
-        primField = fields[primFieldIndex]
+            filenames (list): 文件名列表
+            selected (set): 需要读取的字段名，为None时读取所有字段
+            filters (list): 下推的贷款协议过滤器
 
-        if primField not in samples:
-            sample = []
-            for j, field in enumerate(fields):
-                sample.append([])
-                sample[j].append(field)
-            samples[primField] = sample
+        Returns:
+            dict: 字段索引
+            list: 按文件顺序排列的数据块，每块为(按读入顺序排列的各字段数组, 枚举类字段的词表, 被过滤的(主键, 客户号)数组)
+            list: 每个数据块所属文件(月份)的序号
+        '''
+        with open(filenames[0]) as inFile:
+            fieldNames = inFile.readline().strip().split('\t')  # 利用第一个文件的第一行获取所有字段
+        fieldName2Index, converter = self.fieldProcessor.buildIndex(fieldNames, selected)  # 构建字段索引
+        if filters:
+            converter.predicate = CMSBRowPredicate(list(filters), converter.fieldName2IndexOld, self.fieldProcessor.fieldName2fieldType,
+                                                   self.protolNumName, self.loanCustNumName)
+
+        chunkBytes = self.chunkBytes if self.nProcs > 1 else 0
+        tasks = []
+        slots = []
+        for slot, filename in enumerate(filenames):
+            for start, stop in splitFile(filename, chunkBytes):
+                tasks.append((converter, filename, start, stop))
+                slots.append(slot)
+        blocks = [None] * len(tasks)
+        if self.cache is not None:
+            keys = [self.cache.getKey(task, self.fieldProcessor.fieldName2fieldType) for task in tasks]
+            blocks = [self.cache.load(key) for key in keys]
+        missing = [i for i, block in enumerate(blocks) if block is None]
+
+        if self.nProcs > 1 and len(missing) > 1:
+            pool = multiprocessing.Pool(min(self.nProcs, len(missing)))
+            try:
+                parsed = pool.map(parseBlock, [tasks[i] for i in missing], chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
         else:
-            sample = samples[primField]
-            for j, field in enumerate(fields):
-                sample[j].append(field)
+            parsed = [parseBlock(tasks[i]) for i in missing]
+        for i, block in zip(missing, parsed):
+            blocks[i] = block
+            if self.cache is not None:
+                self.cache.save(keys[i], block)
 
-    def expandSamples(self, samples, primFieldName, fieldName2Index):
-        '''
-        对表数据中字段的维数进行扩展,使表中所有样本的对应字段维数相同
+        return fieldName2Index, blocks, slots
 
-        Args:
-            samples (dict): 表数据
-            primFieldName (str): 主字段名
-            fieldName2Index (dict): 字段索引
+    def iterTranss(self, filenames, batchSize=65536, fieldNames=None):
         '''
-        dimMax = 0
-        for sample in samples.itervalues():
-            for field in sample:
-                dimMax = max(dimMax, len(field))
-        for sample in samples.itervalues():
-            for fieldName, fieldIndex in fieldName2Index.iteritems():
-                field = sample[fieldIndex]
-                if len(field) < dimMax:
-                    type_ = self.fieldName2fieldType[fieldName]
-                    sample[fieldIndex] = [type_()] * (dimMax - len(field))
-                    sample[fieldIndex].extend(field)
-        return samples
-
+        流式读取交易流水表数据，每批不超过batchSize条记录，批内按客户号分组。
+        同一客户的记录可能分布在多个批中，使用方需逐批累计
 
-class CMSBReader(object):
-    '''
-    该类用于读取若干月(比如n ~ n+m-1共m个月)贷款协议表，交易流水表和产品签约表的数据。
+        Args:
+            filenames (list): 文件名列表
+            batchSize (int): 每批记录数
+            fieldNames (list): 需要读取的字段名，为None时读取所有字段
 
-    贷款协议表数据保存格式为：
-    {贷款协议号1: [[字段1第n月数据, 字段1第n+1月数据, ..., 字段1第n+m-1月数据],
-                   [字段2第n月数据, 字段2第n+1月数据, ..., 字段2第n+m-1月数据],
-                   ...
-                  ],
-     贷款协议号2: [[字段1第n月数据, 字段1第n+1月数据, ..., 字段1第n+m-1月数据],
-                   [字段2第n月数据, 字段2第n+1月数据, ..., 字段2第n+m-1月数据],
-                   ...
-                  ],
-     ...,
-    }
-
-    交易流水表数据保存格式为(假定用户i在n ~ n+m-1月内共有pi笔交易)：
-    {客户号1: [[字段1第1笔数据, 字段1第2笔数据, ..., 字段1第p1笔数据],
-               [字段2第1笔数据, 字段2第2笔数据, ..., 字段2第p1笔数据],
-               ...
-              ],
-     客户号2: [[字段1第1笔数据, 字段1第2笔数据, ..., 字段1第p2笔数据],
-               [字段2第1笔数据, 字段2第2笔数据, ..., 字段2第p2笔数据],
-               ...
-              ],
-     ...,
-    }
-
-    产品签约表数据保存格式为(假定用户i在n ~ n+m-1月内共签约qi款产品)：
-    {客户号1: [[字段1第1笔数据, 字段1第2笔数据, ..., 字段1第q1笔数据],
-               [字段2第1笔数据, 字段2第2笔数据, ..., 字段2第q1笔数据],
-               ...
-              ],
-     客户号2: [[字段1第1笔数据, 字段1第2笔数据, ..., 字段1第q2笔数据],
-               [字段2第1笔数据, 字段2第2笔数据, ..., 字段2第q2笔数据],
-               ...
-              ],
-     ...,
-    }
-    '''
-    def __init__(self, fieldName2fieldType):
-        self.fieldProcessor = CMSBFieldProcessor(fieldName2fieldType)
-        self.protolNumName = '协议号'
-        self.loanCustNumName = '核心客户号'
-        self.custNumName = '我行客户号'
+        Yields:
+            CMSBTable: 一批表数据
+        '''
+        return self.iterRecords(filenames, self.custNumName, batchSize, fieldNames)
 
-    def readLoans(self, filenames):
+    def iterProds(self, filenames, batchSize=65536, fieldNames=None):
         '''
-        读取贷款协议表数据
+        流式读取产品签约表数据，每批不超过batchSize条记录，批内按客户号分组
 
         Args:
             filenames (list): 文件名列表
+            batchSize (int): 每批记录数
+            fieldNames (list): 需要读取的字段名，为None时读取所有字段
 
-        Returns:
-            dict: 字段索引
-            dict: 表数据
-            dict: 客户号对应的协议号，格式为{客户号1: [协议号11, 协议号12, ...], 客户号2: [协议号21, 协议号22, ...], ...}
+        Yields:
+            CMSBTable: 一批表数据
         '''
-        fieldName2Index = {}
-        loans = {}
-        custNum2ProtolNum = {}
-
-        for i, filename in enumerate(filenames):
-            with open(filename) as inFile:
-                # 读取第一行
-                firstLine = inFile.readline()
-                if i == 0:  # 第一次读取文件
-                    fieldNames = firstLine.strip().split('\t')  # 利用第一行获取所有字段
-                    fieldName2Index = self.fieldProcessor.buildLoanFieldNameIndex(fieldNames)  # 构建字段索引
-                # 读取剩余行，获取各字段对应数据
-                for line in inFile:
-                    fields = line.strip().split('\t')
-                    fields = self.fieldProcessor.convertLoanFields(fields)
-                    self.fieldProcessor.addLoanFields(fields, loans, self.protolNumName)
-                inFile.close()
-        loans = self.fieldProcessor.expandSamples(loans, self.protolNumName, fieldName2Index)  # 扩展字段维数
-
-        for protolNum in loans:
-            custNumIndex = fieldName2Index[self.loanCustNumName]
-            custNum = loans[protolNum][custNumIndex][-1]
-            if custNum not in custNum2ProtolNum:
-                custNum2ProtolNum[custNum] = [protolNum]
-            else:
-                custNum2ProtolNum[custNum].append(protolNum)
+        return self.iterRecords(filenames, self.custNumName, batchSize, fieldNames)
 
-        return fieldName2Index, loans, custNum2ProtolNum
-
-    def readTranss(self, filenames):
+    def iterRecords(self, filenames, primFieldName, batchSize, fieldNames=None):
         '''
-        读取交易流水表数据
+        流式读取表数据
 
         Args:
             filenames (list): 文件名列表
+            primFieldName (str): 主字段名
+            batchSize (int): 每批记录数
+            fieldNames (list): 需要读取的字段名，为None时读取所有字段
 
-        Returns:
-            dict: 字段索引
-            dict: 表数据
+        Yields:
+            CMSBTable: 一批表数据
         '''
-        fieldName2Index = {}
-        transs = {}
-
+        selected = self.project(fieldNames, primFieldName)
+        builder = None
         for i, filename in enumerate(filenames):
             with open(filename) as inFile:
                 # 读取第一行
                 firstLine = inFile.readline()
                 if i == 0:  # 第一次读取文件
-                    fieldNames = firstLine.strip().split('\t')  # 第一次读取，利用第一行获取所有字段
-                    fieldName2Index = self.fieldProcessor.buildTransFieldNameIndex(fieldNames)  # 构建字段索引
-                # 读取剩余行，获取各字段对应数据
+                    fieldNames = firstLine.strip().split('\t')  # 利用第一行获取所有字段
+                    fieldName2Index, converter = self.fieldProcessor.buildIndex(fieldNames, selected)  # 构建字段索引
+                    builder = CMSBTableBuilder(fieldName2Index, primFieldName, batchSize, converter.columnTypes)
+                # 读取剩余行，每满一批即返回
                 for line in inFile:
                     fields = line.strip().split('\t')
-                    fields = self.fieldProcessor.convertTransFields(fields)
-                    self.fieldProcessor.addTransFields(fields, transs, self.custNumName)
-                inFile.close()
+                    builder.add(converter(fields))
+                    if len(builder) >= batchSize:
+                        yield builder.build()
+        if builder is not None and len(builder) > 0:
+            yield builder.build()
 
-        return fieldName2Index, transs
 
-    def readProds(self, filenames):
-        '''
-        读取产品签约表数据
+def splitFile(filename, chunkBytes=0):
+    '''
+    将文件(除第一行外)按行边界切分为若干字节区间
 
-        Args:
-            filenames (list): 文件名列表
+    Args:
+        filename (str): 文件名
+        chunkBytes (int): 每块的大致字节数，为0时整个文件为一块
 
-        Returns:
-            dict: 字段索引
-            dict: 表数据
-        '''
-        fieldName2Index = {}
-        prods = {}
+    Returns:
+        list: 字节区间列表，格式为[(起始位置, 结束位置), ...]，结束位置为None表示读到文件末尾
+    '''
+    with open(filename) as inFile:
+        inFile.readline()
+        start = inFile.tell()
+        if chunkBytes <= 0:
+            return [(start, None)]
+        size = os.fstat(inFile.fileno()).st_size
+        bounds = [start]
+        while bounds[-1] + chunkBytes < size:
+            inFile.seek(bounds[-1] + chunkBytes)
+            inFile.readline()  # 对齐到下一行行首
+            if inFile.tell() >= size:
+                break
+            bounds.append(inFile.tell())
+    return [(start, stop) for start, stop in zip(bounds, bounds[1:] + [None])]
+
+
+def parseBlock(task):
+    '''
+    解析文件中的一块，可在子进程中执行
 
-        for i, filename in enumerate(filenames):
-            with open(filename) as inFile:
-                # 读取第一行
-                firstLine = inFile.readline()
-                if i == 0:  # 第一次读取文件
-                    fieldNames = firstLine.strip().split('\t')  # 第一次读取，利用第一行获取所有字段
-                    fieldName2Index = self.fieldProcessor.buildProdFieldNameIndex(fieldNames)  # 构建字段索引
-                # 读取剩余行，获取各字段对应数据
-                for line in inFile:
-                    fields = line.strip().split('\t')
-                    fields = self.fieldProcessor.convertProdFields(fields)
-                    self.fieldProcessor.addProdFields(fields, prods, self.custNumName)
-                inFile.close()
+    Args:
+        task (tuple): (逐行转换器, 文件名, 起始位置, 结束位置)
+
+    Returns:
+        list: 按读入顺序排列的各字段数组，枚举类字段为代码数组
+        dict: 枚举类字段的词表
+        numpy.ndarray: 被下推的过滤条件过滤掉的记录的 (主键, 客户号)，形状为 (n, 2)
+    '''
+    converter, filename, start, stop = task
+    predicate = converter.predicate
+    builder = CMSBTableBuilder(converter.fieldName2IndexNew, None, columnTypes=converter.columnTypes)
+    discarded = []
+    with open(filename) as inFile:
+        for line in iterLines(inFile, start, stop):
+            fields = line.strip().split('\t')
+            if predicate is not None and predicate(fields):
+                discarded.append((fields[predicate.primIndex], fields[predicate.custIndex]))
+                continue
+            builder.add(converter(fields))
+    columns, vocabs = builder.buildColumns()
+    return columns, vocabs, np.array(discarded, dtype=str).reshape(-1, 2)
+
+
+def iterLines(inFile, start, stop):
+    '''
+    逐行读取文件中 [start, stop) 字节区间内的行，stop为None时读到文件末尾
+    '''
+    inFile.seek(start)
+    if stop is None:
+        for line in inFile:
+            yield line
+    else:
+        pos = start
+        while pos < stop:
+            line = inFile.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line
+
+
+def blockSize(block):
+    columns = block[0]
+    return len(columns[0]) if columns else 0
+
+
+def concatBlocks(fieldName2Index, blocks):
+    '''
+    按顺序拼接各块数据，各块枚举类字段的词表合并为一个，代码随之转换
+
+    Args:
+        fieldName2Index (dict): 字段索引
+        blocks (list): 各块的(字段数组列表, 词表, 被过滤的记录)
 
-        return fieldName2Index, prods
+    Returns:
+        list: 拼接后的各字段数组
+        dict: 枚举类字段的词表
+    '''
+    blocks = [block for block in blocks if blockSize(block) > 0] or blocks[:1]
+    columns = []
+    vocabs = {}
+    for fieldIndex in range(len(fieldName2Index)):
+        if fieldIndex in blocks[0][1]:
+            vocab, mappings = mergeVocabs([block[1][fieldIndex] for block in blocks])
+            columns.append(np.concatenate([mapping[block[0][fieldIndex]] for block, mapping in zip(blocks, mappings)]))
+            vocabs[fieldIndex] = vocab
+        else:
+            columns.append(np.concatenate([block[0][fieldIndex] for block in blocks]))
+    return columns, vocabs
@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from FieldTypes import codeType, isDate, Date
+
+
+class CMSBTable(object):
+    '''
+    列式表：每个字段保存为一个类型化的numpy数组，同一主键的记录在数组中连续存放，
+    并通过 主键 -> 行区间 索引定位。主键按升序排列，同一主键内的记录保持读入顺序。
+
+    按月份槽位存放的表(如贷款协议表)中，每个主键占固定的m行，第j行对应第j个月，
+    该月没有记录时取字段默认值，并由逐行的mask标记该月记录是否存在。
+
+    枚举类字段以字典编码存放：列中为小整数代码，vocabs[字段索引]为按升序排列的词表，
+    第k个取值对应代码k。column/getColumns返回代码，decoded返回原始字符串。
+    日期类字段存放为int32天数(缺失为Date.NaT)，decoded返回 '年/月/日' 字符串，dateColumn返回天数。
+
+    为兼容原有的字典格式，table[主键] 仍返回 [[字段1数据...], [字段2数据...], ...]，
+    其中枚举类与日期类字段已解码为字符串，并支持 in / len / 迭代 / del 等字典操作。
+    '''
+    def __init__(self, fieldName2Index, columns, primKeys, offsets, mask=None, vocabs=None, columnTypes=None):
+        '''
+        Args:
+            fieldName2Index (dict): 字段索引
+            columns (list): 字段数组列表，顺序与字段索引一致
+            primKeys (numpy.ndarray): 主键数组
+            offsets (numpy.ndarray): 行区间边界，第i个主键的记录为 offsets[i]:offsets[i + 1]
+            mask (numpy.ndarray): 逐行标记记录是否存在，为None时所有行均存在
+            vocabs (dict): 枚举类字段的词表，格式为{字段索引: 词表}
+            columnTypes (dict): 整列编码的字段类型(枚举类、日期类)，格式为{字段索引: 字段类型}
+        '''
+        self.fieldName2Index = fieldName2Index
+        self.columns = columns
+        self.primKeys = primKeys
+        self.offsets = offsets
+        self.mask = mask
+        self.vocabs = vocabs or {}
+        self.columnTypes = columnTypes or {}
+        self.alive = np.ones(len(primKeys), dtype=bool)  # 主键是否未被删除
+        self.key2pos = dict((key, pos) for pos, key in enumerate(primKeys.tolist()))
+
+    @classmethod
+    def fromDict(cls, fieldName2Index, samples):
+        '''
+        由原有字典格式的表数据构建列式表
+
+        Args:
+            fieldName2Index (dict): 字段索引
+            samples (dict): 表数据
+
+        Returns:
+            CMSBTable: 列式表
+        '''
+        keys = sorted(samples)
+        counts = [len(samples[key][0]) if samples[key] else 0 for key in keys]
+        columns = []
+        for fieldIndex in range(len(fieldName2Index)):
+            columns.append(np.array([field for key in keys for field in samples[key][fieldIndex]]))
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        return cls(fieldName2Index, columns, np.array(keys), offsets)
+
+    # ------------------------------------------------------------------
+    # 兼容字典格式的接口
+    def __len__(self):
+        return len(self.key2pos)
+
+    def __contains__(self, key):
+        return key in self.key2pos
+
+    def __iter__(self):
+        return iter(self.primKeys[self.alive].tolist())
+
+    def __getitem__(self, key):
+        start, stop = self.getRange(key)
+        return [self.decode(fieldIndex, column[start:stop]).tolist() for fieldIndex, column in enumerate(self.columns)]
+
+    def __delitem__(self, key):
+        pos = self.key2pos.pop(key)
+        self.alive[pos] = False
+
+    def has_key(self, key):
+        return key in self.key2pos
+
+    def get(self, key, default=None):
+        return self[key] if key in self.key2pos else default
+
+    def iterkeys(self):
+        return iter(self)
+
+    def keys(self):
+        return list(self)
+
+    def iteritems(self):
+        for key in self:
+            yield key, self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        for key in self:
+            yield self[key]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def toDict(self):
+        '''
+        转换为原有字典格式的表数据
+
+        Returns:
+            dict: 表数据
+        '''
+        return dict(self.iteritems())
+
+    # ------------------------------------------------------------------
+    # 列式接口
+    def getRange(self, key):
+        '''
+        获取主键对应的行区间
+
+        Args:
+            key (str): 主键
+
+        Returns:
+            int: 起始行
+            int: 结束行(不含)
+        '''
+        pos = self.key2pos[key]
+        return self.offsets[pos], self.offsets[pos + 1]
+
+    def getColumns(self, key):
+        '''
+        获取主键对应的各字段数据(numpy视图，不复制数据)，枚举类字段为代码，日期类字段为天数
+
+        Args:
+            key (str): 主键
+
+        Returns:
+            list: 各字段数据
+        '''
+        start, stop = self.getRange(key)
+        return [column[start:stop] for column in self.columns]
+
+    def column(self, fieldName):
+        '''
+        获取字段对应的整列数据，枚举类字段为代码，日期类字段为天数
+
+        Args:
+            fieldName (str): 字段名
+
+        Returns:
+            numpy.ndarray: 整列数据
+        '''
+        self.compact()
+        return self.columns[self.fieldName2Index[fieldName]]
+
+    def decoded(self, fieldName):
+        '''
+        获取字段对应的整列数据，枚举类与日期类字段解码为字符串
+
+        Args:
+            fieldName (str): 字段名
+
+        Returns:
+            numpy.ndarray: 整列数据
+        '''
+        return self.decode(self.fieldName2Index[fieldName], self.column(fieldName))
+
+    def decode(self, fieldIndex, values):
+        if fieldIndex in self.vocabs:
+            return self.vocabs[fieldIndex][values]
+        if isDate(self.columnTypes.get(fieldIndex)):
+            return self.columnTypes[fieldIndex].format(values)
+        return values
+
+    def dateColumn(self, fieldName):
+        '''
+        获取日期字段对应的整列天数。字段未按日期类读入(仍为字符串)时按 '年/月/日' 解析，同一字符串只解析一次
+
+        Args:
+            fieldName (str): 字段名
+
+        Returns:
+            numpy.ndarray: int32天数，缺失或无法解析的日期为Date.NaT
+        '''
+        column = self.column(fieldName)
+        if isDate(self.columnTypes.get(self.fieldName2Index[fieldName])):
+            return column
+        return Date().encodeColumn(self.decoded(fieldName))[0]
+
+    def isCategory(self, fieldName):
+        return self.fieldName2Index[fieldName] in self.vocabs
+
+    def encode(self, fieldName, value):
+        '''
+        将字段取值转换为与column相同的表示，枚举类字段转换为代码
+
+        Args:
+            fieldName (str): 字段名
+            value: 字段取值
+
+        Returns:
+            枚举类字段返回取值的代码，取值不在词表中时返回-1；其他字段原样返回
+        '''
+        vocab = self.vocabs.get(self.fieldName2Index[fieldName])
+        if vocab is None:
+            return value
+        code = int(np.searchsorted(vocab, value))
+        return code if code < len(vocab) and vocab[code] == value else -1
+
+    def equals(self, fieldName, value):
+        '''
+        逐行判断字段是否等于给定取值，枚举类字段直接比较代码
+
+        Args:
+            fieldName (str): 字段名
+            value: 字段取值
+
+        Returns:
+            numpy.ndarray: 逐行的布尔标记
+        '''
+        return self.column(fieldName) == self.encode(fieldName, value)
+
+    def categoryCounts(self, fieldName, rowFlags=None):
+        '''
+        统计每个主键在枚举类字段各取值上的记录数
+
+        Args:
+            fieldName (str): 字段名
+            rowFlags (numpy.ndarray): 逐行的布尔标记，只统计为True的行，为None时统计所有行
+
+        Returns:
+            numpy.ndarray: 词表
+            numpy.ndarray: (主键数 × 词表大小) 的记录数矩阵
+        '''
+        vocab = self.vocabs[self.fieldName2Index[fieldName]]
+        cells = self.rowKeyPos() * len(vocab) + self.column(fieldName)
+        if rowFlags is not None:
+            cells = cells[rowFlags]
+        counts = np.bincount(cells, minlength=len(self.primKeys) * len(vocab))
+        return vocab, counts.reshape(len(self.primKeys), len(vocab))
+
+    def nRows(self):
+        self.compact()
+        return int(self.offsets[-1])
+
+    def counts(self):
+        '''
+        每个主键的记录数
+        '''
+        self.compact()
+        return np.diff(self.offsets)
+
+    def rowKeyPos(self):
+        '''
+        每行记录所属主键的位置
+        '''
+        counts = self.counts()
+        return np.repeat(np.arange(len(counts)), counts)
+
+    def present(self):
+        '''
+        逐行标记记录是否存在
+        '''
+        self.compact()
+        if self.mask is None:
+            return np.ones(self.offsets[-1], dtype=bool)
+        return self.mask
+
+    def lastRows(self):
+        '''
+        每个主键最后一条存在的记录的位置
+        '''
+        self.compact()
+        if self.mask is None or len(self.primKeys) == 0:
+            return self.offsets[1:] - 1
+        rows = np.where(self.mask, np.arange(len(self.mask)), -1)
+        return np.maximum.reduceat(rows, self.offsets[:-1])
+
+    def monthMatrix(self, fieldName):
+        '''
+        获取字段的 (主键数 × 月份数) 矩阵，要求每个主键的行数相同(如按月份槽位存放的表)
+
+        Args:
+            fieldName (str): 字段名
+
+        Returns:
+            numpy.ndarray: 第i行第j列为第i个主键第j个月的数据
+        '''
+        return self.column(fieldName).reshape(len(self.primKeys), -1)
+
+    def reduceRows(self, rowFlags):
+        '''
+        将逐行的标记按主键做或运算
+
+        Args:
+            rowFlags (numpy.ndarray): 逐行的布尔标记
+
+        Returns:
+            numpy.ndarray: 逐主键的布尔标记
+        '''
+        self.compact()
+        if len(self.primKeys) == 0:
+            return np.zeros(0, dtype=bool)
+        return np.logical_or.reduceat(rowFlags, self.offsets[:-1])
+
+    def deleteKeys(self, keyFlags):
+        '''
+        按逐主键的标记一次删除多个主键并回收其占用的行，原地修改
+
+        Args:
+            keyFlags (numpy.ndarray): 逐主键的布尔标记，True表示删除
+        '''
+        self.compact()
+        self.alive = ~keyFlags
+        return self.compact()
+
+    def compact(self):
+        '''
+        回收已删除主键占用的行，原地修改
+        '''
+        if self.alive.all():
+            return self
+        rowFlags = np.repeat(self.alive, np.diff(self.offsets))
+        counts = np.diff(self.offsets)[self.alive]
+        self.columns = [column[rowFlags] for column in self.columns]
+        if self.mask is not None:
+            self.mask = self.mask[rowFlags]
+        self.primKeys = self.primKeys[self.alive]
+        self.offsets = np.zeros(len(self.primKeys) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(counts)
+        self.alive = np.ones(len(self.primKeys), dtype=bool)
+        self.key2pos = dict((key, pos) for pos, key in enumerate(self.primKeys.tolist()))
+        return self
+
+    def selectRows(self, rowFlags):
+        '''
+        按行筛选记录，不再有记录的主键被删除
+
+        Args:
+            rowFlags (numpy.ndarray): 逐行的布尔标记，True表示保留
+
+        Returns:
+            CMSBTable: 新表
+        '''
+        self.compact()
+        keyPos = self.rowKeyPos()[rowFlags]
+        counts = np.bincount(keyPos, minlength=len(self.primKeys))
+        keyFlags = counts > 0
+        offsets = np.zeros(keyFlags.sum() + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts[keyFlags])
+        columns = [column[rowFlags] for column in self.columns]
+        mask = self.mask[rowFlags] if self.mask is not None else None
+        return CMSBTable(self.fieldName2Index, columns, self.primKeys[keyFlags], offsets, mask, self.vocabs, self.columnTypes)
+
+
+class CMSBTableBuilder(object):
+    '''
+    逐条添加记录并构建列式表。记录按块转换为numpy数组，避免长期持有逐格的Python对象
+    '''
+    def __init__(self, fieldName2Index, primFieldName, chunkSize=65536, columnTypes=None):
+        '''
+        Args:
+            fieldName2Index (dict): 字段索引
+            primFieldName (str): 主字段名，只构建各字段数组时可为None
+            chunkSize (int): 每块记录数
+            columnTypes (dict): 需整列编码的字段类型，格式为{字段索引: 字段类型}
+        '''
+        self.fieldName2Index = fieldName2Index
+        self.primFieldName = primFieldName
+        self.chunkSize = chunkSize
+        self.columnTypes = columnTypes or {}
+        self.rows = []
+        self.chunks = [[] for i in range(len(fieldName2Index))]
+        self.nRows = 0  # 已添加且尚未构建的记录数
+
+    def __len__(self):
+        return self.nRows
+
+    def add(self, fields):
+        '''
+        添加一项新记录(字段列表)
+
+        Args:
+            fields (list): 字段列表
+        '''
+        self.rows.append(fields)
+        self.nRows += 1
+        if len(self.rows) >= self.chunkSize:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        for j, values in enumerate(zip(*self.rows)):
+            self.chunks[j].append(np.array(values))
+        self.rows = []
+
+    def buildColumns(self):
+        '''
+        构建按添加顺序排列的各字段数组，枚举类与日期类字段整列编码
+
+        Returns:
+            list: 各字段数组
+            dict: 枚举类字段的词表
+        '''
+        self.flush()
+        columns = [np.concatenate(chunks) if chunks else np.array([]) for chunks in self.chunks]
+        self.chunks = [[] for i in range(len(self.fieldName2Index))]
+        self.nRows = 0
+        return encodeColumns(columns, self.columnTypes)
+
+    def build(self):
+        '''
+        构建列式表
+
+        Returns:
+            CMSBTable: 列式表
+        '''
+        columns, vocabs = self.buildColumns()
+        return groupColumns(self.fieldName2Index, columns, self.fieldName2Index[self.primFieldName], vocabs, self.columnTypes)
+
+
+def encodeColumns(columns, columnTypes):
+    '''
+    对需整列编码的字段(枚举类、日期类)的字符串数组编码
+
+    Args:
+        columns (list): 各字段数组
+        columnTypes (dict): 需整列编码的字段类型，格式为{字段索引: 字段类型}
+
+    Returns:
+        list: 各字段数组，枚举类字段为代码数组，日期类字段为天数数组
+        dict: 枚举类字段的词表，格式为{字段索引: 词表}
+    '''
+    columns = list(columns)
+    vocabs = {}
+    for fieldIndex, type_ in columnTypes.iteritems():
+        columns[fieldIndex], vocab = type_.encodeColumn(columns[fieldIndex])
+        if vocab is not None:
+            vocabs[fieldIndex] = vocab
+    return columns, vocabs
+
+
+def mergeVocabs(blockVocabs):
+    '''
+    合并各块的词表，并给出各块代码到合并后代码的映射
+
+    Args:
+        blockVocabs (list): 各块的词表
+
+    Returns:
+        numpy.ndarray: 合并后的词表
+        list: 各块的代码映射，block代码k对应合并后代码mappings[block][k]
+    '''
+    vocab = np.unique(np.concatenate(blockVocabs)) if blockVocabs else np.array([], dtype=str)
+    mappings = [np.searchsorted(vocab, blockVocab).astype(codeType(len(vocab))) for blockVocab in blockVocabs]
+    return vocab, mappings
+
+
+def groupColumns(fieldName2Index, columns, primFieldIndex, vocabs=None, columnTypes=None):
+    '''
+    将按读入顺序排列的各字段数组按主键分组，构建列式表
+
+    Args:
+        fieldName2Index (dict): 字段索引
+        columns (list): 各字段数组
+        primFieldIndex (int): 主字段索引
+        vocabs (dict): 枚举类字段的词表
+        columnTypes (dict): 整列编码的字段类型
+
+    Returns:
+        CMSBTable: 列式表
+    '''
+    keys, keyPos = np.unique(columns[primFieldIndex], return_inverse=True)
+    order = np.argsort(keyPos, kind='mergesort')  # 稳定排序，保持同一主键内的读入顺序
+    columns = [column[order] for column in columns]
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(keyPos, minlength=len(keys)))
+    return CMSBTable(fieldName2Index, columns, keys, offsets, vocabs=vocabs, columnTypes=columnTypes)
+
+
+def slotColumns(fieldName2Index, columns, slots, nSlots, primFieldIndex, defaults, vocabs=None, columnTypes=None):
+    '''
+    将按读入顺序排列的各字段数组按主键和月份槽位存放，构建列式表。
+    第i个主键第j个月的记录位于第 i * nSlots + j 行，缺失的月份取默认值；同一槽位有多条记录时保留最后一条
+
+    Args:
+        fieldName2Index (dict): 字段索引
+        columns (list): 各字段数组
+        slots (numpy.ndarray): 每行记录所属的月份槽位
+        nSlots (int): 月份数
+        primFieldIndex (int): 主字段索引
+        defaults (list): 各字段的默认值，顺序与字段索引一致
+        vocabs (dict): 枚举类字段的词表
+        columnTypes (dict): 整列编码的字段类型
+
+    Returns:
+        CMSBTable: 列式表
+    '''
+    keys, keyPos = np.unique(columns[primFieldIndex], return_inverse=True)
+    dest = keyPos * nSlots + slots
+    columns = list(columns)
+    defaults = list(defaults)
+    vocabs = dict(vocabs or {})
+    for fieldIndex, vocab in vocabs.items():  # 默认值加入词表，缺失月份填入其代码
+        vocab, (mapping, defaultCode) = mergeVocabs([vocab, np.array([defaults[fieldIndex]])])
+        columns[fieldIndex] = mapping[columns[fieldIndex]]
+        defaults[fieldIndex] = defaultCode[0]
+        vocabs[fieldIndex] = vocab
+    slotted = []
+    for column, default in zip(columns, defaults):
+        values = np.empty(len(keys) * nSlots, dtype=column.dtype)
+        values[:] = default
+        values[dest] = column
+        slotted.append(values)
+    mask = np.zeros(len(keys) * nSlots, dtype=bool)
+    mask[dest] = True
+    offsets = np.arange(len(keys) + 1, dtype=np.int64) * nSlots
+    return CMSBTable(fieldName2Index, slotted, keys, offsets, mask, vocabs, columnTypes)
+
+
+def asTable(fieldName2Index, samples):
+    '''
+    将表数据统一为列式表，原有字典格式的表数据会被转换
+
+    Args:
+        fieldName2Index (dict): 字段索引
+        samples (dict or CMSBTable): 表数据
+
+    Returns:
+        CMSBTable: 列式表
+    '''
+    if isinstance(samples, CMSBTable):
+        return samples
+    return CMSBTable.fromDict(fieldName2Index, samples)
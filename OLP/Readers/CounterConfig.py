@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import numpy
+from Sketches import Quantile, DistinctCount
 '''
 配置文件
 '''
@@ -14,6 +15,8 @@ contactAmountTitle = '签约数量'
 
 # 用户产品签约表、用户交易流水表中的客户号title
 custNoTitle = '我行客户号'
+# 交易流水表中的交易日期title，用于按时间窗口统计
+transDateTitle = '交易日期'
 
 # 贷款表
 # 客户号title
@@ -88,13 +91,20 @@ loanFeatTitle = {
     #'结清标志': bool,
     #'五级分类代码': str
 }
+# 合成特征表时，该时间段内没有交易流水或签约记录的客户的交易流水特征与签约数量的填充值
+transFeatFillValue = 0
+prodFeatFillValue = 0
 
 # 统计交易流水表中的下列属性，作为该表特征
 # 格式：{属性名：{
 # 'formula':'sum/count/average', # 统计公式：求和/统计次数/平均值
 # 'title':'折人民币',  # 统计哪一项
 # 'rules':{title1: value1,title2: value2 # 统计的筛选条件
+# 'window':30,  # 可选，只统计统计日期(含)之前30天内的交易，统计公式限sum/len/mean
 # }}
+# 统计公式也可以是Sketches中基于sketch的公式：Quantile(q)为分位数，DistinctCount()为不同取值个数，
+# 它们在有限内存内近似计算，且部分结果可以合并。
+# 带window与基于sketch的规则见下方的windowCountRules、sketchCountRules，默认不加入countRules
 countRules = {'notCorpIncomeTotalMoney':{'formula':sum,
                                    'title':'折人民币',
                                    'rules':{'借贷标志':True,'客户类型':'客户类型2'}
@@ -157,3 +167,50 @@ countRules = {'notCorpIncomeTotalMoney':{'formula':sum,
                                                  },
               }
 
+# 可选的交易流水特征，默认不统计，置为True时加入countRules
+# 近期交易：按时间窗口统计，统计时需要给出统计日期
+windowCount = False
+# 交易金额分布与分散程度：基于sketch，TransCounter.countSketches逐客户构建sketch，是较慢的统计路径
+sketchCount = False
+
+# 近期交易：统计日期之前7/30/90天内的收入、支出金额与笔数
+windowCountRules = {}
+for window in (7, 30, 90):
+    for direction, flag in (('Income', False), ('Outcome', True)):
+        windowCountRules['recent%s%dDaysTotalMoney' % (direction, window)] = {'formula':sum,
+                                                                            'title':'折人民币',
+                                                                            'rules':{'借贷标志':flag},
+                                                                            'window':window}
+        windowCountRules['recent%s%dDaysTotalCount' % (direction, window)] = {'formula':len,
+                                                                            'title':'折人民币',
+                                                                            'rules':{'借贷标志':flag},
+                                                                            'window':window}
+del window, direction, flag
+
+# 交易金额分布与交易对手、地区的分散程度
+sketchCountRules = {'transMoneyMedian':{'formula':Quantile(0.5),
+                                        'title':'折人民币',
+                                        'rules':{}
+                                        },
+                    'transMoneyP90':{'formula':Quantile(0.9),
+                                     'title':'折人民币',
+                                     'rules':{}
+                                     },
+                    'rivalBankDistinctCount':{'formula':DistinctCount(),
+                                              'title':'对方银行名称',
+                                              'rules':{}
+                                              },
+                    'tradeRegionDistinctCount':{'formula':DistinctCount(),
+                                                'title':'交易发生地行政区',
+                                                'rules':{}
+                                                },
+                    'tradeDestRegionDistinctCount':{'formula':DistinctCount(),
+                                                    'title':'交易去向行政区',
+                                                    'rules':{}
+                                                    },
+                    }
+
+if windowCount:
+    countRules.update(windowCountRules)
+if sketchCount:
+    countRules.update(sketchCountRules)
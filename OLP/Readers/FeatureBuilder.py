@@ -1,81 +1,91 @@
 # coding: utf-8
 
 from CounterConfig import loanCustNoTitle, custNoTitle, loanNoTitle, contactAmountTitle
-from CounterConfig import loanFeatTitle
+from CounterConfig import loanFeatTitle, transFeatFillValue, prodFeatFillValue
+from CMSBTable import asTable
+from KeyJoin import joinIndex, gatherRows
+import numpy as np
 
 
 class FeatureBuilder:
     '''
     根据输入的各个表的特征，合成成一张特征表。在建立该类对象后，利用buildFeature方法获取。
     '''
-    def __init__(self, loanTable, transFeatTable, prodFeatTable):
+    fieldNames = [loanCustNoTitle, loanNoTitle] + sorted(loanFeatTitle)  # 需要读取的贷款表字段
+
+    def __init__(self, loanTable, transFeatTable, prodFeatTable, transFillValue=transFeatFillValue, prodFillValue=prodFeatFillValue):
         '''
         :param loanTable: 贷款表的特征。格式 (特征表索引{特征名：该特征索引}, 贷款表特征{})
         :param transFeatTable: 交易流水特征表的特征。格式 (特征表索引{特征名：该特征索引}, 交易流水表特征{})
         :param prodFeatTable: 产品签约特征表的特征。格式 {用户号: 用户签约数量}
+        :param transFillValue: 交易流水特征表中没有的客户的交易流水特征
+        :param prodFillValue: 产品签约特征表中没有的客户的签约数量
         '''
         self.LTTitle2index, self.LTLoans, self.cust2Proto = loanTable
         self.TFTTitle2index, self.TFTTrans = transFeatTable
         self.prodFeatTable = prodFeatTable
+        self.transFillValue = transFillValue
+        self.prodFillValue = prodFillValue
         self.title2index = {}
 
-    def buildFeature(self):
+    def compileLayout(self, nMonths):
         '''
-        为每个协议号返回特征表。格式(特征表索引{特征名：该特征索引},[[贷款协议号，客户号，[特征1，特征2，...]]，[贷款协议号，客户号，[特征1，特征2，...]], ...])
-        :return:
+        编译特征布局：每个输出列来自哪张表的哪个字段(及哪个月份)，只计算一次，与字典顺序无关。
+        贷款表特征按字段名排序、每个字段依次展开各月份，其后为交易流水特征(按特征名排序，与贷款表重名的跳过)，最后为签约数量
+        :param nMonths: 贷款表的月份数
+        :return: 特征表索引{特征名：该特征索引}，贷款表特征 [(贷款表字段索引, 输出列)]，交易流水特征 [(交易流水特征索引, 输出列)]，签约数量的输出列
         '''
-        resultRecords = []
-        for exeTime,custNo in enumerate(self.LTLoans):
-            loanRecord = self.LTLoans[custNo]
-            transRecord = self.TFTTrans[custNo]
-            prodRecord = self.prodFeatTable[custNo]
-            # 计算该贷款的所有特征并返回
-            features = self.getFeature(exeTime, custNo, loanRecord, transRecord, prodRecord)
-            resultRecords.append([custNo, features])
-        return self.title2index, resultRecords
+        title2index = {}
+        propSet = set([loanCustNoTitle, custNoTitle, loanNoTitle])
+        loanPlan = []
+        for loanPropKey in sorted(self.LTTitle2index):
+            if loanPropKey not in propSet and loanPropKey in loanFeatTitle:
+                propSet.add(loanPropKey)
+                loanPlan.append((self.LTTitle2index[loanPropKey], len(title2index)))
+                for month in range(nMonths):
+                    title2index[loanPropKey + str(month)] = len(title2index)
+        transPlan = []
+        for transPropKey in sorted(self.TFTTitle2index):
+            if transPropKey not in propSet:
+                propSet.add(transPropKey)
+                transPlan.append((self.TFTTitle2index[transPropKey], len(title2index)))
+                title2index[transPropKey] = len(title2index)
+        prodColumn = len(title2index)
+        title2index[contactAmountTitle] = prodColumn
+        return title2index, loanPlan, transPlan, prodColumn
 
-    def getFeature(self, exeTime, customerNo, loanRecord, transRecord, prodRecord):
+    def buildMatrix(self, dtype=np.float64):
         '''
-        计算某个协议号的特征
-        :param exeTime: 第几次调用本函数
-        :param customerNo: 用户号
-        :param loanRecord: 贷款表
-        :param transRecord: 交易流水特征表
-        :param prodRecord: 产品签约特征表
-        :return: 该协议号的所有特征
+        按编译好的特征布局直接写入预先分配的 (客户数 × 特征数) 矩阵
+        :param dtype: 矩阵类型，float64或float32
+        :return: 特征表索引{特征名：该特征索引}，客户号数组，特征矩阵(第i行为第i个客户的特征)
         '''
-        record = []
-        # 记录加入了哪些特征title，用以避免添加重复特征
-        propList = [loanCustNoTitle, custNoTitle, loanNoTitle]
-        # 特征在list中的索引值
-        index = 0
-        # 提取了几个月的数据
-        months = range(len(loanRecord[0]))
-
-        # 加入贷款表中的特征
-        for loanPropKey in self.LTTitle2index:
-            if loanPropKey not in propList and loanFeatTitle.has_key(loanPropKey):
-                for month in months:
-                    record.append(loanRecord[self.LTTitle2index[loanPropKey]][month])
-                    propList.append(loanPropKey)
-                    #如果第一次执行该函数，则将该特征的索引加入“特征表索引”
-                    if exeTime == 0:
-                        self.title2index[loanPropKey + str(month)] = index
-                        index += 1
-        # 加入交易流水特征表中的特征
-        for transPropKey in self.TFTTitle2index:
-            if transPropKey not in propList:
-                record.append(transRecord[self.TFTTitle2index[transPropKey]])
-                propList.append(transPropKey)
-                if exeTime == 0:
-                    self.title2index[transPropKey] = index
-                    index += 1
-
-        # 加入产品签约特征表中的特征
-        record.append(prodRecord)
-        propList.append(contactAmountTitle)
-        if exeTime == 0:
-            self.title2index[contactAmountTitle] = index
-            index += 1
+        loans = asTable(self.LTTitle2index, self.LTLoans)
+        loans.compact()
+        custNos = loans.primKeys
+        nMonths = loans.nRows() // len(custNos) if len(custNos) > 0 else 0
+        title2index, loanPlan, transPlan, prodColumn = self.compileLayout(nMonths)
+        self.title2index = title2index
+        X = np.empty((len(custNos), len(title2index)), dtype=dtype)
+        # 贷款表特征：每个字段的 (客户数 × 月份数) 矩阵整块写入
+        for fieldIndex, column in loanPlan:
+            X[:, column:column + nMonths] = loans.columns[fieldIndex].reshape(len(custNos), nMonths)
+        # 交易流水特征与签约数量：按客户号连接，缺失的客户填充默认值
+        transIndexes = [transIndex for transIndex, column in transPlan]
+        transColumns = [column for transIndex, column in transPlan]
+        transKeys = list(self.TFTTrans)
+        transMatrix = np.array([[self.TFTTrans[custNo][transIndex] for transIndex in transIndexes] for custNo in transKeys],
+                               dtype=dtype).reshape(len(transKeys), len(transIndexes))
+        X[:, transColumns] = gatherRows(transMatrix, joinIndex(custNos, transKeys), self.transFillValue)
+        prodKeys = list(self.prodFeatTable)
+        prodValues = np.array([self.prodFeatTable[custNo] for custNo in prodKeys], dtype=dtype)
+        X[:, prodColumn] = gatherRows(prodValues, joinIndex(custNos, prodKeys), self.prodFillValue)
+        return title2index, custNos, X
 
-        return record
\ No newline at end of file
+    def buildFeature(self):
+        '''
+        为每个协议号返回特征表。格式(特征表索引{特征名：该特征索引},[[客户号，[特征1，特征2，...]]，[客户号，[特征1，特征2，...]], ...])
+        :return:
+        '''
+        title2index, custNos, X = self.buildMatrix()
+        return title2index, [[custNo, features] for custNo, features in zip(custNos.tolist(), X.tolist())]
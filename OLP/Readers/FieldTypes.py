@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+'''
+fieldName2fieldType中可使用的特殊字段类型。
+
+这些类型读入时与str相同不做逐行转换，构建列式表时再由encodeColumn对整列编码
+'''
+
+import datetime
+import numpy as np
+
+
+def codeType(vocabSize):
+    '''
+    能容纳词表全部代码的最小整数类型
+    '''
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if vocabSize <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.int64
+
+
+class Category(object):
+    '''
+    枚举类字段类型：取值为少量字符串之一，编码为小整数代码数组和该字段的词表
+    '''
+    __name__ = 'category'
+    identity = True  # 切分后的字符串即为读入结果，逐行转换时跳过
+
+    def __call__(self, value=''):
+        return value
+
+    def __repr__(self):
+        return self.__name__
+
+    def encodeColumn(self, column):
+        '''
+        Args:
+            column (numpy.ndarray): 字符串数组
+
+        Returns:
+            numpy.ndarray: 代码数组
+            numpy.ndarray: 按升序排列的词表，第k个取值对应代码k
+        '''
+        vocab, codes = np.unique(column.astype(str), return_inverse=True)
+        return codes.astype(codeType(len(vocab))), vocab
+
+
+class Date(object):
+    '''
+    日期类字段类型：'年/月/日' 格式的字符串编码为int32的天数(距1970/1/1)，
+    空字符串及无法解析的取值编码为NaT。同一字符串只解析一次
+    '''
+    __name__ = 'date'
+    identity = True
+    NaT = np.iinfo(np.int32).min  # 缺失日期
+    missing = NaT  # 缺失月份的默认值
+    epoch = datetime.date(1970, 1, 1).toordinal()
+
+    def __init__(self, separator='/'):
+        self.separator = separator
+
+    def __call__(self, value=''):
+        return value
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__name__, self.separator)
+
+    def encodeColumn(self, column):
+        '''
+        Args:
+            column (numpy.ndarray): 字符串数组
+
+        Returns:
+            numpy.ndarray: 天数数组
+            None: 日期类字段没有词表
+        '''
+        strs, indexes = np.unique(column.astype(str), return_inverse=True)
+        return self.parse(strs.tolist())[indexes], None
+
+    def parse(self, strs):
+        '''
+        将日期字符串列表转换为天数数组
+        '''
+        days = np.empty(len(strs), dtype=np.int32)
+        for i, string in enumerate(strs):
+            try:
+                year, month, day = string.split(self.separator)
+                days[i] = datetime.date(int(year), int(month), int(day)).toordinal() - self.epoch
+            except ValueError:
+                days[i] = self.NaT
+        return days
+
+    def format(self, days):
+        '''
+        将天数数组转换回 '年/月/日' 格式的字符串数组，NaT转换为空字符串
+        '''
+        values, indexes = np.unique(days, return_inverse=True)
+        strs = []
+        for value in values.tolist():
+            if value == self.NaT:
+                strs.append('')
+            else:
+                d = datetime.date.fromordinal(value + self.epoch)
+                strs.append('%d%s%d%s%d' % (d.year, self.separator, d.month, self.separator, d.day))
+        return np.array(strs, dtype=str)[indexes] if strs else np.array([], dtype=str)
+
+
+category = Category()
+date = Date()
+
+
+def isIdentity(type_):
+    '''
+    字段类型是否无需逐行转换
+    '''
+    return type_ is str or getattr(type_, 'identity', False)
+
+
+def isColumnar(type_):
+    '''
+    字段类型是否需要整列编码
+    '''
+    return hasattr(type_, 'encodeColumn')
+
+
+def isDate(type_):
+    return isinstance(type_, Date)
+
+
+def defaultValue(type_):
+    '''
+    字段类型的默认值，用于填充缺失月份
+    '''
+    return type_.missing if hasattr(type_, 'missing') else type_()
+
+
+def toDays(value, separator='/'):
+    '''
+    将单个日期(字符串或datetime)转换为天数
+    '''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.toordinal() - Date.epoch
+    return int(Date(separator).parse([value])[0])
+
+
+def toMonths(days):
+    '''
+    将天数数组转换为月份序数(年 * 12 + 月 - 1)，用于按年月比较
+    '''
+    return np.asarray(days, dtype=np.int32).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) + 1970 * 12
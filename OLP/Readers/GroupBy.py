@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from FieldTypes import Date
+
+
+# 统计公式与向量化聚合的对应关系
+aggregatorNames = {
+    sum: 'sum',
+    len: 'count',
+    np.sum: 'sum',
+    np.mean: 'mean',
+    min: 'min',
+    max: 'max',
+    np.min: 'min',
+    np.max: 'max',
+}
+
+# 可按行区间分段聚合的聚合及对应的ufunc
+segmentUfuncs = {
+    'sum': np.add,
+    'min': np.minimum,
+    'max': np.maximum,
+}
+
+
+def reduceSegments(name, values, offsets, empty=0):
+    '''
+    按行区间分段聚合：第i段为 values[offsets[i]:offsets[i + 1]]，每段沿第0维聚合，
+    二维数组的各列(如各月份)一次完成
+
+    Args:
+        name (str): 聚合名称，sum/count/mean/min/max
+        values (numpy.ndarray): 按段连续存放的数据
+        offsets (numpy.ndarray): 段边界
+        empty: 空段的结果
+
+    Returns:
+        numpy.ndarray: 第i行为第i段的聚合结果
+    '''
+    counts = np.diff(offsets)
+    shape = (len(counts),) + values.shape[1:]
+    if name == 'count':
+        return np.broadcast_to(counts.reshape((-1,) + (1,) * (values.ndim - 1)), shape).astype(float)
+    if name == 'mean':
+        sums = reduceSegments('sum', values, offsets, empty)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts.reshape((-1,) + (1,) * (values.ndim - 1))
+        means[counts == 0] = empty
+        return means
+    result = np.full(shape, empty, dtype=float)
+    nonEmpty = np.flatnonzero(counts > 0)
+    if len(nonEmpty) > 0:
+        result[nonEmpty] = segmentUfuncs[name].reduceat(values[:offsets[-1]], offsets[nonEmpty], axis=0)
+    return result
+
+
+class GroupBy(object):
+    '''
+    按整数编码的分组键对整列数据做向量化聚合：求和、计数、均值用np.bincount，
+    记录已按分组连续存放时最小值、最大值用np.minimum/np.maximum.reduceat，否则用ufunc.at。
+    各聚合都可以传入逐行的布尔标记，只统计标记为True的行
+    '''
+    def __init__(self, keyPos, nKeys, offsets=None):
+        '''
+        Args:
+            keyPos (numpy.ndarray): 每行记录所属分组的编号
+            nKeys (int): 分组数
+            offsets (numpy.ndarray): 记录已按分组连续存放时的分组边界，第i组为 offsets[i]:offsets[i + 1]
+        '''
+        self.keyPos = keyPos
+        self.nKeys = nKeys
+        self.offsets = offsets
+
+    @classmethod
+    def fromTable(cls, table):
+        '''
+        按列式表(CMSBTable)的主键分组
+        '''
+        table.compact()
+        return cls(table.rowKeyPos(), len(table.primKeys), table.offsets)
+
+    def aggregate(self, name, values, flags=None):
+        '''
+        Args:
+            name (str): 聚合名称，sum/count/mean/min/max
+            values (numpy.ndarray): 逐行的统计值
+            flags (numpy.ndarray): 逐行的布尔标记
+
+        Returns:
+            numpy.ndarray: 逐分组的聚合结果，没有记录的分组求和、计数为0，其余为nan
+        '''
+        return getattr(self, name)(values, flags)
+
+    def count(self, values=None, flags=None):
+        keyPos = self.keyPos if flags is None else self.keyPos[flags]
+        return np.bincount(keyPos, minlength=self.nKeys)
+
+    def sum(self, values, flags=None):
+        if flags is not None:
+            return np.bincount(self.keyPos[flags], weights=values[flags], minlength=self.nKeys)
+        return np.bincount(self.keyPos, weights=values, minlength=self.nKeys)
+
+    def mean(self, values, flags=None):
+        counts = self.count(flags=flags)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum(values, flags) / counts
+
+    def min(self, values, flags=None):
+        return self.extreme(np.minimum, np.inf, values, flags)
+
+    def max(self, values, flags=None):
+        return self.extreme(np.maximum, -np.inf, values, flags)
+
+    def extreme(self, ufunc, identity, values, flags):
+        values = np.asarray(values, dtype=float)
+        if flags is not None:
+            values = np.where(flags, values, identity)
+        if self.offsets is not None:
+            result = np.full(self.nKeys, identity)
+            nonEmpty = np.flatnonzero(np.diff(self.offsets) > 0)
+            if len(nonEmpty) > 0:
+                result[nonEmpty] = ufunc.reduceat(values, self.offsets[nonEmpty])
+        else:
+            result = np.full(self.nKeys, identity)
+            ufunc.at(result, self.keyPos, values)
+        result[result == identity] = np.nan  # 没有记录的分组
+        return result
+
+
+class WindowIndex(object):
+    '''
+    时间窗口聚合：记录按 (分组, 日期) 排序，任一分组在任一时间窗口内的记录为连续的一段，
+    段边界由两次二分查找得到。次数由整数前缀和相减得到；和直接对每段求和(np.add.reduceat)，
+    不用浮点前缀和相减，避免前缀很大时的相消误差。同一列排序后的统计值可用于多个窗口
+    '''
+    def __init__(self, keyPos, nKeys, days):
+        '''
+        Args:
+            keyPos (numpy.ndarray): 每行记录所属分组的编号
+            nKeys (int): 分组数
+            days (numpy.ndarray): 每行记录的日期(int32天数，缺失为Date.NaT)
+        '''
+        self.nKeys = nKeys
+        self.order = np.lexsort((days, keyPos))  # 组内按日期排序，缺失日期排在最前且不落入任何窗口
+        # 排序键：高32位为分组编号，低32位为平移到非负的天数
+        self.sortKeys = (keyPos[self.order].astype(np.int64) << 32) | (days[self.order].astype(np.int64) - Date.NaT)
+        self.keyBase = np.arange(nKeys, dtype=np.int64) << 32
+
+    @classmethod
+    def fromTable(cls, table, dateFieldName):
+        '''
+        按列式表(CMSBTable)的主键分组，dateFieldName为日期字段
+        '''
+        table.compact()
+        return cls(table.rowKeyPos(), len(table.primKeys), table.dateColumn(dateFieldName))
+
+    def sortValues(self, values, flags=None):
+        '''
+        按 (分组, 日期) 排列统计值，供window对各窗口直接求和；次数另求整数前缀和
+
+        Args:
+            values (numpy.ndarray): 逐行的统计值
+            flags (numpy.ndarray): 逐行的布尔标记，只统计标记为True的行
+
+        Returns:
+            tuple: 排序后的统计值(不统计的行为0，末尾补一个0)与前缀计数(首项为0)
+        '''
+        if flags is None:
+            flags = np.ones(len(values), dtype=bool)
+        flags = flags[self.order]
+        values = np.concatenate([np.where(flags, np.asarray(values, dtype=float)[self.order], 0.0), [0.0]])
+        counts = np.concatenate([[0], np.cumsum(flags, dtype=np.int64)])
+        return values, counts
+
+    def window(self, sortedValues, stop, length):
+        '''
+        各分组在时间窗口 (stop - length, stop] 内的和与次数
+
+        Args:
+            sortedValues (tuple): sortValues的结果
+            stop (int): 窗口结束日期(天数)，包含当天
+            length (int): 窗口天数
+
+        Returns:
+            numpy.ndarray: 逐分组的和
+            numpy.ndarray: 逐分组的次数
+        '''
+        values, counts = sortedValues
+        lo = np.searchsorted(self.sortKeys, self.keyBase | max(stop - length - Date.NaT, 0), 'right')
+        hi = np.searchsorted(self.sortKeys, self.keyBase | max(stop - Date.NaT, 0), 'right')
+        sums = np.zeros(self.nKeys)
+        nonEmpty = np.flatnonzero(hi > lo)
+        if len(nonEmpty) > 0:
+            # 段边界交错排列，偶数位的结果即各段 [lo, hi) 的和；hi最大为记录数，落在末尾补的0上
+            bounds = np.column_stack((lo[nonEmpty], hi[nonEmpty])).ravel()
+            sums[nonEmpty] = np.add.reduceat(values, bounds)[::2]
+        return sums, counts[hi] - counts[lo]
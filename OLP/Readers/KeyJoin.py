@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+'''
+按主键(如客户号)连接多张表：主键先统一编码为整数，右表整数主键排序后对左表主键二分查找，
+再按查到的位置整块取出右表的行，右表缺少的主键填充指定值
+'''
+
+import numpy as np
+
+
+def joinIndex(leftKeys, rightKeys):
+    '''
+    为左表每个主键找到右表中相同主键的位置
+
+    Args:
+        leftKeys (numpy.ndarray): 左表主键
+        rightKeys (numpy.ndarray): 右表主键，不要求有序，不应有重复
+
+    Returns:
+        numpy.ndarray: 右表中的行位置，右表没有该主键时为-1
+    '''
+    leftKeys = np.asarray(leftKeys).astype(str)
+    rightKeys = np.asarray(rightKeys).astype(str)
+    if len(leftKeys) == 0 or len(rightKeys) == 0:
+        return np.full(len(leftKeys), -1, dtype=np.int64)
+    # 两表主键统一编码为整数，相同主键编码相同
+    codes = np.unique(np.concatenate([leftKeys, rightKeys]), return_inverse=True)[1]
+    leftCodes, rightCodes = codes[:len(leftKeys)], codes[len(leftKeys):]
+    order = np.argsort(rightCodes, kind='mergesort')
+    sortedCodes = rightCodes[order]
+    poses = np.minimum(np.searchsorted(sortedCodes, leftCodes), len(sortedCodes) - 1)
+    return np.where(sortedCodes[poses] == leftCodes, order[poses], -1).astype(np.int64)
+
+
+def gatherRows(values, poses, fillValue=0):
+    '''
+    按行位置取出右表的行，位置为-1的行填充fillValue
+
+    Args:
+        values (numpy.ndarray): 右表数据，第0维为行
+        poses (numpy.ndarray): joinIndex得到的行位置
+        fillValue: 缺失行的填充值
+
+    Returns:
+        numpy.ndarray: 与poses一一对应的行
+    '''
+    missing = poses < 0
+    if len(values) == 0:
+        return np.full((len(poses),) + values.shape[1:], fillValue, dtype=np.result_type(values, np.asarray(fillValue)))
+    rows = values[np.where(missing, 0, poses)]
+    if missing.any():
+        rows = rows.astype(np.result_type(rows, np.asarray(fillValue)))
+        rows[missing] = fillValue
+    return rows
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 
-from ReaderTools import TimeTools
+import numpy as np
 import CounterConfig
+from CMSBTable import asTable
+from GroupBy import reduceSegments
+from KeyJoin import joinIndex, gatherRows
+from FieldTypes import Date, toDays, toMonths
 
 
 class LabelReader:
@@ -17,6 +21,7 @@ class LabelReader:
     lastRepayDate = CounterConfig.lastRepayDate
     shouldRepayDate = CounterConfig.shouldRepayDate
     defaultDebtDate = CounterConfig.defaultDate
+    fieldNames = [custNo, debtDate, statDate, lastRepayDate, shouldRepayDate]  # 需要读取的贷款表字段
 
     def __init__(self, loans4Labeling, loansFiltered):
         '''
@@ -30,67 +35,89 @@ class LabelReader:
     def readLabel(self):
         '''
         从贷款表中得到每一行的信誉度，良好或不良。
+        规则在整张贷款表的日期列上一次判断，再按协议、按客户做或运算
         :param table4Labeling: 已经读取且去重的贷款协议表
         :return: [[客户号，是否不良]，[客户号，是否不良]，……]
         '''
-        cust2prot = self.table4Labeling[2]
-        tableContentDict = self.table4Labeling[1]
-        self.title2index = self.table4Labeling[0]
-        loanReputations = []
+        loans, columns = self.readColumns()
+        protoFlags = loans.reduceRows(self.calculateReputation(columns))
+        custs, reputs = self.reduceCusts(loans, protoFlags)
+        return [[cust, int(reput)] for cust, reput in zip(custs, reputs.tolist())]
 
-        for cust in cust2prot:
-            reput = 0
-            for proto in cust2prot[cust]:
-                if self.calculateReputation(tableContentDict[proto]) == 1:
-                    reput = 1
-                    break
-            loanReputations.append([cust, reput])
-        return loanReputations
-        # for tableKey in tableContentDict:
-        #     if tableKey in self.tableFiltered:
-        #         loanReputationRecord = self.getReputation(tableContentDict[tableKey], tableKey)
-        #         loanReputations.append(loanReputationRecord)
-        # return loanReputations
+    def readLabels(self, horizons):
+        '''
+        一次得到多个标签期限的信誉度：期限为h个月时，标签贷款表前h个月份(按读表时的月份槽位)任一月份不良即为不良，
+        与只读取前h个月份的贷款表调用readLabel结果相同。
+        规则只判断一次，逐月份的结果按协议汇总后沿月份做累积或运算，再取各期限对应的月份
+        :param horizons: 标签期限(月数)列表，如[1, 2, 3, 6]
+        :return: [[客户号，[期限1是否不良，期限2是否不良，……]]，……]
+        '''
+        loans, columns = self.readColumns()
+        rowFlags = self.calculateReputation(columns)
+        keyPos = loans.rowKeyPos()
+        slots = np.arange(len(keyPos)) - loans.offsets[keyPos]  # 每行记录在其协议中的月份槽位
+        nMonths = max(horizons)
+        rowFlags &= slots < nMonths
+        # 协议 × 月份 的规则命中矩阵，沿月份累积或运算后第h - 1列即为期限h的结果
+        hits = np.zeros((len(loans.primKeys), nMonths), dtype=bool)
+        hits[keyPos[rowFlags], slots[rowFlags]] = True
+        protoFlags = np.logical_or.accumulate(hits, axis=1)[:, [horizon - 1 for horizon in horizons]]
+        custs, reputs = self.reduceCusts(loans, protoFlags)
+        return [[cust, [int(reput) for reput in custReputs]] for cust, custReputs in zip(custs, reputs.tolist())]
 
-    # def getReputation(self, contentDictValue, tableKey):
-    #     '''
-    #     得到该条记录的信誉度。
-    #     :param contentDictValue:
-    #     :param tableKey:
-    #     :return: [协议号，客户号，是否不良]
-    #     '''
-    #     return [tableKey, contentDictValue[self.title2index[self.custNo]][0], self.calculateReputation(contentDictValue)]
+    def readColumns(self):
+        '''
+        读取需要打标签的贷款表，各日期字段整列转换为天数，规则中只比较整数
+        :return: 贷款表(CMSBTable)，{日期字段名: 天数数组}
+        '''
+        self.title2index = self.table4Labeling[0]
+        loans = asTable(self.title2index, self.table4Labeling[1])
+        columns = dict((fieldName, loans.dateColumn(fieldName))
+                       for fieldName in (self.debtDate, self.statDate, self.lastRepayDate, self.shouldRepayDate))
+        self.defaultDebtDays = toDays(self.defaultDebtDate)
+        return loans, columns
 
-    def calculateReputation(self, contentDictValue):
+    def reduceCusts(self, loans, protoFlags):
         '''
-        该条记录是否是不良贷款，1代表是不良贷款，0代表不是
-        :param contentDictValue:
-        :return: 1 or 0.
+        将逐协议的标记按客户做或运算
+        :param loans: 贷款表(CMSBTable)
+        :param protoFlags: 逐协议的布尔标记，二维时每列分别运算
+        :return: 客户号列表，逐客户的布尔标记
         '''
-        return self.rule1(contentDictValue)
+        cust2prot = self.table4Labeling[2]
+        # 客户的各协议连续存放，第i个客户的协议为 protos[offsets[i]:offsets[i + 1]]
+        custs = list(cust2prot)
+        protos = [proto for cust in custs for proto in cust2prot[cust]]
+        offsets = np.zeros(len(custs) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(cust2prot[cust]) for cust in custs])
+        # 标签贷款表中没有的协议不判为不良
+        flags = gatherRows(protoFlags, joinIndex(protos, loans.primKeys), False)
+        return custs, reduceSegments('max', flags.astype(float), offsets) > 0
 
-    def rule1(self, contentDictValue):
-        '''
-        欠款月份是否等于统计月份，如果是，则返回1。根据每个贷款记录有多少个月份的数据，循环月份数量的次数
-        :param contentDictValue:
-        :return: 1 or 0.
-        '''
-        for listSize in range(len(contentDictValue[1])):
-            debtDate = TimeTools().str2Date(contentDictValue[self.title2index[self.debtDate]][listSize], "/")
-            statDate = TimeTools().str2Date(contentDictValue[self.title2index[self.statDate]][listSize], "/")
-            if debtDate.year == statDate.year and debtDate.month == statDate.month:
-                return 1
-        return self.rule2(contentDictValue)
+    def calculateReputation(self, columns):
+        '''
+        逐行判断是否是不良贷款，任一规则成立即为不良
+        :param columns: 各日期字段的整列天数，格式{日期字段名: 天数数组}
+        :return: 逐行的布尔标记
+        '''
+        return self.rule1(columns) | self.rule2(columns)
 
-    def rule2(self, contentDictValue):
-        '''
-        最近欠款日期为默认值（贷款未结清），且未提前还款则返回1。根据每个贷款记录有多少个月份的数据，循环月份数量的次数
-        :param contentDictValue:
-        :return: True or False.
-        '''
-        for listSize in range(len(contentDictValue[1])):
-            lastRepayDate = TimeTools().str2Date(contentDictValue[self.title2index[self.lastRepayDate]][listSize], "/")
-            shouldRepayDate = TimeTools().str2Date(contentDictValue[self.title2index[self.shouldRepayDate]][listSize], "/")
-            if lastRepayDate > shouldRepayDate and contentDictValue[self.title2index[self.debtDate]][listSize] == self.defaultDebtDate:
-                return 1
-        return 0
+    def rule1(self, columns):
+        '''
+        欠款月份是否等于统计月份。没有记录的月份统计日期为NaT，不参与判断
+        :param columns:
+        :return: 逐行的布尔标记
+        '''
+        statDays = columns[self.statDate]
+        return (statDays != Date.NaT) & (toMonths(columns[self.debtDate]) == toMonths(statDays))
+
+    def rule2(self, columns):
+        '''
+        最近欠款日期为默认值（贷款未结清），且最近还款日期晚于应还款日期。没有记录的月份不参与判断，
+        应还款日期缺失(NaT为最小的整数)时无法比较，也不判为不良
+        :param columns:
+        :return: 逐行的布尔标记
+        '''
+        shouldRepayDays = columns[self.shouldRepayDate]
+        return (columns[self.statDate] != Date.NaT) & (shouldRepayDays != Date.NaT) & \
+               (columns[self.lastRepayDate] > shouldRepayDays) & (columns[self.debtDate] == self.defaultDebtDays)
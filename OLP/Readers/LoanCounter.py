@@ -2,14 +2,25 @@
 
 from CounterConfig import loanCountTitle, loanCustNoTitle, loanNoTitle # 该属性计算方式，客户号，贷款协议号
 from ReaderTools import UniPrinter
+from CMSBTable import asTable
+from GroupBy import aggregatorNames, reduceSegments
+import numpy as np
 
 class LoanCounter:
     '''
     生成新的贷款表，将每一个月内，同一用户的贷款数据进行合并。调用countLoan即可
     '''
-    def __init__(self, loanTable):
+    fieldNames = [loanCustNoTitle, loanNoTitle] + sorted(loanCountTitle)  # 需要读取的贷款表字段
+
+    def __init__(self, loanTable, vectorized=True):
+        '''
+        :param loanTable: 格式(特征索引{}, 贷款表{}, 客户号与协议号对应表{})
+        :param vectorized: 合并规则均为sum/len/mean/min/max时，是否对所有客户分段聚合
+        '''
         # 原始贷款表的 索引表，贷款表，客户与协议X对应表
         self.LTTitle2index, self.LTLoans, self.cust2Proto = loanTable
+        self.vectorized = vectorized
+        self.LTLoans = asTable(self.LTTitle2index, self.LTLoans)
 
     def countLoan(self):
         '''
@@ -19,28 +30,52 @@ class LoanCounter:
         newLoans = {}
         # 生成新贷款表的索引表
         title2index = self.buildIndex(loanCountTitle)
+        # 各属性的 (协议数 × 月份数) 矩阵，按月份直接取列
+        title2matrix = dict((titleKey, self.LTLoans.monthMatrix(titleKey)) for titleKey in loanCountTitle)
+        if self.vectorized and all(formula in aggregatorNames for formula in loanCountTitle.itervalues()):
+            return self.countLoanSegments(title2index, title2matrix)
+        months = range(title2matrix.values()[0].shape[1]) if title2matrix else []
         # 循环得到每个用户
         for custom in self.cust2Proto:
-            custProtoRecords = []
-            # 循环每个用户的贷款记录
-            for protoIndex in self.cust2Proto[custom]:
-                custProtoRecords.append(self.LTLoans[protoIndex])
+            # 该用户的所有贷款协议在表中的位置
+            protoPoses = [self.LTLoans.key2pos[protoIndex] for protoIndex in self.cust2Proto[custom]]
 
             # 存放某个用户的所有贷款
             newCustRecords = [ ]
 
             customs = []
-            for month in range(len(custProtoRecords[0][0])):
+            for month in months:
                 customs.append(custom)
             newCustRecords.append(customs)
 
             # 循环需要合并的贷款属性
             for titleKey in loanCountTitle:
-                newCustRecords.append(self.calcNewValue(custom, titleKey, custProtoRecords))
+                newCustRecords.append(self.calcNewValue(custom, titleKey, title2matrix[titleKey][protoPoses]))
 
             newLoans[custom] = newCustRecords
         return title2index, newLoans, self.cust2Proto
 
+    def countLoanSegments(self, title2index, title2matrix):
+        '''
+        对所有客户分段聚合：协议按客户排列一次，每个属性的 (协议数 × 月份数) 矩阵按客户分段，
+        一次reduceat得到所有客户所有月份的结果，没有协议的客户结果为0
+        :return: 格式同countLoan
+        '''
+        customs = list(self.cust2Proto)
+        protoPoses = [self.LTLoans.key2pos[protoIndex] for custom in customs for protoIndex in self.cust2Proto[custom]]
+        protoPoses = np.array(protoPoses, dtype=np.int64)
+        offsets = np.zeros(len(customs) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(self.cust2Proto[custom]) for custom in customs])
+        nMonths = title2matrix.values()[0].shape[1] if title2matrix else 0
+        title2result = {}
+        for titleKey in loanCountTitle:
+            matrix = title2matrix[titleKey][protoPoses]
+            title2result[titleKey] = reduceSegments(aggregatorNames[loanCountTitle[titleKey]], matrix, offsets).tolist()
+        newLoans = {}
+        for i, custom in enumerate(customs):
+            newLoans[custom] = [[custom] * nMonths] + [title2result[titleKey][i] for titleKey in loanCountTitle]
+        return title2index, newLoans, self.cust2Proto
+
     def buildIndex(self, loanCountTitle):
         '''
         产生新的索引表c
@@ -59,14 +94,14 @@ class LoanCounter:
         合并该月该用户该属性的所有值。合并规则存在loanCountTitle中
         :param custom:
         :param titleKey:
-        :param custProtoRecords:
+        :param custProtoRecords: 该用户所有协议该属性的 (协议数 × 月份数) 矩阵
         :return:
         '''
         formula = loanCountTitle[titleKey]
         result = []
 
-        for month in range(len(custProtoRecords[0][0])):
-            keyRecords = [x[self.LTTitle2index[titleKey]][month] for x in custProtoRecords]
+        for month in range(custProtoRecords.shape[1]):
+            keyRecords = custProtoRecords[:, month].tolist()
             if len(keyRecords) == 0:
                 result.append(0)
             else:
@@ -1,96 +1,215 @@
 # -*- coding: utf-8 -*-
 
+import numpy as np
+from CMSBTable import asTable
+from FieldTypes import Date, toMonths
+from CMSBCache import typeName
+from Pipeline import fingerprint
+
 
 class Filter(object):
+    '''
+    每个Filter类执行一条过滤规则，删除n条协议：只要协议在某个月命中规则即被删除
+    读入值和返回值都是 (title2index,loans,custo2protol)
+    '''
+    customID = '核心客户号'
+    fieldNames = []  # hit中用到的字段
+    pushDown = False  # 是否实现了hitRow，可下推到读表过程中
+    memoNames = ()  # 只作缓存的实例属性，不影响过滤结果，不计入getKey
+
+    def getFieldNames(self):
+        '''
+        过滤需要读取的贷款协议表字段
+        '''
+        return [self.customID] + list(self.fieldNames)
+
+    def getKey(self):
+        '''
+        过滤规则的稳定表示，用于生成读表缓存与流程阶段的缓存键：类名、类中各方法的字节码哈希与类属性，
+        以及构造时设置的实例属性(不含memoNames)，规则的实现或参数变化时随之变化
+        '''
+        cls = type(self)
+        attrs = {}
+        for klass in reversed(cls.__mro__):
+            for name, value in vars(klass).iteritems():
+                if name.startswith('__'):
+                    continue
+                attrs[name] = value.__func__ if isinstance(value, (staticmethod, classmethod)) else value
+        attrs.update((name, value) for name, value in vars(self).iteritems() if name not in self.memoNames)
+        return '%s%s' % (typeName(cls), fingerprint(attrs))
 
     def filter(self, title2index, loans, custo2protol):
+        return FilterEngine([self]).filter(title2index, loans, custo2protol)
+
+    def hit(self, title2index, loans):
+        '''
+        逐行判断记录是否命中过滤规则
+
+        Args:
+            title2index (dict): 字段索引
+            loans (CMSBTable): 贷款协议表数据
+
+        Returns:
+            numpy.ndarray: 逐行的布尔标记
+        '''
+        raise NotImplementedError
+
+    def hitRow(self, record):
+        '''
+        判断一条记录是否命中过滤规则，与hit逐行的结果一致。pushDown为True的过滤器需实现，
+        由CMSBReader.readLoans在读表时调用，命中的协议不再转换和保存
+
+        Args:
+            record (dict): 记录中fieldNames各字段转换后的取值，格式为{字段名: 取值}
+
+        Returns:
+            bool: 是否命中
+        '''
         raise NotImplementedError
 
+
 class CleanedLoanFilter(Filter):
     '''
-    每个Filter类执行一条过滤规则，删除n条协议
-    读入值和返回值都是 (title2index,loans,custo2protol)
+    删除已结清的协议
     '''
     cleanedFlag = '结清标志'
-    customID = '核心客户号'
+    fieldNames = [cleanedFlag]
+    pushDown = True
 
     def __init__(self):
         pass
 
-    def filter(self, title2index, loans, custo2protol):
+    def hit(self, title2index, loans):
         '''
         we delete some records which obey the rule of cleanedFlag.
         '''
-        # UniPrinter().pprint(title2index)
-        for key, loan in loans.items():
-            index = title2index[self.cleanedFlag]
-            customIndex = title2index[self.customID]
-            for i in range(len(loan[index])):
-                if loan[index][i] == True:
-                    del loans[key]
-                    values = custo2protol.get(loan[customIndex][i])
-                    values.remove(key)
-                    custo2protol[loan[customIndex][i]] = values
-                    break
-        return title2index, loans, custo2protol
+        return loans.equals(self.cleanedFlag, True)
+
+    def hitRow(self, record):
+        return record[self.cleanedFlag] == True
 
 
 class CustCodeFilter(Filter):
 
     fiveClassificationCode = '五级分类代码'
-    customID = '核心客户号'
+    fieldNames = [fiveClassificationCode]
+    pushDown = True
 
     def __init__(self):
         pass
 
-    def filter(self, title2index, loans, custo2protol):
+    def hit(self, title2index, loans):
         '''
         we delete some records which obey the rule of fiveClassificationCode.
         '''
-        for key, loan in loans.items():
-            index = title2index[self.fiveClassificationCode]
-            customIndex = title2index[self.customID]
-            for i in range(len(loan[index])):
-                if loan[index][i] != '五级分类代码3':
-                    del loans[key]
-                    values = custo2protol.get(loan[customIndex][i])
-                    values.remove(key)
-                    custo2protol[loan[customIndex][i]] = values
-                    break
-        return title2index, loans, custo2protol
+        return ~loans.equals(self.fiveClassificationCode, '五级分类代码3')
+
+    def hitRow(self, record):
+        return record[self.fiveClassificationCode] != '五级分类代码3'
 
 
 class ThisMonthLoanFilter(Filter):
 
     statData = '统计日期'
     lendingData = '放款日期'
-    customID = '核心客户号'
+    fieldNames = [statData, lendingData]
+    pushDown = True
+    memoNames = ('str2month',)
 
     def __init__(self):
-        pass
+        self.str2month = {}
 
-    def filter(self, title2index, loans, custo2protol):
+    def hit(self, title2index, loans):
         '''
         we delete some records which obey this rule.
         '''
-        for key, loan in loans.items():
-            index1 = title2index[self.statData]
-            index2 = title2index[self.lendingData]
-            customIndex = title2index[self.customID]
+        statDays = loans.dateColumn(self.statData)
+        lendingDays = loans.dateColumn(self.lendingData)
+        return (statDays != Date.NaT) & (lendingDays != Date.NaT) & (toMonths(statDays) == toMonths(lendingDays))
 
-            for i in range(len(loan[index1])):
-                if loan[index1][i] == '' or loan[index2][i] == '':
-                    continue
-                statDataList = loan[index1][i].split('/')
-                lendingDataList = loan[index2][i].split('/')
-                if statDataList[0] == lendingDataList[0] and statDataList[1] == lendingDataList[1]:
-                    del loans[key]
-                    values = custo2protol.get(loan[customIndex][i])
-                    values.remove(key)
-                    custo2protol[loan[customIndex][i]] = values
-                    break
+    def hitRow(self, record):
+        statMonth = self.getMonth(record[self.statData])
+        return statMonth is not None and statMonth == self.getMonth(record[self.lendingData])
+
+    def getMonth(self, value):
+        '''
+        日期字符串对应的月份序数，缺失或无法解析时为None。同一字符串只解析一次
+        '''
+        if value not in self.str2month:
+            days = Date().parse([value])
+            self.str2month[value] = None if days[0] == Date.NaT else int(toMonths(days)[0])
+        return self.str2month[value]
+
+
+class FilterEngine(object):
+    '''
+    将多条过滤规则合并为一次过滤：各过滤器的hit在列式贷款协议表上逐行求值并合并为一个布尔掩码，
+    按协议归约后一次删除所有命中协议，客户与协议对应表也只重建一次。
+    结果与依次调用各过滤器的filter相同。新的过滤器只需实现向量化的hit即可加入
+    '''
+    customID = Filter.customID
+
+    def __init__(self, filters):
+        '''
+        Args:
+            filters (list): 过滤器列表
+        '''
+        self.filters = filters
+
+    @classmethod
+    def fromNames(cls, filterNames):
+        return cls([getFilter(filterName) for filterName in filterNames])
+
+    def filter(self, title2index, loans, custo2protol):
+        '''
+        过滤贷款协议表，原地修改loans与custo2protol
+
+        Args:
+            title2index (dict): 字段索引
+            loans (CMSBTable or dict): 贷款协议表数据
+            custo2protol (dict): 客户号对应的协议号
+
+        Returns:
+            dict: 字段索引
+            CMSBTable: 过滤后的贷款协议表数据
+            dict: 过滤后的客户号对应的协议号
+        '''
+        loans = asTable(title2index, loans)
+        rowFlags = np.zeros(loans.nRows(), dtype=bool)
+        for filter_ in self.filters:
+            rowFlags |= filter_.hit(title2index, loans)
+        hitRows = np.flatnonzero(rowFlags & loans.present())  # 缺失月份不参与判断
+        if len(hitRows) == 0:
+            return title2index, loans, custo2protol
+        # 每个命中协议取第一条命中记录，用其客户号定位客户与协议对应表
+        hitPos, firsts = np.unique(loans.rowKeyPos()[hitRows], return_index=True)
+        custNos = np.unique(loans.column(self.customID)[hitRows[firsts]]).tolist()
+        self.deleteProtols(custo2protol, custNos, loans.primKeys[hitPos])
+        keyFlags = np.zeros(len(loans.primKeys), dtype=bool)
+        keyFlags[hitPos] = True
+        loans.deleteKeys(keyFlags)
         return title2index, loans, custo2protol
 
+    @staticmethod
+    def deleteProtols(custo2protol, custNos, keys):
+        '''
+        从客户与协议对应表中删除协议：涉及客户的协议号拼接为一个数组，一次判断是否属于删除的协议，
+        再按各客户的协议个数切分，保持原有顺序
+
+        Args:
+            custo2protol (dict): 客户号对应的协议号，原地修改
+            custNos (list): 涉及的客户号
+            keys (numpy.ndarray): 删除的协议号
+        '''
+        protolLists = [custo2protol[custNo] for custNo in custNos]
+        protols = np.array([protol for protolList in protolLists for protol in protolList])
+        keepFlags = ~np.in1d(protols, keys)
+        custPos = np.repeat(np.arange(len(custNos)), [len(protolList) for protolList in protolLists])
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(custPos[keepFlags], minlength=len(custNos)))]).tolist()
+        kept = protols[keepFlags].tolist()
+        for i, custNo in enumerate(custNos):
+            custo2protol[custNo] = kept[offsets[i]:offsets[i + 1]]
+
 
 def getFilter(name, param={}):
     modName, clsName = name.rsplit('.', 1)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+'''
+带缓存的多阶段流程：流程由命名的阶段组成有向无环图，每个阶段的输出持久化保存，
+缓存键由阶段名、阶段参数(相关配置、输入文件的路径/大小/修改时间等)及各输入阶段输出内容的哈希共同决定。
+再次运行时只重新计算输入或参数发生变化的阶段，上游阶段重新计算但输出内容不变时下游阶段仍命中缓存
+'''
+
+import os
+import time
+import pickle
+import shutil
+import hashlib
+import tempfile
+from CMSBCache import typeName
+
+
+def fingerprint(value):
+    '''
+    参数的稳定文本表示，用于生成缓存键：字典按键排序，函数与类型取typeName(模块名、名称及字节码哈希)，与内存地址无关
+    '''
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join('%s: %s' % (fingerprint(key), fingerprint(item))
+                                  for key, item in sorted(value.iteritems(), key=lambda pair: repr(pair[0])))
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ', '.join(fingerprint(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return 'set(%s)' % fingerprint(sorted(value))
+    if callable(value) and hasattr(value, '__name__'):
+        return typeName(value)
+    return repr(value)
+
+
+def fileStats(filenames):
+    '''
+    输入文件的路径、大小、修改时间，作为读表阶段的参数，文件变化时缓存失效
+    '''
+    stats = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        stats.append((os.path.abspath(filename), stat.st_size, stat.st_mtime))
+    return stats
+
+
+class Stage(object):
+    '''
+    流程中的一个阶段：func以各输入阶段的输出为参数(按inputs的顺序)，返回该阶段的输出
+    '''
+    def __init__(self, name, func, inputs=(), params=None, version=0):
+        '''
+        Args:
+            name (str): 阶段名
+            func (function): 计算函数，不应修改输入
+            inputs (list): 输入阶段名
+            params: 影响输出的参数(配置、输入文件等)，只用于生成缓存键
+            version (int): 计算逻辑变化时递增，旧的缓存随之失效
+        '''
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = params
+        self.version = version
+
+
+class StageCache(object):
+    '''
+    阶段输出的缓存：每个输出pickle为一个文件，同时保存输出内容的哈希及计算耗时
+    '''
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+    def loadMeta(self, key):
+        '''
+        Returns:
+            tuple: (输出内容的哈希, 计算耗时)，缓存不存在时返回None
+        '''
+        metaFilename = os.path.join(self.cacheDir, key, 'meta')
+        if not os.path.isfile(metaFilename):
+            return None
+        with open(metaFilename) as inFile:
+            digest, seconds = inFile.read().split()
+        return digest, float(seconds)
+
+    def load(self, key):
+        '''
+        Returns:
+            阶段的输出
+        '''
+        with open(os.path.join(self.cacheDir, key, 'output.pkl'), 'rb') as inFile:
+            return pickle.load(inFile)
+
+    def save(self, key, output, seconds):
+        '''
+        保存阶段输出：先写入临时目录再重命名，中途失败或并发写入都不会留下不完整的缓存
+
+        Returns:
+            str: 输出内容的哈希
+        '''
+        data = pickle.dumps(output, 2)
+        digest = hashlib.sha1(data).hexdigest()
+        tmpDir = tempfile.mkdtemp(dir=self.cacheDir)
+        with open(os.path.join(tmpDir, 'output.pkl'), 'wb') as outFile:
+            outFile.write(data)
+        with open(os.path.join(tmpDir, 'meta'), 'w') as outFile:
+            outFile.write('%s %r' % (digest, seconds))
+        try:
+            os.rename(tmpDir, os.path.join(self.cacheDir, key))
+        except OSError:  # 已被其他进程写入
+            shutil.rmtree(tmpDir, ignore_errors=True)
+        return digest
+
+
+class Pipeline(object):
+    '''
+    由命名阶段组成的流程，按需计算指定阶段及其上游阶段。
+    给出缓存目录时各阶段输出持久化保存，命中缓存的阶段直接读取；不给出时每次都重新计算。
+    缓存键只依赖上游阶段输出的哈希(保存在缓存的元数据中)，命中缓存的阶段只有在下游阶段需要重新计算
+    或其本身是所求阶段时才读取输出，全部命中时只读取所求阶段的输出。
+    report给出每个阶段是否命中缓存、耗时及节省的时间
+    '''
+    formatVersion = 1  # 缓存格式变化时递增，旧格式的缓存随之失效
+
+    def __init__(self, cacheDir=None):
+        '''
+        Args:
+            cacheDir (str): 阶段输出的缓存目录，为None时不使用缓存
+        '''
+        self.cache = StageCache(cacheDir) if cacheDir else None
+        self.stages = {}
+        self.outputs = {}  # 本次运行已得到的输出
+        self.keys = {}
+        self.digests = {}
+        self.records = []
+        self.name2record = {}
+
+    def add(self, name, func, inputs=(), params=None, version=0):
+        '''
+        添加阶段，输入阶段须已添加
+
+        Returns:
+            Pipeline: self，便于连续添加
+        '''
+        if name in self.stages:
+            raise ValueError('duplicate stage: %s' % name)
+        for inputName in inputs:
+            if inputName not in self.stages:
+                raise ValueError('unknown input stage %s of %s' % (inputName, name))
+        self.stages[name] = Stage(name, func, inputs, params, version)
+        return self
+
+    def getKey(self, stage):
+        '''
+        阶段的缓存键，由阶段名、版本、参数及各输入阶段输出内容的哈希决定
+        '''
+        fingerprint_ = [self.formatVersion, stage.name, stage.version, fingerprint(stage.params),
+                        [self.digests[inputName] for inputName in stage.inputs]]
+        return hashlib.sha1(repr(fingerprint_)).hexdigest()
+
+    def run(self, name):
+        '''
+        计算阶段的输出，上游阶段按需先行计算，同一次运行中每个阶段只计算一次
+
+        Args:
+            name (str): 阶段名
+
+        Returns:
+            阶段的输出
+        '''
+        if self.cache is None:
+            if name not in self.outputs:
+                stage = self.stages[name]
+                inputs = [self.run(inputName) for inputName in stage.inputs]
+                start = time.time()
+                self.outputs[name] = stage.func(*inputs)
+                self.addRecord(name, False, time.time() - start, 0.0)
+            return self.outputs[name]
+        self.resolve(name)
+        return self.getOutput(name)
+
+    def resolve(self, name):
+        '''
+        确定阶段输出的哈希：命中缓存时由元数据得到，不读取输出；否则读取或计算输入后计算该阶段并保存
+        '''
+        if name in self.digests:
+            return
+        stage = self.stages[name]
+        for inputName in stage.inputs:
+            self.resolve(inputName)
+        key = self.keys[name] = self.getKey(stage)
+        meta = self.cache.loadMeta(key)
+        if meta is not None:
+            self.digests[name], seconds = meta
+            self.addRecord(name, True, 0.0, seconds)
+            return
+        inputs = [self.getOutput(inputName) for inputName in stage.inputs]
+        start = time.time()
+        output = stage.func(*inputs)
+        seconds = time.time() - start
+        self.digests[name] = self.cache.save(key, output, seconds)
+        self.outputs[name] = output
+        self.addRecord(name, False, seconds, 0.0)
+
+    def getOutput(self, name):
+        '''
+        已确定哈希的阶段的输出，命中缓存的阶段此时才读取，读取时间计入该阶段的耗时
+        '''
+        if name not in self.outputs:
+            start = time.time()
+            self.outputs[name] = self.cache.load(self.keys[name])
+            record = self.name2record[name]
+            record[2] += time.time() - start
+            record[3] = max(record[3] - record[2], 0.0)
+        return self.outputs[name]
+
+    def addRecord(self, name, hit, seconds, saved):
+        record = [name, hit, seconds, saved]
+        self.records.append(record)
+        self.name2record[name] = record
+
+    def report(self):
+        '''
+        Returns:
+            str: 各阶段的运行情况，每行为: 阶段名 hit/run 耗时 节省时间
+        '''
+        lines = ['%s\t%s\t%.3fs\tsaved %.3fs' % (name, 'hit' if hit else 'run', seconds, saved)
+                 for name, hit, seconds, saved in self.records]
+        hits = sum(1 for record in self.records if record[1])
+        lines.append('%d/%d stages hit, saved %.3fs' % (hits, len(self.records), sum(record[3] for record in self.records)))
+        return '\n'.join(lines)
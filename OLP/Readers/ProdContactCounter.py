@@ -1,101 +1,280 @@
 # -*- coding: utf-8 -*-
 
-from ReaderTools import TimeTools
-from datetime import datetime
+import numpy as np
+from CMSBTable import asTable
+from FieldTypes import Date, toDays
 from CounterConfig import prodContactDateTitle, defaultDate
 from CounterConfig import custNoTitle, prodContactCodeTitle, contactAmountTitle
 
 class ProdContactCounter:
     '''
-    根据产品签约表，生成产品签约特征表。调用countProdContact即可
+    根据产品签约表，生成产品签约特征表。调用countProdContact即可，
+    同一张表需要多个统计日期的结果时调用countProdContacts，签约表只索引一次且不被修改
     '''
-    def __init__(self, contactTableTuple, statDate):
+    fieldNames = [custNoTitle, prodContactCodeTitle, prodContactDateTitle]  # 需要读取的产品签约表字段
+
+    def __init__(self, contactTableTuple, statDate=None):
         '''
         根据产品签约表，生成产品签约特征表
         :param contactTableTuple: 格式(特征索引{}, 产品签约表{})
-        :param statDate: 统计日期
+        :param statDate: 统计日期，只统计签约时间不晚于该日期的签约，为None时统计全部签约
         '''
-        self.countTitle2Index, self.contactTable = ContactDateFilter(contactTableTuple, statDate).filter()
+        self.countTitle2Index, contactTable = contactTableTuple
+        self.statDate = statDate
+        self.index = ProdContactIndex(asTable(self.countTitle2Index, contactTable))
 
     def countProdContact(self):
         '''
         生成产品签约特征表。格式 产品签约特征表{客户号：签约数量}
         '''
-        resultTable = {}
-        for key in self.contactTable:
-            value = self.count(self.contactTable[key])
-            resultTable[key] = value
-        #resultTitle2Index = {custNoTitle:'0', contactAmountTitle:'1'}
-        return resultTable
+        return self.countProdContacts([self.statDate])[0]
 
-    def count(self,contactRecords):
+    def countProdContacts(self, statDates):
         '''
-        计算某个客户的特征（签约数量）
-        :param contactRecords: 该客户的所有签约内容
-        :return: 签约数量
+        为多个统计日期生成产品签约特征表，每个日期只需一次二分查找(ProdContactIndex.countAsOf)，不构建持有位图
+        :param statDates: 统计日期列表
+        :return: 与statDates一一对应的产品签约特征表列表，每个格式同countProdContact，
+            截至该日期没有签约的客户不出现在表中
         '''
-        tempList = []
-        record = contactRecords[self.countTitle2Index[prodContactCodeTitle]]
-        countNum = 0
-        for index in record:
-            # 过滤重复签约
-            if not index in tempList:
-                tempList.append(index)
-                countNum += 1
+        custNos = self.index.primKeys.tolist()
+        resultTables = []
+        for statDate in statDates:
+            counts = self.index.countAsOf(statDate if statDate is not None else self.statDate).tolist()
+            resultTables.append(dict((custNo, count) for custNo, count in zip(custNos, counts) if count > 0))
+        return resultTables
 
-        return countNum
+    def holdings(self, statDate=None):
+        '''
+        截至统计日期各客户的产品持有位图，可在所有客户上一次计算持有某产品、产品组合、新签约等特征
+        :param statDate: 统计日期，为None时取构造时的统计日期
+        :return: ProdHoldings
+        '''
+        return self.index.holdingsAsOf(statDate if statDate is not None else self.statDate)
 
-class ContactDateFilter():
+
+class ProdContactIndex(object):
     '''
-    客户产品签约表的过滤，目前只过滤签约时间大于统计时间的
+    产品签约索引：每个客户签约过的每种产品只保留首次签约时间，客户内按首次签约时间排序，
+    截至任一日期的签约产品种数即为首次签约时间不晚于该日期的个数，所有客户由一次二分查找得到(countAsOf)；
+    需要持有某产品、产品组合等特征时由holdingsAsOf编为持有位图。
+    签约时间缺失(NaT)的签约视为早于任何日期
     '''
-    statDate = defaultDate
+    def __init__(self, table):
+        '''
+        :param table: 产品签约表(CMSBTable)，不会被修改
+        '''
+        table.compact()
+        self.primKeys = table.primKeys
+        self.key2pos = dict((custNo, pos) for pos, custNo in enumerate(self.primKeys.tolist()))
+        keyPos = table.rowKeyPos()
+        days = table.dateColumn(prodContactDateTitle).astype(np.int64)
+        codes, codeIndexes = np.unique(table.decoded(prodContactCodeTitle), return_inverse=True)
+        nCodes = max(len(codes), 1)
+        # 每个 (客户, 产品) 取最早的签约时间
+        pairs = keyPos * nCodes + codeIndexes
+        order = np.lexsort((days, pairs))
+        pairs, days = pairs[order], days[order]
+        firstFlags = np.ones(len(pairs), dtype=bool)
+        firstFlags[1:] = pairs[1:] != pairs[:-1]
+        pairs, days = pairs[firstFlags], days[firstFlags]
+        # 客户内按首次签约时间排序
+        custPos = pairs // nCodes
+        order = np.lexsort((days, custPos))
+        self.custPos = custPos[order]
+        self.firstDays = days[order]
+        self.codeIndexes = pairs[order] % nCodes
+        self.codes = codes[self.codeIndexes] if len(codes) > 0 else codes
+        self.catalogue = codes  # 全部产品代码，第k种产品对应持有位图的第k位
+        self.offsets = np.searchsorted(self.custPos, np.arange(len(self.primKeys) + 1))
+        # 排序键：高32位为客户位置，低32位为平移到非负的首次签约天数，整体有序
+        self.sortKeys = (self.custPos << 32) | (self.firstDays - Date.NaT)
+        self.keyBase = np.arange(len(self.primKeys), dtype=np.int64) << 32
 
-    def __init__(self, contactTableTuple, statDate):
-        self.statDate = statDate
-        self.countTitle2Index, self.contactTable = contactTableTuple
+    def countAsOf(self, statDate=None):
+        '''
+        截至统计日期各客户签约的产品种数，所有客户由一次二分查找得到
+        :param statDate: 统计日期，为None时统计全部签约
+        :return: 与self.primKeys对应的产品种数数组
+        '''
+        if statDate is None:
+            return np.diff(self.offsets)
+        stops = np.searchsorted(self.sortKeys, self.keyBase | (toDays(statDate) - Date.NaT), 'right')
+        return stops - self.offsets[:-1]
 
-    def filter(self):
+    def holdingsAsOf(self, statDate=None):
         '''
-        过滤签约时间大于统计时间的记录
-        :param self.contactTable: 传入的列表
-        :return: 过滤后的记录
+        截至统计日期各客户的产品持有位图
+        :param statDate: 统计日期，为None时统计全部签约
+        :return: ProdHoldings
+        '''
+        flags = self.firstDays <= toDays(statDate) if statDate is not None else np.ones(len(self.firstDays), dtype=bool)
+        nWords = max((len(self.catalogue) + 63) // 64, 1)
+        masks = np.zeros((len(self.primKeys), nWords), dtype=np.uint64)
+        codeIndexes = self.codeIndexes[flags]
+        bits = np.left_shift(np.uint64(1), (codeIndexes % 64).astype(np.uint64))
+        np.bitwise_or.at(masks, (self.custPos[flags], codeIndexes // 64), bits)
+        return ProdHoldings(self.primKeys, self.catalogue, masks)
+
+    def prodsAsOf(self, custNo, statDate=None):
+        '''
+        截至统计日期某客户签约过的产品
+        :param custNo: 客户号
+        :param statDate: 统计日期，为None时统计全部签约
+        :return: 产品代码列表，按首次签约时间排序
         '''
+        if custNo not in self.key2pos:
+            return []
+        pos = self.key2pos[custNo]
+        start, stop = self.offsets[pos], self.offsets[pos + 1]
+        if statDate is not None:
+            stop = start + np.searchsorted(self.firstDays[start:stop], toDays(statDate), 'right')
+        return self.codes[start:stop].tolist()
 
-        delCustNo = []
-        for key in self.contactTable:
-            delProdNo = []
 
-            for index in range(len(self.contactTable[key][0])):
+# 每个字节取值的二进制1的个数
+popcountTable = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
 
-                if not isinstance(self.contactTable[key][self.countTitle2Index[prodContactDateTitle]][index], datetime):
-                    recordValueDate = TimeTools().str2Date(self.contactTable[key][self.countTitle2Index[prodContactDateTitle]][index], '/')
-                if not isinstance(self.statDate, datetime):
-                    statDate = TimeTools().str2Date(self.statDate, '/')
-                # 如果记录中的签约时间大于统计时间，则将此条签约记录标记为将删除记录，加入delProdNo的列表中
-                if recordValueDate > statDate:
-                    delProdNo.append(index)
 
-            # 如果只删除客户的部分记录, 则删除这些记录
-            if (not len(delProdNo) == len(self.contactTable[key][0])) and (not len(delProdNo) == 0):
-                self.deleteRecord(self.contactTable[key], delProdNo)
-            # 如果删除客户的全部记录, 则标记这个客户在delCustNo列表中，在循环外删除
-            elif len(delProdNo) == len(self.contactTable[key][0]):
-                delCustNo.append(key)
+def popcount(masks):
+    '''
+    位图数组每行中1的个数
+    :param masks: uint64数组，形状为 (行数, 字数)
+    :return: int64数组
+    '''
+    masks = np.ascontiguousarray(masks)
+    return popcountTable[masks.view(np.uint8)].reshape(len(masks), -1).sum(axis=1, dtype=np.int64)
 
-        if not len(delCustNo) == 0:
-            self.deleteCust(self.contactTable,delCustNo)
-        return self.countTitle2Index, self.contactTable
 
-    def deleteRecord(self, sourceTable, delList):
+class ProdHoldings(object):
+    '''
+    产品持有位图：每个客户一行uint64位图，第k位表示是否持有产品目录中的第k种产品。
+    产品种数为popcount，持有某产品、产品组合、两个日期间新签约等均为所有客户上的一次位运算
+    '''
+    def __init__(self, custNos, catalogue, masks):
+        '''
+        :param custNos: 客户号数组
+        :param catalogue: 按升序排列的产品代码数组
+        :param masks: 位图，形状为 (客户数, 字数)
+        '''
+        self.custNos = custNos
+        self.catalogue = catalogue
+        self.masks = masks
 
-        delList.reverse()
-        sourceTableLength = range(len(sourceTable))
+    def bitOf(self, code):
+        '''
+        产品代码对应的 (字下标, 位掩码)，不在产品目录中时为None
+        '''
+        k = int(np.searchsorted(self.catalogue, code))
+        if k == len(self.catalogue) or self.catalogue[k] != code:
+            return None
+        return k // 64, np.uint64(1) << np.uint64(k % 64)
 
-        for recordNo in delList:
-            for propNo in sourceTableLength:
-                del sourceTable[propNo][recordNo]
+    def comboMask(self, codes):
+        '''
+        产品组合的位图，产品不在目录中时返回None
+        '''
+        mask = np.zeros(self.masks.shape[1], dtype=np.uint64)
+        for code in codes:
+            bit = self.bitOf(code)
+            if bit is None:
+                return None
+            mask[bit[0]] |= bit[1]
+        return mask
+
+    def counts(self):
+        '''
+        各客户持有的产品种数
+        '''
+        return popcount(self.masks)
+
+    def holds(self, code):
+        '''
+        各客户是否持有某产品
+        '''
+        return self.holdsAll([code])
+
+    def holdsAll(self, codes):
+        '''
+        各客户是否同时持有一组产品
+        '''
+        mask = self.comboMask(codes)
+        if mask is None:
+            return np.zeros(len(self.masks), dtype=bool)
+        return ((self.masks & mask) == mask).all(axis=1)
 
-    def deleteCust(self, sourceTable, delCust):
-        for key in delCust:
-            del sourceTable[key]
\ No newline at end of file
+    def holdsAny(self, codes):
+        '''
+        各客户是否持有一组产品中的任一种
+        '''
+        mask = self.comboMask([code for code in codes if self.bitOf(code) is not None])
+        return ((self.masks & mask) != 0).any(axis=1)
+
+    def since(self, earlier):
+        '''
+        相对于较早日期的持有位图新签约的产品，如本月相对于上月末
+        :param earlier: 同一签约索引得到的较早日期的ProdHoldings
+        :return: ProdHoldings
+        '''
+        return ProdHoldings(self.custNos, self.catalogue, self.masks & ~earlier.masks)
+
+
+class StreamProdContactCounter:
+    '''
+    流式生成产品签约特征表：逐批读入签约记录，只保留每个客户签约过的产品集合。
+    逐批调用update(或一次调用updateBatches)，最后调用countProdContact得到与ProdContactCounter相同格式的结果
+    '''
+    def __init__(self, statDate):
+        '''
+        :param statDate: 统计日期
+        '''
+        self.statDate = statDate
+        self.custNo2prods = {}
+
+    def update(self, batch):
+        '''
+        累计一批签约记录
+        :param batch: 一批签约记录(CMSBTable)
+        '''
+        countTitle2Index, batch = ContactDateFilter((batch.fieldName2Index, batch), self.statDate).filter()
+        codes = batch.decoded(prodContactCodeTitle).tolist()  # 各批词表不同，按原始取值累计
+        for custNo, start, stop in zip(batch.primKeys.tolist(), batch.offsets[:-1], batch.offsets[1:]):
+            self.custNo2prods.setdefault(custNo, set()).update(codes[start:stop])
+
+    def updateBatches(self, batches):
+        '''
+        依次累计若干批签约记录
+        :param batches: 可迭代的CMSBTable，如CMSBReader.iterProds的输出
+        :return: self
+        '''
+        for batch in batches:
+            self.update(batch)
+        return self
+
+    def countProdContact(self):
+        '''
+        生成产品签约特征表。格式 产品签约特征表{客户号：签约数量}
+        '''
+        return dict((custNo, len(prods)) for custNo, prods in self.custNo2prods.iteritems())
+
+
+class ContactDateFilter():
+    '''
+    客户产品签约表的过滤，目前只过滤签约时间大于统计时间的
+    '''
+    statDate = defaultDate
+
+    def __init__(self, contactTableTuple, statDate):
+        self.statDate = statDate
+        self.countTitle2Index, self.contactTable = contactTableTuple
+
+    def filter(self):
+        '''
+        过滤签约时间大于统计时间的记录，不修改传入的表
+        :param self.contactTable: 传入的列表
+        :return: 过滤后的记录
+        '''
+        contactTable = asTable(self.countTitle2Index, self.contactTable)
+        # 签约时间与统计时间均转换为天数比较
+        dateFlags = contactTable.dateColumn(prodContactDateTitle) <= toDays(self.statDate)
+        # 签约时间大于统计时间的记录被删除，全部记录被删除的客户也随之删除
+        return self.countTitle2Index, contactTable.selectRows(dateFlags)
@@ -1,25 +1,163 @@
 # -*- coding: utf-8 -*-
 
 from OLP.core.samples import Sample, Samples
-from OLP.Readers.TransCounter import TransCounter
-from OLP.Readers.ProdContactCounter import ProdContactCounter
+from OLP.Readers.TransCounter import TransCounter, StreamTransCounter
+from OLP.Readers.ProdContactCounter import ProdContactCounter, StreamProdContactCounter
 from OLP.Readers.FeatureBuilder import FeatureBuilder
 from OLP.Readers.LabelReader import LabelReader
+from OLP.Readers.LoanFilter import getFilter, FilterEngine
+from OLP.Readers.Pipeline import fileStats
+from OLP.Readers import CounterConfig
 
 
 class SamplesBuilder:
     '''
     通过一个用户的三张表生成sample类型数据并返回，通过调用buildSample
     '''
-    def __init__(self, loanFieldName2Index, featLoans, featCustNum2ProtolNums, labelLoans, transFieldName2Index, featTranss, prodFieldName2Index, featProds):
+    def __init__(self, loanFieldName2Index, featLoans, featCustNum2ProtolNums, labelLoans, transFieldName2Index, featTranss, prodFieldName2Index, featProds,
+                 labelLoanFieldName2Index=None, vectorizedCount=False, featTransCounts=None, statDate=None,
+                 labelHorizons=None, featProdCounts=None):
+        if statDate is None:
+            raise ValueError('statDate is required, features would otherwise include records after the feature months')
         self.loanFieldName2Index = loanFieldName2Index
+        # 标签贷款协议表按用途投影读取时字段索引与特征贷款协议表不同
+        self.labelLoanFieldName2Index = labelLoanFieldName2Index or loanFieldName2Index
+        self.vectorizedCount = vectorizedCount  # 交易流水特征是否在整表上向量化统计
         self.featLoans = featLoans
         self.featCustNum2ProtolNums = featCustNum2ProtolNums
         self.labelLoans = labelLoans
         self.transFieldName2Index = transFieldName2Index
         self.featTranss = featTranss
+        # 已统计好的交易流水特征(如StreamTransCounter的结果)，给出时不再统计featTranss
+        self.featTransCounts = featTransCounts
+        self.statDate = statDate  # 特征的统计日期，用于按时间窗口统计交易流水及截取产品签约，必须给出以免统计到之后的记录
+        self.labelHorizons = labelHorizons  # 标签期限(月数)列表，buildSamples为每个期限生成一组样本
         self.prodFieldName2Index = prodFieldName2Index
         self.featProds = featProds
+        # 已统计好的产品签约特征(如StreamProdContactCounter的结果)，给出时不再统计featProds
+        self.featProdCounts = featProdCounts
+
+    @staticmethod
+    def getFieldNames(filterNames=()):
+        '''
+        生成样本需要读取的各表字段，按表和用途区分，读表时只转换并保存这些字段
+
+        Args:
+            filterNames (list): 对特征贷款协议表使用的过滤器名称列表
+
+        Returns:
+            dict: 各表需要读取的字段名，格式为:
+                {
+                  'featLoans': [...],  # 用于生成特征的贷款协议表
+                  'labelLoans': [...],  # 用于生成标签的贷款协议表
+                  'transs': [...],  # 交易流水表
+                  'prods': [...],  # 产品签约表
+                }
+        '''
+        featLoanFieldNames = set(FeatureBuilder.fieldNames)
+        for filterName in filterNames:
+            featLoanFieldNames.update(getFilter(filterName).getFieldNames())
+        return {
+            'featLoans': sorted(featLoanFieldNames),
+            'labelLoans': sorted(LabelReader.fieldNames),
+            'transs': TransCounter.getFieldNames(),
+            'prods': sorted(ProdContactCounter.fieldNames),
+        }
+
+    @staticmethod
+    def addStages(pipeline, prefix, reader, loanFilenames, transFilenames, prodFilenames, labelLoanFilenames,
+                  filterNames=(), statDate=None, vectorizedCount=False, labelHorizons=None, streamTransCount=False,
+                  streamProdCount=False):
+        '''
+        将生成样本的流程作为阶段加入带缓存的流程(Pipeline)，阶段名前加prefix以区分多组样本(如训练、测试):
+            featLoans: 读取并过滤特征贷款协议表，参数为文件、字段类型与过滤器(含其实现与参数，见Filter.getKey)
+            transCounts: 读取交易流水表并统计特征，参数为文件、字段类型、统计规则(countRules)与统计日期
+            prodCounts: 读取产品签约表并统计签约数量，参数为文件、字段类型与统计日期
+            feats: 合成特征，输入为以上三个阶段，参数为贷款特征字段(loanFeatTitle)与填充值
+            labels: 读取标签贷款协议表并生成标签，输入为featLoans，参数为文件、字段类型、标签规则字段与标签期限
+            samples: 生成样本，输入为featLoans、feats与labels
+        交易流水表与产品签约表的读取和统计在同一阶段完成，只缓存统计结果，原始表的解析由读表器的缓存负责
+
+        Args:
+            pipeline (Pipeline): 流程
+            prefix (str): 阶段名前缀
+            reader (CMSBReader): 读表器
+            loanFilenames (list): 特征贷款协议文件名列表
+            transFilenames (list): 交易流水文件名列表
+            prodFilenames (list): 产品签约文件名列表
+            labelLoanFilenames (list): 标签贷款协议文件名列表
+            filterNames (list): 过滤器名称列表，支持下推的过滤器在读表时执行
+            statDate (str): 特征的统计日期，必须给出，产品签约只统计该日期(含)之前的记录
+            vectorizedCount (bool): 交易流水特征是否向量化统计
+            labelHorizons (list): 标签期限(月数)列表，给出时样本为{期限: Samples}
+            streamTransCount (bool): 是否逐批读取交易流水文件流式统计特征，不构建整张交易流水表
+            streamProdCount (bool): 是否逐批读取产品签约文件流式统计特征，不构建整张产品签约表
+
+        Returns:
+            str: samples阶段的阶段名
+        '''
+        if statDate is None:
+            raise ValueError('statDate is required, features would otherwise include records after the feature months')
+        filters = [getFilter(filterName) for filterName in filterNames]
+        pushedFilters = [filter_ for filter_ in filters if filter_.pushDown]
+        restFilterNames = [filterName for filterName, filter_ in zip(filterNames, filters) if not filter_.pushDown]
+        fieldNames = SamplesBuilder.getFieldNames(restFilterNames)
+        # 样本由featLoans的客户号对应的协议号决定，标签规则由LabelReader的类变量决定
+        labelRules = (LabelReader.fieldNames, LabelReader.defaultDebtDate)
+        # 读表阶段的输出还取决于字段类型(转换函数、日期格式等)
+        fieldTypes = reader.fieldProcessor.fieldName2fieldType
+
+        def readFeatLoans():
+            fieldName2Index, loans, custNum2ProtolNums = reader.readLoans(loanFilenames, fieldNames['featLoans'], pushedFilters)
+            return FilterEngine.fromNames(restFilterNames).filter(fieldName2Index, loans, custNum2ProtolNums)
+
+        def countTranss():
+            if streamTransCount:
+                return StreamTransCounter(statDate).updateBatches(reader.iterTranss(transFilenames, fieldNames=fieldNames['transs'])).countProp()
+            transFieldName2Index, transs = reader.readTranss(transFilenames, fieldNames['transs'])
+            return TransCounter((transFieldName2Index, transs), vectorizedCount, statDate).countProp()
+
+        def countProds():
+            if streamProdCount:
+                return StreamProdContactCounter(statDate).updateBatches(reader.iterProds(prodFilenames, fieldNames=fieldNames['prods'])).countProdContact()
+            prodFieldName2Index, prods = reader.readProds(prodFilenames, fieldNames['prods'])
+            return ProdContactCounter((prodFieldName2Index, prods), statDate).countProdContact()
+
+        def buildFeats(featLoans, transCounts, prods):
+            fieldName2Index, feats = FeatureBuilder(featLoans, transCounts, prods).buildFeature()
+            feats.sort(key=lambda item: item[0])
+            return fieldName2Index, feats
+
+        def readLabels(featLoans):
+            labelFieldName2Index, labelLoans = reader.readLoans(labelLoanFilenames, fieldNames['labelLoans'])[:2]
+            reader_ = LabelReader((labelFieldName2Index, labelLoans, featLoans[2]), featLoans[1])
+            labels = reader_.readLabel() if labelHorizons is None else reader_.readLabels(labelHorizons)
+            labels.sort(key=lambda item: item[0])
+            return labels
+
+        def buildSamples(featLoans, feats, labels):
+            fieldName2Index, feats = feats
+            if labelHorizons is None:
+                return SamplesBuilder.genSamples(fieldName2Index, featLoans[2], feats, labels)
+            return dict((horizon, SamplesBuilder.genSamples(fieldName2Index, featLoans[2], feats,
+                                                            [[custNum, reputs[i]] for custNum, reputs in labels]))
+                        for i, horizon in enumerate(labelHorizons))
+
+        names = dict((name, prefix + name) for name in ('featLoans', 'transCounts', 'prodCounts', 'feats', 'labels', 'samples'))
+        pipeline.add(names['featLoans'], readFeatLoans,
+                     params=(fileStats(loanFilenames), fieldNames['featLoans'], fieldTypes,
+                             [filter_.getKey() for filter_ in filters]))
+        pipeline.add(names['transCounts'], countTranss,
+                     params=(fileStats(transFilenames), fieldNames['transs'], fieldTypes, CounterConfig.countRules,
+                             CounterConfig.transDateTitle, statDate, vectorizedCount, streamTransCount))
+        pipeline.add(names['prodCounts'], countProds,
+                     params=(fileStats(prodFilenames), fieldNames['prods'], fieldTypes, statDate, streamProdCount))
+        pipeline.add(names['feats'], buildFeats, [names['featLoans'], names['transCounts'], names['prodCounts']],
+                     params=(CounterConfig.loanFeatTitle, CounterConfig.transFeatFillValue, CounterConfig.prodFeatFillValue))
+        pipeline.add(names['labels'], readLabels, [names['featLoans']],
+                     params=(fileStats(labelLoanFilenames), fieldNames['labelLoans'], fieldTypes, labelRules, labelHorizons))
+        pipeline.add(names['samples'], buildSamples, [names['featLoans'], names['feats'], names['labels']])
+        return names['samples']
 
     def buildSample(self):
         # 生成用户特征
@@ -27,11 +165,29 @@ class SamplesBuilder:
                                                self.transFieldName2Index, self.featTranss,
                                                self.prodFieldName2Index, self.featProds)
         # 生成用户标签
-        labels = self.genLabels(self.loanFieldName2Index, self.featLoans, self.labelLoans, self.featCustNum2ProtolNums)
+        labels = self.genLabels(self.labelLoanFieldName2Index, self.featLoans, self.labelLoans, self.featCustNum2ProtolNums)
         # 生成样本
         samples = self.genSamples(fieldName2Index, self.featCustNum2ProtolNums, feats, labels)
         return samples
 
+    def buildSamples(self):
+        '''
+        为每个标签期限生成一组样本，特征只生成一次，各期限的标签由标签贷款表一次读出
+
+        Returns:
+            dict: 标签期限对应的样本，格式为{期限1: Samples, 期限2: Samples, ...}
+        '''
+        fieldName2Index, feats = self.genFeats(self.loanFieldName2Index, self.featLoans, self.featCustNum2ProtolNums,
+                                               self.transFieldName2Index, self.featTranss,
+                                               self.prodFieldName2Index, self.featProds)
+        labels = self.genLabels(self.labelLoanFieldName2Index, self.featLoans, self.labelLoans, self.featCustNum2ProtolNums,
+                                self.labelHorizons)
+        horizon2samples = {}
+        for i, horizon in enumerate(self.labelHorizons):
+            horizonLabels = [[custNum, reputs[i]] for custNum, reputs in labels]
+            horizon2samples[horizon] = self.genSamples(fieldName2Index, self.featCustNum2ProtolNums, feats, horizonLabels)
+        return horizon2samples
+
     def genFeats(self, loanFieldName2Index, loans, custNum2ProtolNums, transFieldName2Index, transs, prodFieldName2Index, prods):
         '''
         为每笔贷款生成特征
@@ -53,8 +209,14 @@ class SamplesBuilder:
                   ...
                 ]
         '''
-        transFieldName2Index, transs = TransCounter((transFieldName2Index, transs)).countProp()
-        prods = ProdContactCounter((prodFieldName2Index, prods), '2014/3/31').countProdContact()  # TODO
+        if self.featTransCounts is not None:
+            transFieldName2Index, transs = self.featTransCounts
+        else:
+            transFieldName2Index, transs = TransCounter((transFieldName2Index, transs), self.vectorizedCount, self.statDate).countProp()
+        if self.featProdCounts is not None:
+            prods = self.featProdCounts
+        else:
+            prods = ProdContactCounter((prodFieldName2Index, prods), self.statDate).countProdContact()
         builder = FeatureBuilder((loanFieldName2Index, loans, custNum2ProtolNums),
                              (transFieldName2Index, transs),
                              prods)
@@ -62,14 +224,15 @@ class SamplesBuilder:
         feats.sort(key=lambda item: item[0])
         return fieldName2Index, feats
 
-    def genLabels(self, loanFieldName2Index, featLoans, labelLoans, custNum2ProtolNums):
+    def genLabels(self, loanFieldName2Index, featLoans, labelLoans, custNum2ProtolNums, horizons=None):
         '''
         为每笔贷款生成类别标签
 
         Args:
-            loanFieldName2Index (dict): 贷款协议表字段索引
+            loanFieldName2Index (dict): 用于生成标签的贷款协议表字段索引
             featLoans (dict): 用于生成特征的贷款协议表数据
             labelLoans (dict): 用于生成标签的贷款协议表数据
+            horizons (list): 标签期限(月数)列表，给出时每个客户的类别标签为各期限标签的列表
 
         Returns:
             list: 客户号和类别标签，格式为:
@@ -80,11 +243,12 @@ class SamplesBuilder:
                 ]
         '''
         reader = LabelReader((loanFieldName2Index, labelLoans, custNum2ProtolNums), featLoans)
-        labels = reader.readLabel()
+        labels = reader.readLabel() if horizons is None else reader.readLabels(horizons)
         labels.sort(key=lambda item: item[0])
         return labels
 
-    def genSamples(self, x_indexes, cust_num_protol_nums, feats, labels):
+    @staticmethod
+    def genSamples(x_indexes, cust_num_protol_nums, feats, labels):
         '''
         将原有数据记录转为Samples格式
         '''
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+'''
+可合并的概要数据结构(sketch)及基于它们的统计公式，用于在有限内存内统计分位数与不同取值个数。
+
+同一统计公式的sketch可以任意顺序合并，因此既可逐客户一次构建，也可在分批或多进程统计时
+分别构建部分sketch再合并
+'''
+
+import math
+import struct
+import hashlib
+import numpy as np
+
+
+class KLLSketch(object):
+    '''
+    KLL分位数sketch：第h层的每个元素代表2**h个原始值，某层满时排序并隔一取一提升到上一层。
+    取值个数不超过k时不做压缩，结果精确。为使结果可复现，压缩时交替取奇偶位置而不随机选取
+    '''
+    def __init__(self, k=200):
+        self.k = k
+        self.compactors = [[]]
+        self.size = 0  # 保存的元素个数
+        self.n = 0  # 代表的原始值个数
+        self.offset = 0
+
+    def capacity(self, height):
+        depth = len(self.compactors) - height - 1
+        return int(math.ceil(self.k * (2.0 / 3) ** depth)) + 1
+
+    def update(self, values):
+        '''
+        Args:
+            values (numpy.ndarray): 数值数组
+        '''
+        values = np.asarray(values, dtype=float).tolist()
+        self.compactors[0].extend(values)
+        self.size += len(values)
+        self.n += len(values)
+        self.compress()
+
+    def add(self, value):
+        '''
+        加入单个数值
+        '''
+        self.compactors[0].append(value)
+        self.size += 1
+        self.n += 1
+        if len(self.compactors[0]) >= self.capacity(0):
+            self.compress()
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for height, items in enumerate(other.compactors):
+            self.compactors[height].extend(items)
+        self.size += other.size
+        self.n += other.n
+        self.compress()
+        return self
+
+    def compress(self):
+        while self.size > sum(self.capacity(height) for height in range(len(self.compactors))):
+            for height in range(len(self.compactors)):
+                if len(self.compactors[height]) >= self.capacity(height):
+                    if height + 1 == len(self.compactors):
+                        self.compactors.append([])
+                    items = sorted(self.compactors[height])
+                    rest = [items.pop()] if len(items) % 2 == 1 else []
+                    self.compactors[height + 1].extend(items[self.offset::2])
+                    self.compactors[height] = rest
+                    self.size -= len(items) // 2
+                    self.offset = 1 - self.offset
+                    break
+
+    def quantile(self, q):
+        '''
+        按最近秩取分位数：累计权重首次达到 q * n 的取值，没有取值时为nan
+        '''
+        if self.n == 0:
+            return float('nan')
+        items = sorted((item, 2 ** height) for height, compactor in enumerate(self.compactors) for item in compactor)
+        target = q * sum(weight for item, weight in items)
+        cumWeight = 0
+        for item, weight in items:
+            cumWeight += weight
+            if cumWeight >= target:
+                return item
+        return items[-1][0]
+
+
+def hashValue(string):
+    '''
+    将字符串转换为64位哈希值，与进程无关，可用于跨进程合并
+    '''
+    return struct.unpack('<Q', hashlib.md5(string).digest()[:8])[0]
+
+
+def hashValues(values):
+    '''
+    将取值数组转换为64位哈希值数组，相同取值只计算一次
+    '''
+    strs, indexes = np.unique(np.asarray(values).astype(str), return_inverse=True)
+    hashes = np.array([hashValue(string) for string in strs.tolist()], dtype=np.uint64)
+    return hashes[indexes] if len(strs) > 0 else np.array([], dtype=np.uint64)
+
+
+def bitLength(x):
+    '''
+    uint64数组中每个元素的二进制位数
+    '''
+    x = x.copy()
+    n = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        flags = x >= np.uint64(1 << shift)
+        n += flags * shift
+        x[flags] >>= np.uint64(shift)
+    return n + (x > 0)
+
+
+class HyperLogLog(object):
+    '''
+    HyperLogLog不同取值个数sketch，输入为64位哈希值(hashValues)。
+    不同哈希值个数不超过寄存器数的1/8时直接保存哈希值(稀疏表示)，结果精确，超过后转为2**p个寄存器。
+    逐个加入的哈希值先缓存，满一批后再一起加入
+    '''
+    bufferSize = 64
+
+    def __init__(self, p=12):
+        self.p = p
+        self.m = 1 << p
+        self.hashes = np.array([], dtype=np.uint64)  # 稀疏表示
+        self.registers = None  # 稠密表示
+        self.buffer = []
+
+    def add(self, hash_):
+        '''
+        加入单个哈希值
+        '''
+        self.buffer.append(hash_)
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            hashes, self.buffer = np.array(self.buffer, dtype=np.uint64), []
+            self.update(hashes)
+
+    def update(self, hashes):
+        '''
+        Args:
+            hashes (numpy.ndarray): uint64哈希值数组
+        '''
+        if self.registers is None:
+            self.hashes = np.union1d(self.hashes, hashes).astype(np.uint64)
+            if len(self.hashes) > self.m // 8:
+                self.registers = np.zeros(self.m, dtype=np.uint8)
+                self.addDense(self.hashes)
+                self.hashes = None
+        else:
+            self.addDense(hashes)
+
+    def addDense(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        indexes = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        ranks = (64 - self.p) - bitLength(rest) + 1
+        np.maximum.at(self.registers, indexes, ranks.astype(np.uint8))
+
+    def merge(self, other):
+        self.flush()
+        other.flush()
+        if other.registers is None:
+            self.update(other.hashes)
+        elif self.registers is None:
+            hashes = self.hashes
+            self.registers = other.registers.copy()
+            self.hashes = None
+            self.addDense(hashes)
+        else:
+            np.maximum(self.registers, other.registers, self.registers)
+        return self
+
+    def count(self):
+        '''
+        不同取值个数的估计值，稀疏表示时为精确值
+        '''
+        self.flush()
+        if self.registers is None:
+            return len(self.hashes)
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m ** 2 / np.sum(2.0 ** -self.registers.astype(float))
+        zeros = int(np.sum(self.registers == 0))
+        if estimate <= 2.5 * self.m and zeros > 0:  # 小基数时用线性计数
+            estimate = self.m * math.log(float(self.m) / zeros)
+        return float(estimate)
+
+
+class Quantile(object):
+    '''
+    统计公式：分位数，由KLLSketch得到。可直接作用于取值列表
+    '''
+    numeric = True  # 统计字段按数值读取
+
+    def __init__(self, q, k=200):
+        self.q = q
+        self.k = k
+
+    def __repr__(self):
+        return 'Quantile(%r, k=%r)' % (self.q, self.k)
+
+    def encode(self, values):
+        return np.asarray(values, dtype=float)
+
+    def encodeValue(self, value):
+        return float(value)
+
+    def newSketch(self):
+        return KLLSketch(self.k)
+
+    def result(self, sketch):
+        return sketch.quantile(self.q)
+
+    def __call__(self, values):
+        sketch = self.newSketch()
+        sketch.update(self.encode(values))
+        return self.result(sketch)
+
+
+class DistinctCount(object):
+    '''
+    统计公式：不同取值个数，由HyperLogLog得到。可直接作用于取值列表
+    '''
+    numeric = False  # 统计字段按原始字符串读取
+
+    def __init__(self, p=12):
+        self.p = p
+
+    def __repr__(self):
+        return 'DistinctCount(%r)' % self.p
+
+    def encode(self, values):
+        return hashValues(values)
+
+    def encodeValue(self, value):
+        return hashValue(str(value))
+
+    def newSketch(self):
+        return HyperLogLog(self.p)
+
+    def result(self, sketch):
+        return sketch.count()
+
+    def __call__(self, values):
+        sketch = self.newSketch()
+        sketch.update(self.encode(values))
+        return self.result(sketch)
+
+
+def isSketch(formula):
+    '''
+    统计公式是否基于sketch
+    '''
+    return hasattr(formula, 'newSketch')
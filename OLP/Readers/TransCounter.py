@@ -2,64 +2,392 @@
 
 import CounterConfig
 import math
+import numpy as np
 from ReaderTools import UniPrinter
+from CMSBTable import asTable
+from GroupBy import GroupBy, WindowIndex, aggregatorNames
+from FieldTypes import Date, toDays
+from Sketches import isSketch
 
 class TransCounter:
     '''
     将输入的交易信息表进行统计，得到每个key想要得到的间接属性，生成交易信息特征表。计算规则写在CountConfig.py配置文件中
     '''
 
-    def __init__(self,table):
+    def __init__(self,table, vectorized=False, statDate=None):
         '''
         :param table: 要处理的交易信息表，格式（{title:index,title2:index2,……}{key:[[a1,a2……][b1,b2……]，……]}）
+        :param vectorized: 是否在整表上做向量化分组聚合(统计公式均为sum/len/mean/min/max时有效)，
+            浮点结果与逐客户统计可能有舍入误差
+        :param statDate: 统计日期('年/月/日'或datetime)，带window的规则统计该日期(含)之前window天内的交易，
+            为None时取表中最晚的交易日期
         '''
         self.title2index = table[0]
-        self.tableContent = table[1]
+        self.vectorized = vectorized
+        self.statDate = statDate
+        self.tableContent = asTable(table[0], table[1])
         self.indiTitle2index = {}
         i = 0
         for propKey in CounterConfig.countRules:
             self.indiTitle2index[propKey] = i
             i += 1
+        # 筛选条件的取值预先转换为列中的表示，枚举类字段直接比较代码
+        self.ruleValues = {}
+        for prop in CounterConfig.countRules.itervalues():
+            for ruleKey, ruleValue in prop['rules'].iteritems():
+                self.ruleValues[ruleKey, ruleValue] = self.tableContent.encode(ruleKey, ruleValue)
+        self.compileRules()
         self.resultDict = {}
 
+    @staticmethod
+    def isWindowed(prop):
+        '''
+        统计规则是否只统计时间窗口内的交易
+        '''
+        return prop.get('window') is not None
+
+    # 带window的规则支持的统计公式
+    windowFormulas = {sum: 'sum', np.sum: 'sum', len: 'count', np.mean: 'mean'}
+
+    def compileRules(self):
+        '''
+        将统计规则编译为互不相同的筛选条件：
+        self.atoms为所有规则中出现过的 (字段索引, 取值) 单项条件；
+        self.groups中每项为 (单项条件下标, 统计字段索引, [(间接属性索引, 统计公式), ...])，
+        筛选条件与统计字段都相同的规则共用一组，只是统计公式不同；
+        带window的规则另编为self.windowGroups，每项为 (单项条件下标, 统计字段索引, [(间接属性索引, 统计公式, 窗口天数), ...])；
+        统计公式基于sketch的规则另编为self.sketchGroups，格式同self.groups
+        '''
+        atom2index = {}
+        group2props = {}
+        group2windowProps = {}
+        group2sketchProps = {}
+        for propKey, prop in CounterConfig.countRules.iteritems():
+            atomIndexes = []
+            for ruleKey, ruleValue in sorted(prop['rules'].iteritems()):
+                atom = (self.title2index[ruleKey], self.ruleValues[ruleKey, ruleValue])
+                atomIndexes.append(atom2index.setdefault(atom, len(atom2index)))
+            groupKey = (tuple(sorted(atomIndexes)), self.title2index[prop['title']])
+            if self.isWindowed(prop):
+                if self.windowFormulas.get(prop['formula']) is None:
+                    raise ValueError('formula of %s is not supported with window' % propKey)
+                group2windowProps.setdefault(groupKey, []).append((self.indiTitle2index[propKey], prop['formula'], prop['window']))
+            elif isSketch(prop['formula']):
+                group2sketchProps.setdefault(groupKey, []).append((self.indiTitle2index[propKey], prop['formula']))
+            else:
+                group2props.setdefault(groupKey, []).append((self.indiTitle2index[propKey], prop['formula']))
+        self.atoms = sorted(atom2index, key=atom2index.get)
+        self.groups = [(atomIndexes, titleIndex, props) for (atomIndexes, titleIndex), props in sorted(group2props.iteritems())]
+        self.windowGroups = [(atomIndexes, titleIndex, props) for (atomIndexes, titleIndex), props in sorted(group2windowProps.iteritems())]
+        self.sketchGroups = [(atomIndexes, titleIndex, props) for (atomIndexes, titleIndex), props in sorted(group2sketchProps.iteritems())]
+
+    @staticmethod
+    def getFieldNames():
+        '''
+        统计需要读取的交易信息表字段：客户号及各统计规则用到的字段
+        '''
+        fieldNames = set([CounterConfig.custNoTitle])
+        for prop in CounterConfig.countRules.itervalues():
+            fieldNames.add(prop['title'])
+            fieldNames.update(prop['rules'])
+            if TransCounter.isWindowed(prop):
+                fieldNames.add(CounterConfig.transDateTitle)
+        return sorted(fieldNames)
+
     def countProp(self):
         '''
-        处理交易信息表
+        处理交易信息表：每个客户的交易记录对每个单项条件只比较一次，每组筛选条件只取一次统计值，
+        同组的各统计公式作用在同一统计值列表上，结果与逐条规则调用calcProp相同
         :return:处理好的交易信息表，格式（{title:index,title2:index2,……}{key:[proA,proB,……}）
         '''
+        if self.vectorized and all(formula in aggregatorNames for atomIndexes, titleIndex, props in self.groups for propIndex, formula in props):
+            return self.countPropGrouped()
         for loanKey in self.tableContent:
-            value = []
-            for propKey in CounterConfig.countRules:
-                calcResult = self.calcProp(self.tableContent[loanKey], CounterConfig.countRules[propKey])
-                value.append(calcResult)
+            loan = self.tableContent.getColumns(loanKey)
+            atomFlags = [loan[fieldIndex] == value for fieldIndex, value in self.atoms]
+            value = [0] * len(self.indiTitle2index)
+            for atomIndexes, titleIndex, props in self.groups:
+                ruleFlags = np.ones(len(loan[0]), dtype=bool)
+                for atomIndex in atomIndexes:
+                    ruleFlags &= atomFlags[atomIndex]
+                addedElement = loan[titleIndex][ruleFlags].astype(float).tolist()
+                if len(addedElement) > 0:
+                    for propIndex, formula in props:
+                        value[propIndex] = formula(addedElement)
             self.resultDict[loanKey] = value
+        self.countWindows()
+        self.countSketches()
+        return self.indiTitle2index, self.resultDict
+
+    def countPropGrouped(self):
+        '''
+        在整表上向量化统计：每个单项条件为整列上的一个布尔掩码，各组筛选条件的统计值按客户编号一次聚合
+        :return:处理好的交易信息表，格式同countProp
+        '''
+        table = self.tableContent
+        groupBy = GroupBy.fromTable(table)
+        atomFlags = [table.columns[fieldIndex] == value for fieldIndex, value in self.atoms]
+        columns = [[0] * len(table.primKeys) for i in range(len(self.indiTitle2index))]  # 带window的规则由countWindows填写
+        for atomIndexes, titleIndex, props in self.groups:
+            ruleFlags = np.ones(table.nRows(), dtype=bool)
+            for atomIndex in atomIndexes:
+                ruleFlags &= atomFlags[atomIndex]
+            values = table.columns[titleIndex].astype(float)
+            counts = groupBy.count(flags=ruleFlags).tolist()
+            for propIndex, formula in props:
+                results = groupBy.aggregate(aggregatorNames[formula], values, ruleFlags).tolist()
+                # 没有满足条件的交易时结果为0
+                columns[propIndex] = [result if count > 0 else 0 for result, count in zip(results, counts)]
+        for j, loanKey in enumerate(table.primKeys.tolist()):
+            self.resultDict[loanKey] = [column[j] for column in columns]
+        self.countWindows()
+        self.countSketches()
         return self.indiTitle2index, self.resultDict
 
+    def countWindows(self):
+        '''
+        统计带window的规则并写入self.resultDict：交易记录在每个客户内按交易日期排序，每组筛选条件排列一次统计值，
+        每个窗口的边界由两次二分查找得到，和由np.add.reduceat对窗口内的统计值直接求和，次数由整数前缀和相减得到
+        '''
+        if not self.windowGroups:
+            return
+        table = self.tableContent
+        windowIndex = WindowIndex.fromTable(table, CounterConfig.transDateTitle)
+        if self.statDate is not None:
+            stop = toDays(self.statDate)
+        else:
+            days = table.dateColumn(CounterConfig.transDateTitle)
+            stop = int(days.max()) if len(days) > 0 else Date.NaT
+        atomFlags = [table.columns[fieldIndex] == value for fieldIndex, value in self.atoms]
+        loanKeys = table.primKeys.tolist()
+        for atomIndexes, titleIndex, props in self.windowGroups:
+            ruleFlags = np.ones(table.nRows(), dtype=bool)
+            for atomIndex in atomIndexes:
+                ruleFlags &= atomFlags[atomIndex]
+            sortedValues = windowIndex.sortValues(table.columns[titleIndex].astype(float), ruleFlags)
+            for propIndex, formula, window in props:
+                sums, counts = windowIndex.window(sortedValues, stop, window)
+                name = self.windowFormulas[formula]
+                if name == 'sum':
+                    results = sums.tolist()
+                elif name == 'count':
+                    results = counts.tolist()
+                else:
+                    results = (sums / np.maximum(counts, 1)).tolist()
+                # 窗口内没有满足条件的交易时结果为0
+                for loanKey, result, count in zip(loanKeys, results, counts.tolist()):
+                    self.resultDict[loanKey][propIndex] = result if count > 0 else 0
+
+    def countSketches(self):
+        '''
+        统计基于sketch的规则并写入self.resultDict：每组筛选条件整列编码一次统计字段，再逐客户构建sketch。
+        逐客户的Python循环是较慢的统计路径，客户数多时耗时明显，基于sketch的规则因此默认不启用(见CounterConfig.sketchCount)
+        '''
+        if not self.sketchGroups:
+            return
+        table = self.tableContent
+        table.compact()
+        atomFlags = [table.columns[fieldIndex] == value for fieldIndex, value in self.atoms]
+        loanKeys = table.primKeys.tolist()
+        bounds = zip(table.offsets[:-1].tolist(), table.offsets[1:].tolist())
+        for atomIndexes, titleIndex, props in self.sketchGroups:
+            ruleFlags = np.ones(table.nRows(), dtype=bool)
+            for atomIndex in atomIndexes:
+                ruleFlags &= atomFlags[atomIndex]
+            for propIndex, formula in props:
+                encoded = self.encodeColumn(table, titleIndex, formula)
+                for loanKey, (start, stop) in zip(loanKeys, bounds):
+                    flags = ruleFlags[start:stop]
+                    if flags.any():  # 没有满足条件的交易时结果为0
+                        sketch = formula.newSketch()
+                        sketch.update(encoded[start:stop][flags])
+                        self.resultDict[loanKey][propIndex] = formula.result(sketch)
+
+    @staticmethod
+    def encodeColumn(table, titleIndex, formula):
+        '''
+        将统计字段整列编码为sketch的输入，枚举类字段只编码词表
+        '''
+        if not formula.numeric and titleIndex in table.vocabs:
+            return formula.encode(table.vocabs[titleIndex])[table.columns[titleIndex]]
+        return formula.encode(table.decode(titleIndex, table.columns[titleIndex]))
+
     def calcProp(self, loan, prop):
         '''
         得到某个客户信息的某条间接属性
-        :param loan: 某条客户的所有交易记录
+        :param loan: 某条客户的所有交易记录，每个字段为一个numpy数组，枚举类字段为代码
         :param prop: 配置信息中要统计的某条间接属性
         :return:
         '''
-        sum, count = 0.0, 0
         formula = prop['formula']
         title = prop['title']
         rules = prop['rules']
 
-        addedElement = []
-        for i in range(len(loan[0])):
-            ruleFlag = True
-            for ruleKey in rules:
-                if not rules[ruleKey] == loan[self.title2index[ruleKey]][i]:
-                    ruleFlag = False
-
-            if ruleFlag:
-                addedElement.append(float(loan[self.title2index[title]][i]))
+        ruleFlags = np.ones(len(loan[0]), dtype=bool)
+        for ruleKey in rules:
+            ruleFlags &= loan[self.title2index[ruleKey]] == self.ruleValues[ruleKey, rules[ruleKey]]
+        addedElement = loan[self.title2index[title]][ruleFlags].astype(float).tolist()
         if len(addedElement) == 0:
             result = 0
         else:
             result = formula(addedElement)
         # if math.isnan(result):
         #     result = 0
-        return result
\ No newline at end of file
+        return result
+
+
+class StreamTransCounter:
+    '''
+    流式统计交易信息：逐批读入交易记录(如CMSBReader.iterTranss的输出)并累计每个客户每条间接属性的和、次数、
+    最小值与最大值，不保留原始交易记录，内存占用只与批大小和客户数有关。
+    逐批调用update(或updateBatches)，最后调用countProp得到与TransCounter相同格式的结果。
+    统计公式支持sum/len/mean/min/max，均值由累计的和与次数求得；基于sketch的统计公式为每个客户保存一个sketch，逐批合并。
+    各进程分别统计部分交易记录后可用merge合并
+    '''
+    formulas = {sum: 'sum', len: 'count', np.sum: 'sum', np.mean: 'mean',
+                min: 'min', max: 'max', np.min: 'min', np.max: 'max'}
+
+    def __init__(self, statDate=None):
+        '''
+        :param statDate: 统计日期，有带window的规则时必须给出
+        '''
+        self.indiTitle2index = {}
+        for i, propKey in enumerate(CounterConfig.countRules):
+            self.indiTitle2index[propKey] = i
+            formula = CounterConfig.countRules[propKey]['formula']
+            if formula not in self.formulas and not isSketch(formula):
+                raise ValueError('formula of %s is not supported when streaming' % propKey)
+            if TransCounter.isWindowed(CounterConfig.countRules[propKey]) and statDate is None:
+                raise ValueError('statDate is required by window of %s when streaming' % propKey)
+        self.stop = toDays(statDate) if statDate is not None else None
+        # 基于sketch的间接属性：间接属性索引 -> {客户内部编号: sketch}
+        self.sketches = dict((i, {}) for propKey, i in self.indiTitle2index.iteritems()
+                             if isSketch(CounterConfig.countRules[propKey]['formula']))
+        self.custNos = []  # 客户号，下标即客户的内部编号
+        self.custNo2id = {}
+        self.sums = np.zeros((len(self.indiTitle2index), 0))
+        self.counts = np.zeros((len(self.indiTitle2index), 0), dtype=np.int64)
+        self.mins = np.zeros((len(self.indiTitle2index), 0))
+        self.maxs = np.zeros((len(self.indiTitle2index), 0))
+
+    def update(self, batch):
+        '''
+        累计一批交易记录
+        :param batch: 一批交易记录(CMSBTable)，格式同TransCounter的输入表
+        '''
+        custIds = self.getCustIds(batch.primKeys.tolist())
+        rowKeyPos = batch.rowKeyPos()
+        rowCustIds = custIds[rowKeyPos]
+        for propKey, i in self.indiTitle2index.iteritems():
+            prop = CounterConfig.countRules[propKey]
+            ruleFlags = np.ones(batch.nRows(), dtype=bool)
+            for ruleKey in prop['rules']:
+                ruleFlags &= batch.equals(ruleKey, prop['rules'][ruleKey])
+            if TransCounter.isWindowed(prop):
+                days = batch.dateColumn(CounterConfig.transDateTitle)
+                ruleFlags &= (days > self.stop - prop['window']) & (days <= self.stop)
+            if i in self.sketches:
+                self.updateSketches(self.sketches[i], prop['formula'], batch, prop['title'], custIds, rowKeyPos, ruleFlags)
+                continue
+            ids = rowCustIds[ruleFlags]
+            values = batch.column(prop['title'])[ruleFlags].astype(float)
+            self.sums[i] += np.bincount(ids, weights=values, minlength=self.sums.shape[1])
+            self.counts[i] += np.bincount(ids, minlength=self.sums.shape[1])
+            if self.formulas[prop['formula']] == 'min':
+                np.minimum.at(self.mins[i], ids, values)
+            elif self.formulas[prop['formula']] == 'max':
+                np.maximum.at(self.maxs[i], ids, values)
+
+    def updateBatches(self, batches):
+        '''
+        依次累计若干批交易记录
+        :param batches: 可迭代的CMSBTable，如CMSBReader.iterTranss的输出
+        :return: self
+        '''
+        for batch in batches:
+            self.update(batch)
+        return self
+
+    def updateSketches(self, sketches, formula, batch, title, custIds, rowKeyPos, ruleFlags):
+        '''
+        将一批交易记录中满足条件的统计值加入各客户的sketch，批内同一客户的记录连续存放
+        '''
+        encoded = TransCounter.encodeColumn(batch, batch.fieldName2Index[title], formula)[ruleFlags]
+        keyPos = rowKeyPos[ruleFlags]
+        if len(keyPos) == 0:
+            return
+        keyPos, starts = np.unique(keyPos, return_index=True)
+        for pos, start, stop in zip(keyPos.tolist(), starts.tolist(), starts[1:].tolist() + [len(encoded)]):
+            custId = custIds[pos]
+            if custId not in sketches:
+                sketches[custId] = formula.newSketch()
+            sketches[custId].update(encoded[start:stop])
+
+    def merge(self, other):
+        '''
+        合并另一个统计器的结果，用于多进程分别统计部分交易记录后汇总
+        :param other: StreamTransCounter
+        :return: self
+        '''
+        custIds = self.getCustIds(other.custNos)
+        nCusts = len(other.custNos)
+        self.sums[:, custIds] += other.sums[:, :nCusts]
+        self.counts[:, custIds] += other.counts[:, :nCusts]
+        self.mins[:, custIds] = np.minimum(self.mins[:, custIds], other.mins[:, :nCusts])
+        self.maxs[:, custIds] = np.maximum(self.maxs[:, custIds], other.maxs[:, :nCusts])
+        for i, sketches in other.sketches.iteritems():
+            for otherId, sketch in sketches.iteritems():
+                custId = custIds[otherId]
+                if custId in self.sketches[i]:
+                    self.sketches[i][custId].merge(sketch)
+                else:
+                    self.sketches[i][custId] = sketch
+        return self
+
+    def getCustIds(self, custNos):
+        '''
+        获取客户的内部编号，新客户分配新编号并扩展累计数组
+        '''
+        custIds = np.empty(len(custNos), dtype=np.int64)
+        for j, custNo in enumerate(custNos):
+            if custNo not in self.custNo2id:
+                self.custNo2id[custNo] = len(self.custNos)
+                self.custNos.append(custNo)
+            custIds[j] = self.custNo2id[custNo]
+        if len(self.custNos) > self.sums.shape[1]:
+            capacity = max(len(self.custNos), 2 * self.sums.shape[1])
+            padding = capacity - self.sums.shape[1]
+            self.sums = np.hstack([self.sums, np.zeros((len(self.sums), padding))])
+            self.counts = np.hstack([self.counts, np.zeros((len(self.counts), padding), dtype=np.int64)])
+            self.mins = np.hstack([self.mins, np.full((len(self.mins), padding), np.inf)])
+            self.maxs = np.hstack([self.maxs, np.full((len(self.maxs), padding), -np.inf)])
+        return custIds
+
+    def countProp(self):
+        '''
+        :return:处理好的交易信息表，格式（{title:index,title2:index2,……}{key:[proA,proB,……}）
+        '''
+        nCusts = len(self.custNos)
+        columns = [None] * len(self.indiTitle2index)
+        for propKey, i in self.indiTitle2index.iteritems():
+            if i in self.sketches:
+                formula, sketches = CounterConfig.countRules[propKey]['formula'], self.sketches[i]
+                # 没有满足条件的交易时没有sketch，结果为0
+                columns[i] = [formula.result(sketches[j]) if j in sketches else 0 for j in range(nCusts)]
+                continue
+            sums, counts = self.sums[i, :nCusts], self.counts[i, :nCusts]
+            formula = self.formulas[CounterConfig.countRules[propKey]['formula']]
+            if formula == 'sum':
+                values = sums.tolist()
+            elif formula == 'count':
+                values = counts.tolist()
+            elif formula == 'min':
+                values = self.mins[i, :nCusts].tolist()
+            elif formula == 'max':
+                values = self.maxs[i, :nCusts].tolist()
+            else:
+                values = (sums / np.maximum(counts, 1)).tolist()
+            # 没有满足条件的交易时结果为0
+            columns[i] = [value if count > 0 else 0 for value, count in zip(values, counts.tolist())]
+        resultDict = dict((custNo, [column[j] for column in columns]) for j, custNo in enumerate(self.custNos))
+        return self.indiTitle2index, resultDict
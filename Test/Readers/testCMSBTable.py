@@ -0,0 +1,90 @@
+# coding: utf-8
+
+import numpy as np
+from OLP.Readers.CMSBTable import CMSBTable, CMSBTableBuilder, slotColumns
+from OLP.Readers.FieldTypes import category, date, Date
+
+
+fieldName2Index = {'协议号': 0, '金额': 1, '标志': 2}
+
+
+def buildTable():
+    builder = CMSBTableBuilder(fieldName2Index, '协议号', chunkSize=2)
+    builder.add(['b', 1.0, True])
+    builder.add(['a', 2.0, False])
+    builder.add(['b', 3.0, False])
+    return builder.build()
+
+
+def testCMSBTableBuilder():
+    table = buildTable()
+    assert table.keys() == ['a', 'b']
+    assert table['b'] == [['b', 'b'], [1.0, 3.0], [True, False]]
+    assert table.counts().tolist() == [1, 2]
+    print table.toDict()
+
+
+def testSlotColumns():
+    # 'a'只在第2个月出现，'b'在第1、3个月出现
+    columns = [np.array(['b', 'a', 'b']), np.array([1.0, 2.0, 3.0]), np.array([True, False, False])]
+    table = slotColumns(fieldName2Index, columns, np.array([0, 1, 2]), 3, 0, ['', 0.0, False])
+    assert table['a'] == [['', 'a', ''], [0.0, 2.0, 0.0], [False, False, False]]
+    assert table['b'] == [['b', '', 'b'], [1.0, 0.0, 3.0], [True, False, False]]
+    assert table.present().tolist() == [False, True, False, True, False, True]
+    assert table.lastRows().tolist() == [1, 5]
+    assert table.monthMatrix('金额').tolist() == [[0.0, 2.0, 0.0], [1.0, 0.0, 3.0]]
+
+
+def testCMSBTableDelete():
+    table = buildTable()
+    del table['a']
+    assert 'a' not in table and len(table) == 1
+    assert table.column('金额').tolist() == [1.0, 3.0]
+    table = buildTable()
+    table = table.selectRows(table.column('金额') > 2.0)
+    assert table.keys() == ['b'] and table['b'][1] == [3.0]
+
+
+def testCategory():
+    builder = CMSBTableBuilder(fieldName2Index, '协议号', columnTypes={2: category})
+    builder.add(['b', 1.0, 'y'])
+    builder.add(['a', 2.0, 'x'])
+    builder.add(['b', 3.0, 'x'])
+    table = builder.build()
+    assert table.vocabs[2].tolist() == ['x', 'y'] and table.column('标志').dtype == np.uint8
+    assert table['b'] == [['b', 'b'], [1.0, 3.0], ['y', 'x']]
+    assert table.equals('标志', 'x').tolist() == [True, False, True]
+    assert table.encode('标志', 'z') == -1 and not table.equals('标志', 'z').any()
+    assert table.categoryCounts('标志')[1].tolist() == [[1, 0], [1, 1]]
+    # 缺失月份的默认值加入词表
+    columns = [np.array(['b', 'a']), np.array([1.0, 2.0]), np.array([1, 0], dtype=np.uint8)]
+    table = slotColumns(fieldName2Index, columns, np.array([0, 1]), 2, 0, ['', 0.0, ''], {2: np.array(['x', 'y'])})
+    assert table['a'] == [['', 'a'], [0.0, 2.0], ['', 'x']]
+    assert table['b'] == [['b', ''], [1.0, 0.0], ['y', '']]
+
+
+def testDate():
+    builder = CMSBTableBuilder(fieldName2Index, '协议号', columnTypes={2: date})
+    builder.add(['a', 1.0, '2014/3/31'])
+    builder.add(['a', 2.0, ''])
+    builder.add(['b', 3.0, '1970/1/2'])
+    table = builder.build()
+    assert table.column('标志').tolist() == [16160, Date.NaT, 1]
+    assert table['a'][2] == ['2014/3/31', ''] and table['b'][2] == ['1970/1/2']
+    # 未按日期类读入的字符串列同样可以取得天数
+    assert CMSBTable.fromDict(fieldName2Index, table.toDict()).dateColumn('标志').tolist() == [16160, Date.NaT, 1]
+
+
+def testCMSBTableFromDict():
+    table = buildTable()
+    assert CMSBTable.fromDict(fieldName2Index, table.toDict()).toDict() == table.toDict()
+
+
+if __name__ == '__main__':
+
+    testCMSBTableBuilder()
+    testSlotColumns()
+    testCMSBTableDelete()
+    testCategory()
+    testDate()
+    testCMSBTableFromDict()
@@ -0,0 +1,74 @@
+# coding: utf-8
+
+import numpy as np
+from OLP.Readers import CounterConfig
+from OLP.Readers.GroupBy import WindowIndex
+from OLP.Readers.CMSBTable import CMSBTableBuilder
+from OLP.Readers.FieldTypes import toDays, Date, category
+from OLP.Readers.TransCounter import TransCounter
+
+
+def testWindowIndex():
+    # 各分组窗口内的和与逐组直接求和相同，前面分组的金额很大时也没有相消误差
+    random = np.random.RandomState(0)
+    nKeys = 50
+    keyPos = random.randint(0, nKeys, 2000)
+    days = toDays('2014/3/31') - random.randint(-5, 120, 2000)
+    days[random.rand(2000) < 0.05] = Date.NaT  # 缺失日期不落入任何窗口
+    values = np.round(random.uniform(1, 1e4, 2000), 2)
+    values[keyPos < 10] *= 1e9
+    flags = random.rand(2000) < 0.7
+    index = WindowIndex(keyPos, nKeys, days)
+    sortedValues = index.sortValues(values, flags)
+    stop = toDays('2014/3/31')
+    for length in (7, 30, 90):
+        sums, counts = index.window(sortedValues, stop, length)
+        for key in range(nKeys):
+            selected = (keyPos == key) & flags & (days > stop - length) & (days <= stop) & (days != Date.NaT)
+            assert counts[key] == selected.sum()
+            expected = sum(values[selected][np.argsort(days[selected], kind='mergesort')].tolist())
+            assert abs(sums[key] - expected) <= 1e-12 * max(abs(expected), 1), (key, sums[key], expected)
+
+
+def buildTranss():
+    # 客户c0没有满足任何筛选条件的交易，c1只满足部分筛选条件
+    fieldName2Index = {'我行客户号': 0, '客户类型': 1, '借贷标志': 2, '折人民币': 3}
+    builder = CMSBTableBuilder(fieldName2Index, '我行客户号', columnTypes={1: category})
+    builder.add(['c0', 'B', False, 5.0])
+    builder.add(['c1', 'A', True, 3.5])
+    builder.add(['c1', 'A', True, -1.25])
+    random = np.random.RandomState(0)
+    for i in range(300):
+        builder.add(['c%d' % random.randint(2, 40), 'ABC'[random.randint(0, 3)], bool(random.randint(0, 2)),
+                     round(random.uniform(-1e4, 1e4), 2)])
+    return fieldName2Index, builder.build()
+
+
+def testCountPropGrouped():
+    # 整表向量化统计与逐客户统计的结果一致，没有满足条件的交易的客户结果为0
+    formulas = [sum, len, np.mean, min, max, np.sum, np.min, np.max]
+    countRules = {}
+    for i, formula in enumerate(formulas):
+        countRules['incomeA%d' % i] = {'formula': formula, 'title': '折人民币', 'rules': {'借贷标志': True, '客户类型': 'A'}}
+        countRules['typeC%d' % i] = {'formula': formula, 'title': '折人民币', 'rules': {'客户类型': 'C'}}
+    oldCountRules = CounterConfig.countRules
+    CounterConfig.countRules = countRules
+    try:
+        fieldName2Index, transs = buildTranss()
+        loopTitle2Index, loopResults = TransCounter((fieldName2Index, transs)).countProp()
+        fieldName2Index, transs = buildTranss()
+        title2Index, results = TransCounter((fieldName2Index, transs), True).countProp()
+    finally:
+        CounterConfig.countRules = oldCountRules
+    assert title2Index == loopTitle2Index and sorted(results) == sorted(loopResults)
+    assert results['c0'] == [0] * len(countRules)
+    assert results['c1'][title2Index['typeC1']] == 0 and results['c1'][title2Index['incomeA4']] == 3.5
+    for custNo, values in loopResults.iteritems():
+        for value, groupedValue in zip(values, results[custNo]):
+            assert abs(value - groupedValue) <= 1e-9 * max(abs(value), 1), (custNo, value, groupedValue)
+
+
+if __name__ == '__main__':
+
+    testWindowIndex()
+    testCountPropGrouped()
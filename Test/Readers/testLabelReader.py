@@ -0,0 +1,72 @@
+# coding: utf-8
+
+import os
+import shutil
+import random
+import tempfile
+from OLP.Readers.CMSBReaders import CMSBReader
+from OLP.Readers.FieldTypes import date
+from OLP.Readers.LabelReader import LabelReader
+
+
+fieldName2fieldType = {
+    '协议号': str,
+    '核心客户号': str,
+    '统计日期': date,
+    '最近欠款日期': date,
+    '上次付款日期': date,
+    '本月应还款日期': date,
+}
+loanFields = ['协议号', '核心客户号', '统计日期', '最近欠款日期', '上次付款日期', '本月应还款日期', '无关']
+horizons = [1, 2, 3, 4]
+
+
+def writeLoans(dirname):
+    # 四个月份的贷款协议文件，部分协议缺少某些月份，部分应还款日期缺失。
+    # 客户cLate只在第三个月份逾期；客户cNaT的应还款日期缺失，最近还款日期虽有值也不判为不良
+    random.seed(0)
+    filenames = []
+    for month in (1, 2, 3, 4):
+        filename = os.path.join(dirname, 'loan%d.txt' % month)
+        with open(filename, 'w') as outFile:
+            outFile.write('\t'.join(loanFields) + '\n')
+            statDate = '2014/%d/28' % month
+            rows = [['pLate', 'cLate', statDate, '0001/1/1', '2014/%d/20' % month, '2014/%d/%d' % (month, 10 if month == 3 else 25)],
+                    ['pNaT', 'cNaT', statDate, '0001/1/1', '2014/%d/20' % month, '']]
+            for i in range(60):
+                if random.random() < 0.2:
+                    continue
+                debtDate = random.choice(['0001/1/1'] * 8 + ['2014/%d/3' % month, '2013/12/3'])
+                shouldRepayDate = random.choice(['', '2014/%d/%d' % (month, random.randint(1, 28))])
+                rows.append(['p%d' % i, 'c%d' % (i % 25), statDate, debtDate, '2014/%d/%d' % (month, random.randint(1, 28)),
+                             shouldRepayDate])
+            for row in rows:
+                outFile.write('\t'.join(row + ['z']) + '\n')
+        filenames.append(filename)
+    return filenames
+
+
+def testReadLabels():
+    # 各标签期限的结果与只读取该期限月数的贷款表打标签的结果相同
+    dirname = tempfile.mkdtemp()
+    try:
+        filenames = writeLoans(dirname)
+        reader = CMSBReader(fieldName2fieldType)
+        fieldNames = LabelReader.fieldNames
+        fieldName2Index, loans, custo2protol = reader.readLoans(filenames, fieldNames)
+        results = LabelReader((fieldName2Index, loans, custo2protol), None).readLabels(horizons)
+        cust2labels = dict(results)
+        assert cust2labels['cLate'] == [0, 0, 1, 1]
+        assert cust2labels['cNaT'] == [0, 0, 0, 0]
+        assert 0 < sum(labels[0] for labels in cust2labels.itervalues()) < len(cust2labels) - 1
+        for i, horizon in enumerate(horizons):
+            fieldName2Index, loans, _ = reader.readLoans(filenames[:horizon], fieldNames)
+            labels = LabelReader((fieldName2Index, loans, custo2protol), None).readLabel()
+            assert labels == [[cust, custLabels[i]] for cust, custLabels in results]
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+
+    testReadLabels()
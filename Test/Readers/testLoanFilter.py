@@ -0,0 +1,111 @@
+# coding: utf-8
+
+import os
+import shutil
+import random
+import tempfile
+import numpy as np
+from OLP.Readers.CMSBReaders import CMSBReader
+from OLP.Readers.FieldTypes import date
+from OLP.Readers.LoanFilter import CustCodeFilter, ThisMonthLoanFilter, FilterEngine, getFilter
+
+
+def _bool(string='0'):
+    return False if string == '0' else True
+
+fieldName2fieldType = {
+    '协议号': str,
+    '核心客户号': str,
+    '统计日期': date,
+    '放款日期': date,
+    '结清标志': _bool,
+    '五级分类代码': str,
+    '剩余本金': float,
+}
+loanFields = ['协议号', '核心客户号', '统计日期', '放款日期', '结清标志', '五级分类代码', '剩余本金', '无关']
+filterNames = [
+    'OLP.Readers.LoanFilter.CleanedLoanFilter',
+    'OLP.Readers.LoanFilter.CustCodeFilter',
+    'OLP.Readers.LoanFilter.ThisMonthLoanFilter',
+]
+
+
+class Code2Filter(CustCodeFilter):
+    # 与CustCodeFilter只差判断用的常量
+    def hitRow(self, record):
+        return record[self.fiveClassificationCode] != '五级分类代码2'
+
+
+class ParamFilter(CustCodeFilter):
+    def __init__(self, code='五级分类代码3'):
+        self.code = code
+
+
+def testFilterKey():
+    # 过滤规则的实现、类属性或构造参数变化时缓存键随之变化，只作缓存的属性不影响缓存键
+    assert CustCodeFilter().getKey() == getFilter('OLP.Readers.LoanFilter.CustCodeFilter').getKey()
+    hitRowKey = Code2Filter().getKey().replace('Code2Filter', 'CustCodeFilter').replace(__name__, 'OLP.Readers.LoanFilter')
+    assert hitRowKey != CustCodeFilter().getKey()
+    assert ParamFilter('五级分类代码2').getKey() != ParamFilter().getKey()
+    filter_ = ThisMonthLoanFilter()
+    key = filter_.getKey()
+    assert filter_.hitRow({'统计日期': '2014/3/31', '放款日期': '2014/3/2'})
+    assert filter_.str2month and filter_.getKey() == key
+
+
+def writeLoans(dirname):
+    # 三个月份的贷款协议文件，部分协议缺少某些月份；协议p0只在中间月份结清，p1只在最后一个月份放款
+    random.seed(0)
+    filenames = []
+    for month in (1, 2, 3):
+        filename = os.path.join(dirname, 'loan%d.txt' % month)
+        with open(filename, 'w') as outFile:
+            outFile.write('\t'.join(loanFields) + '\n')
+            for i in range(40):
+                if i > 1 and random.random() < 0.2:
+                    continue
+                lendingMonth = [12, 3][i] if i < 2 else random.choice([1, 1, 2, 3])
+                cleaned = month == 2 if i == 0 else i > 1 and random.random() < 0.05
+                code = '五级分类代码3' if i < 2 or random.random() < 0.9 else '五级分类代码1'
+                row = ['p%d' % i, 'c%d' % (i % 15), '2014/%d/28' % month, '%d/%d/%d' % (2013 if lendingMonth == 12 else 2014, lendingMonth, random.randint(1, 28)),
+                       '1' if cleaned else '0', code, '%.2f' % random.uniform(1, 1e4), 'z']
+                outFile.write('\t'.join(row) + '\n')
+        filenames.append(filename)
+    return filenames
+
+
+def testFilterEquivalence():
+    # 读表时下推过滤与读表后一次过滤的结果，均与读表后依次调用各过滤器的filter相同
+    dirname = tempfile.mkdtemp()
+    try:
+        filenames = writeLoans(dirname)
+        reader = CMSBReader(fieldName2fieldType)
+        for names in (filterNames, filterNames[:1], filterNames[1:]):
+            title2index, loans, custo2protol = reader.readLoans(filenames)
+            for name in names:
+                title2index, loans, custo2protol = getFilter(name).filter(title2index, loans, custo2protol)
+            protols = loans.primKeys.tolist()
+            assert ('p0' in protols) == (filterNames[0] not in names)  # 只在中间月份命中也删除整个协议
+            assert ('p1' in protols) == (filterNames[2] not in names)
+            results = [FilterEngine.fromNames(names).filter(*reader.readLoans(filenames)),
+                       reader.readLoans(filenames, None, [getFilter(name) for name in names])]
+            for title2index_, loans_, custo2protol_ in results:
+                assert title2index_ == title2index
+                assert loans_.toDict() == loans.toDict()
+                assert custo2protol_ == custo2protol
+    finally:
+        shutil.rmtree(dirname)
+
+
+def testDeleteProtols():
+    # 删除协议后各客户保留的协议号保持原有顺序，协议全部删除的客户保留为空列表
+    custo2protol = {'c1': ['p3', 'p1', 'p2'], 'c2': ['p4'], 'c3': ['p5', 'p6']}
+    FilterEngine.deleteProtols(custo2protol, ['c1', 'c2'], np.array(['p1', 'p4', 'p6']))
+    assert custo2protol == {'c1': ['p3', 'p2'], 'c2': [], 'c3': ['p5', 'p6']}
+
+
+if __name__ == '__main__':
+
+    testFilterKey()
+    testFilterEquivalence()
+    testDeleteProtols()
@@ -0,0 +1,106 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+from OLP.Readers.Pipeline import Pipeline, fingerprint
+from OLP.Readers.CMSBReaders import CMSBReader
+from OLP.Readers.SamplesBuilder import SamplesBuilder
+from OLP.Readers.FieldTypes import date, Date
+
+
+def buildPipeline(cacheDir, calls, scale, parity):
+    pipeline = Pipeline(cacheDir)
+    pipeline.add('source', lambda: calls.append('source') or range(10), params=scale)
+    pipeline.add('scaled', lambda values: calls.append('scaled') or [value * scale for value in values], ['source'], params=scale)
+    pipeline.add('odd', lambda values: calls.append('odd') or [value % 2 for value in values], ['source'], params=parity)
+    pipeline.add('total', lambda scaled, odd: calls.append('total') or sum(scaled) + sum(odd), ['scaled', 'odd'])
+    return pipeline
+
+
+def testPipeline():
+    cacheDir = tempfile.mkdtemp()
+    try:
+        calls = []
+        assert buildPipeline(cacheDir, calls, 2, 0).run('total') == 95
+        assert sorted(calls) == ['odd', 'scaled', 'source', 'total']
+        # 输入与参数都没有变化时全部命中缓存
+        calls = []
+        pipeline = buildPipeline(cacheDir, calls, 2, 0)
+        assert pipeline.run('total') == 95 and calls == []
+        assert pipeline.outputs.keys() == ['total']  # 上游阶段的输出不需要读取
+        print pipeline.report()
+        # 只有参数变化的阶段重新计算
+        calls = []
+        assert buildPipeline(cacheDir, calls, 2, 1).run('total') == 95
+        assert calls == ['odd']  # 输出内容不变，下游仍命中缓存
+        calls = []
+        assert buildPipeline(cacheDir, calls, 3, 0).run('odd') == [0, 1] * 5
+        assert calls == ['source']
+    finally:
+        shutil.rmtree(cacheDir)
+
+
+def doubled(value='0'):
+    return float(value) * 2
+
+
+def runFeatLoans(cacheDir, filenames, amountType):
+    fieldName2fieldType = {'协议号': str, '核心客户号': str, '放款金额': amountType, '统计日期': date}
+    pipeline = Pipeline(cacheDir)
+    SamplesBuilder.addStages(pipeline, 'trn.', CMSBReader(fieldName2fieldType), filenames, filenames, filenames, filenames,
+                             statDate='2014/3/31')
+    fieldName2Index, loans, custNum2ProtolNums = pipeline.run('trn.featLoans')
+    hit = pipeline.records[-1][1]
+    return loans.column('放款金额').tolist(), hit
+
+
+def testFieldTypeChange():
+    # 字段类型变化时读表阶段不能命中缓存
+    cacheDir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(cacheDir, 'loans.txt')
+        with open(filename, 'w') as outFile:
+            outFile.write('协议号\t核心客户号\t放款金额\t统计日期\n')
+            outFile.write('p1\tc1\t100\t2014/3/31\n')
+            outFile.write('p2\tc1\t50.5\t2014/3/31\n')
+        stageDir = os.path.join(cacheDir, 'stages')
+        assert runFeatLoans(stageDir, [filename], float) == ([100.0, 50.5], False)
+        assert runFeatLoans(stageDir, [filename], float) == ([100.0, 50.5], True)
+        assert runFeatLoans(stageDir, [filename], doubled) == ([200.0, 101.0], False)
+    finally:
+        shutil.rmtree(cacheDir)
+
+
+def testTypeFingerprint():
+    # 同名转换函数的逻辑不同、日期分隔符不同时参数的文本表示也不同
+    def halved(value='0'):
+        return float(value) / 2
+    otherHalved = halved
+
+    def halved(value='0'):
+        return float(value) / 3
+    assert otherHalved.__name__ == halved.__name__
+    assert fingerprint({'金额': otherHalved}) != fingerprint({'金额': halved})
+    assert fingerprint({'金额': halved}) == fingerprint({'金额': halved})
+    assert fingerprint({'日期': date}) == fingerprint({'日期': Date('/')})
+    assert fingerprint({'日期': date}) != fingerprint({'日期': Date('-')})
+    assert fingerprint([float, str]) == '[__builtin__.float, __builtin__.str]'
+
+
+def testStatDateRequired():
+    # 不给出统计日期时会统计到特征月份之后的记录，直接报错
+    try:
+        SamplesBuilder.addStages(Pipeline(), 'trn.', CMSBReader({}), [], [], [], [])
+    except ValueError:
+        pass
+    else:
+        assert False, 'statDate should be required'
+
+
+if __name__ == '__main__':
+
+    testPipeline()
+    testFieldTypeChange()
+    testTypeFingerprint()
+    testStatDateRequired()
@@ -0,0 +1,89 @@
+# coding: utf-8
+
+import random
+import numpy as np
+from OLP.Readers.CMSBTable import CMSBTableBuilder
+from OLP.Readers.FieldTypes import date, toDays
+from OLP.Readers.ProdContactCounter import ProdContactCounter, ProdContactIndex, popcount
+
+
+fieldName2Index = {'我行客户号': 0, '零售签约产品代码': 1, '签约时间': 2}
+statDates = ['2014/1/15', '2014/2/28', '2014/3/31', None]
+
+
+def buildContacts():
+    # 100种产品(位图超过一个uint64字)，部分签约时间缺失，同一产品可能重复签约
+    random.seed(0)
+    codes = ['P%03d' % i for i in range(100)]
+    rows = []
+    for i in range(40):
+        for k in range(random.randint(0, 30)):
+            signDate = random.choice(['', '2014/%d/%d' % (random.randint(1, 4), random.randint(1, 28))])
+            rows.append(['c%d' % i, random.choice(codes), signDate])
+    random.shuffle(rows)
+    builder = CMSBTableBuilder(fieldName2Index, '我行客户号', columnTypes={2: date})
+    for row in rows:
+        builder.add(row)
+    return builder.build(), rows, codes
+
+
+def bruteHoldings(rows, statDate):
+    # 逐条签约记录得到各客户持有的产品集合，缺失的签约时间视为早于任何日期
+    custNo2prods = {}
+    for custNo, code, signDate in rows:
+        if statDate is None or signDate == '' or toDays(signDate) <= toDays(statDate):
+            custNo2prods.setdefault(custNo, set()).add(code)
+    return custNo2prods
+
+
+def testPopcount():
+    masks = np.random.RandomState(0).randint(0, 2 ** 62, (20, 3)).astype(np.uint64) << np.uint64(1)
+    masks[0] = np.iinfo(np.uint64).max
+    expected = [sum(bin(int(word)).count('1') for word in row) for row in masks]
+    assert popcount(masks).tolist() == expected
+
+
+def testProdContactIndex():
+    table, rows, codes = buildContacts()
+    index = ProdContactIndex(table)
+    custNos = index.primKeys.tolist()
+    earlier = index.holdingsAsOf('2014/1/31')
+    earlierProds = bruteHoldings(rows, '2014/1/31')
+    allProds = bruteHoldings(rows, None)
+    heldCombo = sorted(max(allProds.itervalues(), key=len))[::4]  # 某客户持有的产品组合，跨两个字
+    combos = [codes[:1], codes[60:70:3], heldCombo, [codes[5], codes[70]], [codes[1], 'unknown']]
+    for statDate in statDates:
+        custNo2prods = bruteHoldings(rows, statDate)
+        holdings = index.holdingsAsOf(statDate)
+        assert holdings.masks.shape == (len(custNos), 2)
+        prods = [custNo2prods.get(custNo, set()) for custNo in custNos]
+        assert holdings.counts().tolist() == [len(prods_) for prods_ in prods]
+        assert index.countAsOf(statDate).tolist() == [len(prods_) for prods_ in prods]
+        for code in codes[::7]:
+            assert holdings.holds(code).tolist() == [code in prods_ for prods_ in prods]
+        for combo in combos:
+            assert holdings.holdsAll(combo).tolist() == [set(combo) <= prods_ for prods_ in prods]
+            assert holdings.holdsAny(combo).tolist() == [len(set(combo) & prods_) > 0 for prods_ in prods]
+        newProds = [prods_ - earlierProds.get(custNo, set()) for custNo, prods_ in zip(custNos, prods)]
+        if statDate is not None and toDays(statDate) >= toDays('2014/1/31'):
+            assert holdings.since(earlier).counts().tolist() == [len(prods_) for prods_ in newProds]
+        for custNo, prods_ in zip(custNos, prods):
+            assert sorted(index.prodsAsOf(custNo, statDate)) == sorted(prods_)
+        assert index.prodsAsOf('unknown', statDate) == []
+
+
+def testProdContactCounter():
+    table, rows, codes = buildContacts()
+    counter = ProdContactCounter((fieldName2Index, table), '2014/3/31')
+    expected = dict((custNo, len(prods)) for custNo, prods in bruteHoldings(rows, '2014/3/31').iteritems())
+    assert counter.countProdContact() == expected
+    results = counter.countProdContacts(statDates[:-1])  # 为None时取构造时的统计日期
+    for statDate, result in zip(statDates[:-1], results):
+        assert result == dict((custNo, len(prods)) for custNo, prods in bruteHoldings(rows, statDate).iteritems())
+
+
+if __name__ == '__main__':
+
+    testPopcount()
+    testProdContactIndex()
+    testProdContactCounter()
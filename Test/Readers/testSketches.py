@@ -0,0 +1,49 @@
+# coding: utf-8
+
+import numpy as np
+from OLP.Readers.Sketches import KLLSketch, HyperLogLog, Quantile, DistinctCount, hashValues
+from OLP.Readers.Pipeline import fingerprint
+
+
+def testQuantile():
+    # 取值个数不超过k时结果精确，按最近秩取值
+    assert Quantile(0.5)([4.0, 1.0, 3.0, 2.0]) == 2.0
+    assert Quantile(0.9)(range(10)) == 8.0
+    values = np.random.RandomState(0).lognormal(10, 2, 20000)
+    whole = KLLSketch()
+    whole.update(values)
+    left, right = KLLSketch(), KLLSketch()
+    left.update(values[:5000])
+    right.update(values[5000:])
+    left.merge(right)
+    for sketch in (whole, left):
+        rank = np.searchsorted(np.sort(values), sketch.quantile(0.5), 'right') / float(len(values))
+        assert abs(rank - 0.5) < 0.01
+        print sketch.quantile(0.5), sketch.size
+
+
+def testDistinctCount():
+    assert DistinctCount()(['a', 'b', 'a']) == 2
+    values = np.array(['bank%d' % i for i in range(10000)])
+    left, right = HyperLogLog(), HyperLogLog()
+    left.update(hashValues(values[:6000]))
+    for value in values[4000:]:
+        right.add(hashValues([value])[0])
+    left.merge(right)
+    assert abs(left.count() - 10000) < 10000 * 0.05
+    print left.count()
+
+
+def testSketchFingerprint():
+    # sketch的参数影响结果，缓存键须随之变化
+    assert Quantile(0.9, k=8)(range(1000)) != Quantile(0.9, k=400)(range(1000))
+    assert fingerprint({'rule': Quantile(0.9, k=8)}) != fingerprint({'rule': Quantile(0.9, k=400)})
+    assert fingerprint({'rule': Quantile(0.9)}) == fingerprint({'rule': Quantile(0.9, k=200)})
+    assert fingerprint({'rule': DistinctCount(10)}) != fingerprint({'rule': DistinctCount(12)})
+
+
+if __name__ == '__main__':
+
+    testQuantile()
+    testDistinctCount()
+    testSketchFingerprint()
@@ -0,0 +1,105 @@
+# coding: utf-8
+
+import os
+import shutil
+import random
+import tempfile
+from OLP.Readers import CounterConfig
+from OLP.Readers.CMSBReaders import CMSBReader
+from OLP.Readers.FieldTypes import category, date
+from OLP.Readers.TransCounter import TransCounter, StreamTransCounter
+from OLP.Readers.ProdContactCounter import ProdContactCounter, StreamProdContactCounter
+
+
+def _bool(string='0'):
+    return False if string == '0' else True
+
+fieldName2fieldType = {
+    '我行客户号': str,
+    '客户类型': category,
+    '借贷标志': _bool,
+    '折人民币': float,
+    '交易日期': date,
+    '对方银行名称': str,
+    '对方是否我行客户': _bool,
+    '交易发生地行政区': category,
+    '交易去向行政区': category,
+    '零售签约产品代码': str,
+    '签约时间': date,
+}
+transFields = ['我行客户号', '客户类型', '借贷标志', '折人民币', '交易日期', '对方银行名称', '对方是否我行客户',
+               '交易发生地行政区', '交易去向行政区', '无关']
+prodFields = ['我行客户号', '零售签约产品代码', '签约时间', '无关']
+
+
+def writeFiles(dirname):
+    # 两个月份的交易流水与产品签约文件，同一客户的记录分布在两个文件中
+    random.seed(0)
+    transFilenames, prodFilenames = [], []
+    for month in (2, 3):
+        transFilename = os.path.join(dirname, 'trans%d.txt' % month)
+        with open(transFilename, 'w') as outFile:
+            outFile.write('\t'.join(transFields) + '\n')
+            for i in range(60):
+                for k in range(random.randint(1, 6)):
+                    row = ['c%d' % i, '客户类型%d' % random.randint(1, 3), random.choice('01'),
+                           '%.2f' % random.uniform(1, 1e4), '2014/%d/%d' % (month, random.randint(1, 28)),
+                           'bank%d' % random.randint(1, 5), random.choice('01'),
+                           'r%d' % random.randint(1, 4), 'r%d' % random.randint(1, 4), 'z']
+                    outFile.write('\t'.join(row) + '\n')
+        transFilenames.append(transFilename)
+        prodFilename = os.path.join(dirname, 'prod%d.txt' % month)
+        with open(prodFilename, 'w') as outFile:
+            outFile.write('\t'.join(prodFields) + '\n')
+            for i in range(60):
+                for k in range(random.randint(0, 3)):
+                    row = ['c%d' % i, 'P%d' % random.randint(1, 8), '2014/%d/%d' % (random.randint(1, 4), random.randint(1, 28)), 'z']
+                    outFile.write('\t'.join(row) + '\n')
+        prodFilenames.append(prodFilename)
+    return transFilenames, prodFilenames
+
+
+def testStreamTransCounter():
+    # 流式统计与整表统计的结果一致，批很小时同一客户的记录分布在多个批中；可选的窗口与sketch规则一并检查
+    dirname = tempfile.mkdtemp()
+    countRules = CounterConfig.countRules
+    CounterConfig.countRules = dict(countRules, **dict(CounterConfig.windowCountRules, **CounterConfig.sketchCountRules))
+    try:
+        transFilenames, prodFilenames = writeFiles(dirname)
+        reader = CMSBReader(fieldName2fieldType)
+        fieldNames = TransCounter.getFieldNames()
+        for statDate in ('2014/3/31', '2014/3/15'):
+            transFieldName2Index, transs = reader.readTranss(transFilenames, fieldNames)
+            countTitle2Index, counts = TransCounter((transFieldName2Index, transs), True, statDate).countProp()
+            streamCountTitle2Index, streamCounts = StreamTransCounter(statDate).updateBatches(
+                reader.iterTranss(transFilenames, batchSize=7, fieldNames=fieldNames)).countProp()
+            assert streamCountTitle2Index == countTitle2Index
+            assert sorted(streamCounts) == sorted(counts)
+            for custNo, values in counts.iteritems():
+                for value, streamValue in zip(values, streamCounts[custNo]):
+                    assert abs(value - streamValue) <= 1e-9 * max(abs(value), 1), (custNo, value, streamValue)
+    finally:
+        CounterConfig.countRules = countRules
+        shutil.rmtree(dirname)
+
+
+def testStreamProdContactCounter():
+    dirname = tempfile.mkdtemp()
+    try:
+        transFilenames, prodFilenames = writeFiles(dirname)
+        reader = CMSBReader(fieldName2fieldType)
+        fieldNames = ProdContactCounter.fieldNames
+        for statDate in ('2014/3/31', '2014/2/10'):
+            prodFieldName2Index, prods = reader.readProds(prodFilenames, fieldNames)
+            counts = ProdContactCounter((prodFieldName2Index, prods), statDate).countProdContact()
+            streamCounts = StreamProdContactCounter(statDate).updateBatches(
+                reader.iterProds(prodFilenames, batchSize=5, fieldNames=fieldNames)).countProdContact()
+            assert streamCounts == counts
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+
+    testStreamTransCounter()
+    testStreamProdContactCounter()